@@ -0,0 +1,294 @@
+import argparse
+import time
+from datetime import date
+from config import (
+    DATABASE_NAME, ANALYTICS_DATABASE, ANALYTICS_SNAPSHOT, ANALYTICS_BATCH_SIZE, AGEING_BUCKETS,
+    SNAPSHOT_PAGES_PER_STEP
+)
+from backup import online_copy
+from connection import connect
+
+# Daily rollups are kept in a separate analytics database. refresh() attaches
+# the clinical database (or a snapshot copy of it) as "src" and folds in only
+# the rows added since the last run, tracked per source table by a row-id
+# watermark, so a refresh costs in proportion to the new rows, never the whole
+# history. Row ids only grow, so each row is counted once; rows archive.py
+# later moves out of the clinical database stay counted in the rollups.
+#
+# Each batch is a deferred transaction: it reads src and writes only the
+# analytics tables, so it takes the analytics database's write lock and never
+# the clinical one. (BEGIN IMMEDIATE would lock every attached database.)
+
+ROLLUP_SCHEMA = [
+    """
+    CREATE TABLE IF NOT EXISTS DailyDoctorAppointments (
+        day TEXT NOT NULL,
+        doctor_id INTEGER NOT NULL,
+        appointments INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (day, doctor_id)
+    ) WITHOUT ROWID
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_daily_doctor ON DailyDoctorAppointments (doctor_id, day)",
+    # Billed amounts are counted on the bill date, collected amounts on the receipt date
+    """
+    CREATE TABLE IF NOT EXISTS DailyRevenue (
+        day TEXT PRIMARY KEY,
+        billed_total REAL NOT NULL DEFAULT 0,
+        bills INTEGER NOT NULL DEFAULT 0,
+        collected_total REAL NOT NULL DEFAULT 0,
+        receipts INTEGER NOT NULL DEFAULT 0
+    )
+    """,
+    # Still-unpaid amounts by the date they were billed, for receivables ageing
+    """
+    CREATE TABLE IF NOT EXISTS OutstandingByBillDate (
+        day TEXT PRIMARY KEY,
+        open_total REAL NOT NULL DEFAULT 0,
+        open_bills INTEGER NOT NULL DEFAULT 0
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS DailyRegistrations (
+        day TEXT PRIMARY KEY,
+        registrations INTEGER NOT NULL DEFAULT 0
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS RollupWatermark (
+        source TEXT PRIMARY KEY,
+        last_id INTEGER NOT NULL
+    )
+    """,
+]
+
+# (source table, id column, statements run per batch with :lo and :hi bound).
+# Billing must come before Receipt so a receipt's bill is always counted first.
+ROLLUPS = [
+    ("Appointment", "appointment_id", [
+        """
+        INSERT INTO DailyDoctorAppointments (day, doctor_id, appointments)
+        SELECT appointment_date, doctor_id, COUNT(*) FROM src.Appointment
+        WHERE appointment_id BETWEEN :lo AND :hi
+        GROUP BY appointment_date, doctor_id
+        ON CONFLICT(day, doctor_id) DO UPDATE SET appointments = appointments + excluded.appointments
+        """,
+    ]),
+    ("Billing", "bill_id", [
+        """
+        INSERT INTO DailyRevenue (day, billed_total, bills)
+        SELECT date, SUM(amount), COUNT(*) FROM src.Billing
+        WHERE bill_id BETWEEN :lo AND :hi
+        GROUP BY date
+        ON CONFLICT(day) DO UPDATE SET
+            billed_total = billed_total + excluded.billed_total, bills = bills + excluded.bills
+        """,
+        """
+        INSERT INTO OutstandingByBillDate (day, open_total, open_bills)
+        SELECT date, SUM(amount), COUNT(*) FROM src.Billing
+        WHERE bill_id BETWEEN :lo AND :hi
+        GROUP BY date
+        ON CONFLICT(day) DO UPDATE SET
+            open_total = open_total + excluded.open_total, open_bills = open_bills + excluded.open_bills
+        """,
+    ]),
+    ("Receipt", "receipt_id", [
+        """
+        INSERT INTO DailyRevenue (day, collected_total, receipts)
+        SELECT R.date, SUM(B.amount), COUNT(*)
+        FROM src.Receipt R JOIN src.Billing B ON B.bill_id = R.bill_id
+        WHERE R.receipt_id BETWEEN :lo AND :hi
+        GROUP BY R.date
+        ON CONFLICT(day) DO UPDATE SET
+            collected_total = collected_total + excluded.collected_total, receipts = receipts + excluded.receipts
+        """,
+        """
+        INSERT INTO OutstandingByBillDate (day, open_total, open_bills)
+        SELECT B.date, -SUM(B.amount), -COUNT(*)
+        FROM src.Receipt R JOIN src.Billing B ON B.bill_id = R.bill_id
+        WHERE R.receipt_id BETWEEN :lo AND :hi
+        GROUP BY B.date
+        ON CONFLICT(day) DO UPDATE SET
+            open_total = open_total + excluded.open_total, open_bills = open_bills + excluded.open_bills
+        """,
+    ]),
+    ("PatientRegistration", "regn_id", [
+        """
+        INSERT INTO DailyRegistrations (day, registrations)
+        SELECT date, COUNT(*) FROM src.PatientRegistration
+        WHERE regn_id BETWEEN :lo AND :hi
+        GROUP BY date
+        ON CONFLICT(day) DO UPDATE SET registrations = registrations + excluded.registrations
+        """,
+    ]),
+]
+
+
+def connect_analytics(database=None):
+    """Opens the analytics database, creating the rollup tables if needed."""
+    conn = connect(database or ANALYTICS_DATABASE)
+    for statement in ROLLUP_SCHEMA:
+        conn.execute(statement)
+    conn.commit()
+    return conn
+
+
+def watermarks(conn):
+    """Returns {source table: last row id folded into the rollups}."""
+    return dict(conn.execute("SELECT source, last_id FROM RollupWatermark"))
+
+
+def refresh(conn, source=None, batch_size=ANALYTICS_BATCH_SIZE, progress=True):
+    """Folds rows added to the source database since the last refresh into the rollups.
+
+    Returns {source table: rows' id range processed}. source is the path of
+    the clinical database or of a snapshot of it.
+    """
+    if conn.in_transaction:
+        conn.commit()
+    conn.execute("ATTACH DATABASE ? AS src", (source or DATABASE_NAME,))
+    try:
+        # One statement, so every high-water mark comes from the same read snapshot
+        targets = conn.execute("SELECT " + ", ".join(
+            f"(SELECT MAX({column}) FROM src.{table})" for table, column, _ in ROLLUPS)).fetchone()
+        done = watermarks(conn)
+        processed = {}
+        for (table, column, statements), hi in zip(ROLLUPS, targets):
+            lo = done.get(table, 0) + 1
+            if hi is None or hi < lo:
+                continue
+            started = time.perf_counter()
+            for batch_lo in range(lo, hi + 1, batch_size):
+                batch_hi = min(batch_lo + batch_size - 1, hi)
+                conn.execute("BEGIN")
+                try:
+                    for sql in statements:
+                        conn.execute(sql, {"lo": batch_lo, "hi": batch_hi})
+                    conn.execute("INSERT OR REPLACE INTO RollupWatermark (source, last_id) VALUES (?, ?)",
+                                 (table, batch_hi))
+                    conn.commit()
+                except Exception:
+                    conn.rollback()
+                    raise
+            processed[table] = (lo, hi)
+            if progress:
+                print(f"  {table}: ids {lo}..{hi} rolled up ({time.perf_counter() - started:.1f}s)")
+        return processed
+    finally:
+        conn.execute("DETACH DATABASE src")
+
+
+def reset(conn):
+    """Empties every rollup and watermark so the next refresh starts from scratch."""
+    for statement in ROLLUP_SCHEMA:
+        if statement.lstrip().startswith("CREATE TABLE"):
+            table = statement.split("EXISTS")[1].split("(")[0].strip()
+            conn.execute(f"DELETE FROM {table}")
+    conn.commit()
+
+
+def take_snapshot(source=None, path=ANALYTICS_SNAPSHOT, pages=SNAPSHOT_PAGES_PER_STEP):
+    """Copies the source database to path with the online backup API. Returns path.
+
+    The copy is taken a few pages at a time from one read snapshot, so it
+    neither blocks clinical writers nor restarts when they commit.
+    """
+    online_copy(path, source, pages)
+    return path
+
+
+# --- Query API ---
+
+def appointments_per_doctor(conn, start, end, doctor_id=None):
+    """Returns (day, doctor_id, appointments) rows for start <= day <= end."""
+    if doctor_id is None:
+        return conn.execute("""
+            SELECT day, doctor_id, appointments FROM DailyDoctorAppointments
+            WHERE day BETWEEN ? AND ? ORDER BY day, doctor_id
+        """, (start, end)).fetchall()
+    return conn.execute("""
+        SELECT day, doctor_id, appointments FROM DailyDoctorAppointments
+        WHERE doctor_id = ? AND day BETWEEN ? AND ? ORDER BY day
+    """, (doctor_id, start, end)).fetchall()
+
+
+def appointments_by_doctor_total(conn, start, end, limit=20):
+    """Returns (doctor_id, appointments) for the busiest doctors over a date range."""
+    return conn.execute("""
+        SELECT doctor_id, SUM(appointments) AS total FROM DailyDoctorAppointments
+        WHERE day BETWEEN ? AND ? GROUP BY doctor_id ORDER BY total DESC LIMIT ?
+    """, (start, end, limit)).fetchall()
+
+
+def revenue_per_day(conn, start, end):
+    """Returns (day, billed_total, bills, collected_total, receipts) rows."""
+    return conn.execute("""
+        SELECT day, billed_total, bills, collected_total, receipts FROM DailyRevenue
+        WHERE day BETWEEN ? AND ? ORDER BY day
+    """, (start, end)).fetchall()
+
+
+def registrations_per_week(conn, start, end):
+    """Returns (week starting Monday, registrations) rows."""
+    return conn.execute("""
+        SELECT date(day, '-6 days', 'weekday 1') AS week, SUM(registrations) FROM DailyRegistrations
+        WHERE day BETWEEN ? AND ? GROUP BY week ORDER BY week
+    """, (start, end)).fetchall()
+
+
+def bucket_labels(buckets=AGEING_BUCKETS):
+    """Labels for the age buckets ending at each edge (in days), plus one for anything older."""
+    return [f"0-{buckets[0]}"] + [f"{lo + 1}-{hi}" for lo, hi in zip(buckets, buckets[1:])] + [f">{buckets[-1]}"]
+
+
+def receivables_ageing(conn, as_of=None, buckets=AGEING_BUCKETS):
+    """Returns (bucket label, outstanding amount, open bills) rows, youngest bucket first."""
+    as_of = date.fromisoformat(as_of) if as_of else date.today()
+    totals = [[label, 0.0, 0] for label in bucket_labels(buckets)]
+    for day, amount, bills in conn.execute(
+            "SELECT day, open_total, open_bills FROM OutstandingByBillDate WHERE open_bills <> 0"):
+        age = (as_of - date.fromisoformat(day)).days
+        index = next((i for i, edge in enumerate(buckets) if age <= edge), len(buckets))
+        totals[index][1] += amount
+        totals[index][2] += bills
+    return [(label, round(amount, 2), bills) for label, amount, bills in totals]
+
+
+if __name__ == "__main__":
+    from datetime import timedelta
+
+    parser = argparse.ArgumentParser(description="Refresh and query the analytics rollups.")
+    parser.add_argument("--snapshot", action="store_true",
+                        help="Copy the clinical database first and roll up from the copy")
+    parser.add_argument("--rebuild", action="store_true", help="Discard the rollups and recompute them")
+    parser.add_argument("--no-refresh", action="store_true", help="Only print the report")
+    parser.add_argument("--days", type=int, default=14, help="Days covered by the report")
+    args = parser.parse_args()
+
+    conn = connect_analytics()
+    if args.rebuild:
+        reset(conn)
+    if not args.no_refresh:
+        source = None
+        if args.snapshot:
+            started = time.perf_counter()
+            source = take_snapshot()
+            print(f"Snapshot written to {source} in {time.perf_counter() - started:.1f}s.")
+        started = time.perf_counter()
+        refresh(conn, source)
+        print(f"Rollups refreshed in {time.perf_counter() - started:.1f}s.")
+
+    end = date.today()
+    start = end - timedelta(days=args.days)
+    print(f"\nRevenue per day ({start} to {end}):")
+    for day, billed, bills, collected, receipts in revenue_per_day(conn, start.isoformat(), end.isoformat()):
+        print(f"  {day}  billed ${billed:>10.2f} ({bills})  collected ${collected:>10.2f} ({receipts})")
+    print("\nBusiest doctors:")
+    for doctor_id, total in appointments_by_doctor_total(conn, start.isoformat(), end.isoformat(), 5):
+        print(f"  Dr. #{doctor_id}: {total} appointments")
+    print("\nNew registrations per week:")
+    for week, count in registrations_per_week(conn, (end - timedelta(days=8 * 7)).isoformat(), end.isoformat()):
+        print(f"  week of {week}: {count}")
+    print("\nReceivables ageing:")
+    for label, amount, bills in receivables_ageing(conn):
+        print(f"  {label:>7} days: ${amount:>12.2f} in {bills} bill(s)")
+    conn.close()
@@ -0,0 +1,480 @@
+import asyncio
+import json
+import secrets
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date
+from http import HTTPStatus
+from urllib.parse import parse_qsl, urlsplit
+from config import (
+    API_HOST, API_PORT, API_WORKERS, API_MAX_PENDING, API_SESSION_TTL, API_SESSION_SWEEP, DATABASE_NAME,
+    PAGE_SIZE, GROUP_COMMIT_ENABLED, METRICS_ENABLED, API_LOG_LEVEL
+)
+from cache import cache_stats
+from connection import connect
+from logs import configure_logging
+from replica import replica_stats, to_prometheus as replica_prometheus
+import db
+import scheduling
+from writer import close_writers, get_writer
+
+MAX_BODY = 1 << 20
+
+
+class ApiError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+
+class DatabaseWorkers:
+    """A bounded thread pool where every worker thread owns one SQLite connection.
+
+    Each job runs as fn(conn) and is committed on success or rolled back on
+    error, so jobs never see each other's open transactions.
+    """
+
+    def __init__(self, database=None, workers=API_WORKERS, max_pending=API_MAX_PENDING):
+        self.database = database or DATABASE_NAME
+        self._local = threading.local()
+        self._executor = ThreadPoolExecutor(workers, thread_name_prefix="hms-db")
+        self.pending = asyncio.Semaphore(max_pending)
+
+    def _connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = connect(self.database)
+        return conn
+
+    def _run(self, fn):
+        conn = self._connection()
+        try:
+            result = fn(conn)
+            conn.commit()
+            return result
+        except BaseException:
+            conn.rollback()
+            raise
+
+    async def run(self, fn):
+        async with self.pending:
+            return await asyncio.get_running_loop().run_in_executor(self._executor, self._run, fn)
+
+    def shutdown(self):
+        self._executor.shutdown(wait=True)
+
+
+class Sessions:
+    """In-memory bearer tokens issued at login."""
+
+    def __init__(self, ttl=API_SESSION_TTL, sweep_every=API_SESSION_SWEEP):
+        self.ttl = ttl
+        self.sweep_every = sweep_every
+        self._tokens = {}
+        self._next_sweep = time.monotonic() + sweep_every
+
+    def create(self, user):
+        now = time.monotonic()
+        if now >= self._next_sweep:
+            self.sweep(now)
+        token = secrets.token_urlsafe(24)
+        self._tokens[token] = (now + self.ttl, user)
+        return token
+
+    def sweep(self, now=None):
+        """Drops every expired token; logins call it every sweep_every seconds. Returns the number dropped."""
+        now = now or time.monotonic()
+        expired = [token for token, (expires, _) in self._tokens.items() if expires < now]
+        for token in expired:
+            del self._tokens[token]
+        self._next_sweep = now + self.sweep_every
+        return len(expired)
+
+    def get(self, token):
+        entry = self._tokens.get(token)
+        if entry is None:
+            return None
+        expires, user = entry
+        if expires < time.monotonic():
+            del self._tokens[token]
+            return None
+        return user
+
+
+# --- Request helpers ---
+
+def _int(params, name, default=None):
+    value = params.get(name, default)
+    if value is None:
+        raise ApiError(HTTPStatus.BAD_REQUEST, f"'{name}' is required.")
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        raise ApiError(HTTPStatus.BAD_REQUEST, f"'{name}' must be an integer.")
+
+
+def _str(params, name):
+    value = params.get(name)
+    if not value:
+        raise ApiError(HTTPStatus.BAD_REQUEST, f"'{name}' is required.")
+    return str(value)
+
+
+def _date(params, name):
+    """A required YYYY-MM-DD parameter; dates are compared and archived as text, so no other form will do."""
+    value = _str(params, name)
+    try:
+        if date.fromisoformat(value).isoformat() == value:
+            return value
+    except ValueError:
+        pass
+    raise ApiError(HTTPStatus.BAD_REQUEST, f"'{name}' must be a YYYY-MM-DD date.")
+
+
+def _require(user, *roles):
+    if user is None:
+        raise ApiError(HTTPStatus.UNAUTHORIZED, "Login required.")
+    if roles and user["role"] not in roles:
+        raise ApiError(HTTPStatus.FORBIDDEN, "Not allowed for this role.")
+
+
+def _patient_scope(user, params):
+    """Patients may only see their own records; staff must name a patient."""
+    _require(user)
+    if user["role"] == "patient":
+        return user["user_id"]
+    return _int(params, "patient_id")
+
+
+def _limit(params):
+    return min(_int(params, "limit", PAGE_SIZE), 500)
+
+
+def _rows(rows):
+    return [row._asdict() for row in rows]
+
+
+class Api:
+    """Routes JSON requests to db.py functions running on the worker pool."""
+
+    def __init__(self, database=None, workers=API_WORKERS):
+        self.workers = DatabaseWorkers(database, workers)
+        self.writer = get_writer(database) if GROUP_COMMIT_ENABLED else None
+        self.sessions = Sessions()
+        self.routes = {
+            ("GET", "/health"): self.health,
+            ("POST", "/login"): self.login,
+            ("GET", "/doctors"): self.doctors,
+            ("GET", "/patients"): self.patients,
+            ("GET", "/users/lookup"): self.lookup,
+            ("GET", "/slots"): self.slots,
+            ("GET", "/appointments"): self.appointments,
+            ("POST", "/appointments"): self.book,
+            ("GET", "/reports"): self.reports,
+            ("POST", "/reports"): self.add_report,
+            ("GET", "/reports/search"): self.search_reports,
+            ("GET", "/bills"): self.bills,
+            ("POST", "/bills"): self.add_bill,
+            ("GET", "/receipts"): self.receipts,
+            ("POST", "/receipts"): self.pay,
+            ("GET", "/balance"): self.balance,
+            ("GET", "/timeline"): self.timeline,
+            ("GET", "/timelines"): self.day_timelines,
+            ("GET", "/schedule"): self.schedule,
+            ("GET", "/stats"): self.stats,
+            ("GET", "/replica"): self.replica,
+            ("GET", "/metrics"): self.metrics,
+        }
+
+    async def write(self, fn):
+        """Runs a write through the group-commit writer if enabled, else on a worker."""
+        if self.writer is None:
+            return await self.workers.run(fn)
+        async with self.workers.pending:
+            return await asyncio.wrap_future(self.writer.submit(fn))
+
+    async def health(self, user, params):
+        return {"status": "ok"}
+
+    async def login(self, user, params):
+        email, password = _str(params, "email"), _str(params, "password")
+        found = await self.workers.run(lambda conn: db.authenticate(conn, email, password))
+        if not found:
+            raise ApiError(HTTPStatus.UNAUTHORIZED, "Invalid email or password.")
+        return dict(found, token=self.sessions.create(found))
+
+    async def doctors(self, user, params):
+        after, limit = _int(params, "after", 0), _limit(params)
+        rows = await self.workers.run(lambda conn: db.get_doctors_page(conn, after, limit))
+        return _rows(rows)
+
+    async def patients(self, user, params):
+        _require(user, "admin", "doctor")
+        after, limit = _int(params, "after", 0), _limit(params)
+        rows = await self.workers.run(lambda conn: db.get_patients_page(conn, after, limit))
+        return _rows(rows)
+
+    async def lookup(self, user, params):
+        _require(user, "admin", "doctor")
+        text, role, limit = _str(params, "q"), params.get("role"), _limit(params)
+        rows = await self.workers.run(lambda conn: db.lookup_users(conn, text, role, limit))
+        return _rows(rows)
+
+    async def slots(self, user, params):
+        spec = _str(params, "specialization")
+        days, limit = _int(params, "days", 7), _limit(params)
+        rows = await self.workers.run(lambda conn: scheduling.find_free_slots(conn, spec, days, limit))
+        return _rows(rows)
+
+    async def appointments(self, user, params):
+        _require(user)
+        after = (_date(params, "after_date"), _int(params, "after_id")) if "after_date" in params else None
+        limit = _limit(params)
+        if user["role"] == "doctor" and "patient_id" not in params:
+            doctor_id = user["user_id"]
+            rows = await self.workers.run(
+                lambda conn: db.get_appointments_by_doctor_page(conn, doctor_id, after, limit))
+            return _rows(rows)
+        patient_id = _patient_scope(user, params)
+        rows = await self.workers.run(
+            lambda conn: db.get_appointments_by_patient_page(conn, patient_id, after, limit))
+        return _rows(rows)
+
+    async def book(self, user, params):
+        patient_id = _patient_scope(user, params)
+        doctor_id, day, hhmm = _int(params, "doctor_id"), _date(params, "date"), _str(params, "time")
+        # Refreshed on a reader so the writer's transaction never reloads the index
+        await self.workers.run(scheduling.slot_index.ensure_current)
+        appointment_id = await self.write(
+            lambda conn: scheduling.book_slot(conn, doctor_id, patient_id, day, hhmm))
+        if appointment_id is None:
+            raise ApiError(HTTPStatus.CONFLICT, "That slot has just been taken.")
+        return {"appointment_id": appointment_id}
+
+    async def reports(self, user, params):
+        patient_id, full = _patient_scope(user, params), params.get("history") == "full"
+        rows = await self.workers.run(lambda conn: db.get_reports_by_patient(conn, patient_id, full))
+        return _rows(rows)
+
+    async def search_reports(self, user, params):
+        _require(user, "doctor", "admin")
+        text, since, limit = _str(params, "q"), params.get("since"), _limit(params)
+        try:
+            rows = await self.workers.run(lambda conn: db.search_reports(conn, text, since, limit))
+        except sqlite3.OperationalError:
+            raise ApiError(HTTPStatus.BAD_REQUEST, "Invalid search syntax.")
+        return _rows(rows)
+
+    async def add_report(self, user, params):
+        _require(user, "doctor")
+        patient_id, day, details = _int(params, "patient_id"), _date(params, "date"), _str(params, "details")
+        report_id = await self.write(
+            lambda conn: db.add_medical_report(conn, details, day, patient_id, user["user_id"]))
+        return {"report_id": report_id}
+
+    async def bills(self, user, params):
+        patient_id = _patient_scope(user, params)
+        if params.get("unpaid"):
+            rows = await self.workers.run(lambda conn: db.get_unpaid_bills_by_patient(conn, patient_id))
+            return _rows(rows)
+        full = params.get("history") == "full"
+        rows = await self.workers.run(lambda conn: db.get_all_bills_by_patient(conn, patient_id, full))
+        return _rows(rows)
+
+    async def add_bill(self, user, params):
+        _require(user, "admin")
+        patient_id, day = _int(params, "patient_id"), _date(params, "date")
+        try:
+            amount = float(params.get("amount"))
+        except (TypeError, ValueError):
+            raise ApiError(HTTPStatus.BAD_REQUEST, "'amount' must be a number.")
+        bill_id = await self.write(
+            lambda conn: db.add_billing(conn, amount, day, patient_id, params.get("details")))
+        return {"bill_id": bill_id}
+
+    async def receipts(self, user, params):
+        patient_id = _patient_scope(user, params)
+        rows = await self.workers.run(lambda conn: db.get_receipts_by_patient(conn, patient_id))
+        return _rows(rows)
+
+    async def pay(self, user, params):
+        _require(user, "patient", "admin")
+        patient_id = _patient_scope(user, params)
+        bill_id, day = _int(params, "bill_id"), _date(params, "date")
+        method = params.get("payment_method") or "Cash"
+
+        def pay_bill(conn):
+            unpaid = {bill.bill_id for bill in db.get_unpaid_bills_by_patient(conn, patient_id)}
+            if bill_id not in unpaid:
+                return False
+            # None means another request paid it first
+            return db.add_receipt(conn, day, bill_id, method) is not None
+
+        if not await self.write(pay_bill):
+            raise ApiError(HTTPStatus.CONFLICT, f"Bill #{bill_id} is not an unpaid bill of this patient.")
+        return {"status": "paid"}
+
+    async def balance(self, user, params):
+        patient_id = _patient_scope(user, params)
+        balance = await self.workers.run(lambda conn: db.get_patient_balance(conn, patient_id))
+        return {"billed": balance.billed_total, "paid": balance.paid_total,
+                "outstanding": balance.outstanding, "open_bills": balance.open_bills}
+
+    async def timeline(self, user, params):
+        patient_id = _patient_scope(user, params)
+        since, full = params.get("since"), params.get("history") == "full"
+        rows = await self.workers.run(lambda conn: db.get_patient_timeline(conn, patient_id, since, full))
+        return _rows(rows)
+
+    async def day_timelines(self, user, params):
+        """Every chart for a doctor's day list in one request (admins name the doctor)."""
+        _require(user, "doctor", "admin")
+        doctor_id = user["user_id"] if user["role"] == "doctor" else _int(params, "doctor_id")
+        day, since, full = _date(params, "date"), params.get("since"), params.get("history") == "full"
+        timelines = await self.workers.run(lambda conn: db.get_day_timelines(conn, doctor_id, day, since, full))
+        return [{"patient_id": patient_id, "events": _rows(events)} for patient_id, events in timelines.items()]
+
+    async def schedule(self, user, params):
+        """A doctor's appointments for a date, or from date to end, in time order (admins name the doctor)."""
+        _require(user, "doctor", "admin")
+        doctor_id = user["user_id"] if user["role"] == "doctor" else _int(params, "doctor_id")
+        day, end = _date(params, "date"), params.get("end")
+        if end:
+            rows = await self.workers.run(lambda conn: db.get_doctor_schedule(conn, doctor_id, day, end))
+        else:
+            rows = await self.workers.run(lambda conn: db.get_day_sheet(conn, doctor_id, day))
+        return _rows(rows)
+
+    async def stats(self, user, params):
+        _require(user, "admin")
+        return cache_stats()
+
+    async def replica(self, user, params):
+        """The read replica's mode, lag and routing counters."""
+        _require(user, "admin")
+        return replica_stats()
+
+    async def metrics(self, user, params):
+        _require(user, "admin")
+        if not METRICS_ENABLED:
+            raise ApiError(HTTPStatus.NOT_FOUND, "Metrics are disabled; start the API with HMS_METRICS=1.")
+        import metrics
+        # Prometheus scrapes ask for format=prometheus and get the text exposition format
+        if params.get("format") == "prometheus":
+            return metrics.to_prometheus() + replica_prometheus()
+        return dict(metrics.snapshot(), replica=replica_stats())
+
+    async def dispatch(self, method, target, headers, body):
+        """Returns (status, payload) for one request."""
+        url = urlsplit(target)
+        handler = self.routes.get((method, url.path))
+        if handler is None:
+            return HTTPStatus.NOT_FOUND, {"error": "Not found."}
+
+        params = dict(parse_qsl(url.query))
+        if body:
+            try:
+                payload = json.loads(body)
+            except ValueError:
+                return HTTPStatus.BAD_REQUEST, {"error": "Body must be JSON."}
+            if not isinstance(payload, dict):
+                return HTTPStatus.BAD_REQUEST, {"error": "Body must be a JSON object."}
+            params.update(payload)
+
+        auth = headers.get("authorization", "")
+        user = self.sessions.get(auth[7:]) if auth.startswith("Bearer ") else None
+        try:
+            return HTTPStatus.OK, await handler(user, params)
+        except ApiError as e:
+            return e.status, {"error": e.message}
+        except ValueError as e:
+            return HTTPStatus.BAD_REQUEST, {"error": str(e)}
+        except sqlite3.IntegrityError as e:
+            return HTTPStatus.CONFLICT, {"error": str(e)}
+
+    async def handle_connection(self, reader, writer):
+        """Serves HTTP/1.1 requests on one connection until the client closes it."""
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                try:
+                    method, target, version = request_line.decode("latin-1").split()
+                except ValueError:
+                    break
+
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+
+                length = headers.get("content-length") or "0"
+                length = int(length) if length.isascii() and length.isdigit() else -1
+                if length < 0:
+                    status, payload = HTTPStatus.BAD_REQUEST, {"error": "Invalid Content-Length."}
+                    body = b""
+                elif length > MAX_BODY:
+                    status, payload = HTTPStatus.REQUEST_ENTITY_TOO_LARGE, {"error": "Body too large."}
+                    body = b""
+                else:
+                    body = await reader.readexactly(length) if length else b""
+                    try:
+                        status, payload = await self.dispatch(method, target, headers, body)
+                    except Exception as e:
+                        status, payload = HTTPStatus.INTERNAL_SERVER_ERROR, {"error": type(e).__name__}
+
+                if isinstance(payload, str):
+                    data, content_type = payload.encode(), "text/plain; version=0.0.4"
+                else:
+                    data, content_type = json.dumps(payload).encode(), "application/json"
+                # After a body that was not read the next request cannot be found, so close
+                keep_alive = (version == "HTTP/1.1" and headers.get("connection", "").lower() != "close"
+                              and 0 <= length <= MAX_BODY)
+                writer.write(
+                    f"HTTP/1.1 {status.value} {status.phrase}\r\n"
+                    f"Content-Type: {content_type}\r\nContent-Length: {len(data)}\r\n"
+                    f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n".encode() + data)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+
+async def serve(host=API_HOST, port=API_PORT, database=None, workers=API_WORKERS):
+    """Runs the API until cancelled."""
+    api = Api(database, workers)
+    server = await asyncio.start_server(api.handle_connection, host, port, backlog=1024)
+    print(f"HMS API listening on http://{host}:{port} ({workers} database workers)")
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        api.workers.shutdown()
+        close_writers()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Serve the hospital database over HTTP/JSON.")
+    parser.add_argument("--host", default=API_HOST)
+    parser.add_argument("--port", type=int, default=API_PORT)
+    parser.add_argument("--workers", type=int, default=API_WORKERS)
+    args = parser.parse_args()
+
+    configure_logging(API_LOG_LEVEL)
+    db.init_db()
+    try:
+        asyncio.run(serve(args.host, args.port, workers=args.workers))
+    except KeyboardInterrupt:
+        pass
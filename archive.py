@@ -0,0 +1,355 @@
+import argparse
+import glob
+import itertools
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from datetime import date, timedelta
+from config import ARCHIVE_DIR, ARCHIVE_AFTER_DAYS, ARCHIVE_BATCH_SIZE
+from records import Bill, PatientAppointment, Report, TimelineEvent
+
+# Appointments, medical reports and paid bills (with their receipts) older
+# than the cutoff move out of the clinical database into one archive file
+# per year, ARCHIVE_DIR/<year>.db, keyed by the row's own date (a receipt
+# follows its bill). Unpaid bills are never archived, whatever their age.
+#
+# Each batch is copied into the archive and committed there first, then
+# deleted from the clinical database in a second transaction. Attached
+# databases in WAL mode do not commit atomically together, so this order
+# means a crash can leave a row in both places (the next run finishes the
+# move, and readers drop the duplicate) but never in neither.
+#
+# Archived reports leave the full-text index, and the ledger keeps their
+# amounts in ArchivedBalance. Refresh the analytics rollups before
+# archiving; the CLI does so when an analytics database exists.
+
+log = logging.getLogger("hms.archive")
+
+ARCHIVE_SCHEMA = [
+    """
+    CREATE TABLE IF NOT EXISTS Appointment (
+        appointment_id INTEGER PRIMARY KEY,
+        appointment_date TEXT NOT NULL,
+        doctor_id INTEGER NOT NULL,
+        patient_id INTEGER NOT NULL,
+        appointment_time TEXT
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_appointment_patient_date ON Appointment (patient_id, appointment_date)",
+    """
+    CREATE TABLE IF NOT EXISTS MedicalReport (
+        report_id INTEGER PRIMARY KEY,
+        report_details TEXT NOT NULL,
+        report_date TEXT NOT NULL,
+        patient_id INTEGER NOT NULL,
+        doctor_id INTEGER NOT NULL
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_report_patient_date ON MedicalReport (patient_id, report_date)",
+    """
+    CREATE TABLE IF NOT EXISTS Billing (
+        bill_id INTEGER PRIMARY KEY,
+        amount REAL NOT NULL,
+        date TEXT NOT NULL,
+        patient_id INTEGER NOT NULL,
+        details TEXT
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_billing_patient_date ON Billing (patient_id, date)",
+    """
+    CREATE TABLE IF NOT EXISTS Receipt (
+        receipt_id INTEGER PRIMARY KEY,
+        date TEXT NOT NULL,
+        bill_id INTEGER UNIQUE NOT NULL,
+        payment_method TEXT
+    )
+    """,
+]
+
+# (table, key, date column, columns copied); a bill's receipt moves with it
+ARCHIVED_TABLES = [
+    ("Appointment", "appointment_id", "appointment_date",
+     "appointment_id, appointment_date, doctor_id, patient_id, appointment_time"),
+    ("MedicalReport", "report_id", "report_date", "report_id, report_details, report_date, patient_id, doctor_id"),
+    ("Billing", "bill_id", "date", "bill_id, amount, date, patient_id, details"),
+]
+_RECEIPT_COLUMNS = "receipt_id, date, bill_id, payment_method"
+_IDS = "(SELECT value FROM json_each(:ids))"
+
+
+def archive_path(year, directory=ARCHIVE_DIR):
+    return os.path.join(directory, f"{year}.db")
+
+
+def archive_years(directory=ARCHIVE_DIR):
+    """Years that have an archive file, oldest first."""
+    names = (os.path.basename(path)[:-3] for path in glob.glob(os.path.join(directory, "*.db")))
+    return sorted(int(name) for name in names if name.isdigit())
+
+
+def default_cutoff(today=None):
+    """Rows dated before this 'YYYY-MM-DD' are archived."""
+    return ((today or date.today()) - timedelta(days=ARCHIVE_AFTER_DAYS)).isoformat()
+
+
+def _create_archive(path):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    conn = sqlite3.connect(path)
+    try:
+        for statement in ARCHIVE_SCHEMA:
+            conn.execute(statement)
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def _candidates(conn, table, key, date_column, cutoff, after, limit):
+    """The next batch of (id, year) rows to archive from table, in id order."""
+    paid_only = "AND EXISTS (SELECT 1 FROM Receipt R WHERE R.bill_id = T.bill_id)" if table == "Billing" else ""
+    return conn.execute(f"""
+        SELECT T.{key}, substr(T.{date_column}, 1, 4)
+        FROM {table} T
+        WHERE T.{key} > ? AND T.{date_column} < ? {paid_only}
+        ORDER BY T.{key}
+        LIMIT ?
+    """, (after, cutoff, limit)).fetchall()
+
+
+def _move(conn, table, key, columns, ids):
+    """Copies rows into the attached 'arch' database, then deletes them from main."""
+    params = {"ids": json.dumps(ids)}
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        conn.execute(f"INSERT OR IGNORE INTO arch.{table} ({columns}) "
+                     f"SELECT {columns} FROM main.{table} WHERE {key} IN {_IDS}", params)
+        if table == "Billing":
+            conn.execute(f"INSERT OR IGNORE INTO arch.Receipt ({_RECEIPT_COLUMNS}) "
+                         f"SELECT {_RECEIPT_COLUMNS} FROM main.Receipt WHERE bill_id IN {_IDS}", params)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+
+    # Only rows now safely in the archive are deleted
+    params = {"ids": json.dumps([row[0] for row in conn.execute(
+        f"SELECT {key} FROM arch.{table} WHERE {key} IN {_IDS}", params)])}
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        if table == "Billing":
+            conn.execute(f"""
+                INSERT INTO ArchivedBalance (patient_id, billed_total, bills)
+                SELECT patient_id, SUM(amount), COUNT(*) FROM main.Billing WHERE bill_id IN {_IDS}
+                GROUP BY patient_id
+                ON CONFLICT(patient_id) DO UPDATE SET
+                    billed_total = billed_total + excluded.billed_total,
+                    bills = bills + excluded.bills
+            """, params)
+            conn.execute(f"DELETE FROM main.Receipt WHERE bill_id IN {_IDS}", params)
+            conn.execute(f"DELETE FROM main.BillStatus WHERE bill_id IN {_IDS}", params)
+        moved = conn.execute(f"DELETE FROM main.{table} WHERE {key} IN {_IDS}", params).rowcount
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return moved
+
+
+def archive(conn, cutoff=None, batch_size=ARCHIVE_BATCH_SIZE, directory=ARCHIVE_DIR):
+    """Moves rows dated before cutoff into the per-year archives, batch by batch.
+
+    Returns {table: rows moved}. Safe to interrupt and re-run.
+    """
+    cutoff = cutoff or default_cutoff()
+    if conn.in_transaction:
+        conn.commit()
+    moved, created = {}, set()
+    for table, key, date_column, columns in ARCHIVED_TABLES:
+        moved[table] = 0
+        after, started = 0, time.perf_counter()
+        for n in itertools.count(1):
+            batch = _candidates(conn, table, key, date_column, cutoff, after, batch_size)
+            if not batch:
+                break
+            after = batch[-1][0]
+            by_year = {}
+            for row_id, year in batch:
+                by_year.setdefault(year, []).append(row_id)
+            for year, ids in sorted(by_year.items()):
+                path = archive_path(year, directory)
+                if path not in created:
+                    _create_archive(path)
+                    created.add(path)
+                conn.execute("ATTACH DATABASE ? AS arch", (path,))
+                try:
+                    moved[table] += _move(conn, table, key, columns, ids)
+                finally:
+                    conn.execute("DETACH DATABASE arch")
+            if n % 20 == 0:
+                log.info(f"  {table}: {moved[table]} rows archived so far ({time.perf_counter() - started:.1f}s)")
+        log.info(f"  {table}: {moved[table]} rows archived ({time.perf_counter() - started:.1f}s)",
+                 extra={"table": table, "rows": moved[table]})
+    return moved
+
+
+def archive_counts(directory=ARCHIVE_DIR):
+    """Returns {year: {table: rows}} for every archive file."""
+    counts = {}
+    for year in archive_years(directory):
+        conn = sqlite3.connect(f"file:{archive_path(year, directory)}?mode=ro", uri=True)
+        try:
+            counts[year] = {table: conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+                            for table in ("Appointment", "MedicalReport", "Billing", "Receipt")}
+        finally:
+            conn.close()
+    return counts
+
+
+# --- Reading archived history ---
+# Each thread keeps read-only connections to the archive files it has used.
+# Archive rows carry IDs only; names are looked up in the clinical database.
+
+_local = threading.local()
+
+
+def _archive_connections(directory=ARCHIVE_DIR):
+    cache = getattr(_local, "connections", None)
+    if cache is None:
+        cache = _local.connections = {}
+    connections = []
+    for year in archive_years(directory):
+        path = archive_path(year, directory)
+        conn = cache.get(path)
+        if conn is None:
+            conn = cache[path] = sqlite3.connect(f"file:{path}?mode=ro", uri=True, check_same_thread=False)
+        connections.append(conn)
+    return connections
+
+
+def _archived(sql, params, directory=ARCHIVE_DIR):
+    rows = []
+    for conn in _archive_connections(directory):
+        rows += conn.execute(sql, params).fetchall()
+    return rows
+
+
+def _names(conn, user_ids):
+    if not user_ids:
+        return {}
+    return dict(conn.execute("SELECT user_id, name FROM User WHERE user_id IN (SELECT value FROM json_each(?))",
+                             (json.dumps(sorted(user_ids)),)))
+
+
+def merge_history(hot_rows, archived_rows, date_index=1):
+    """Archived rows (oldest first) followed by the live ones, dropping any row in both."""
+    live = {row[0] for row in hot_rows}
+    archived = sorted((row for row in archived_rows if row[0] not in live),
+                      key=lambda row: (row[date_index], row[0]))
+    return archived + list(hot_rows)
+
+
+def archived_reports_by_patient(conn, patient_id, directory=ARCHIVE_DIR):
+    """A patient's archived medical reports as Report records."""
+    rows = _archived("SELECT report_id, report_date, report_details, doctor_id FROM MedicalReport "
+                     "WHERE patient_id = ?", (patient_id,), directory)
+    names = _names(conn, {row[3] for row in rows})
+    return [Report(report_id, day, details, names.get(doctor_id)) for report_id, day, details, doctor_id in rows]
+
+
+def archived_bills_by_patient(conn, patient_id, directory=ARCHIVE_DIR):
+    """A patient's archived bills as Bill records; they are all paid."""
+    rows = _archived("SELECT bill_id, date, details, amount FROM Billing WHERE patient_id = ?",
+                     (patient_id,), directory)
+    return [Bill(*row, "Paid") for row in rows]
+
+
+def archived_appointments_by_patient(conn, patient_id, directory=ARCHIVE_DIR):
+    """A patient's archived appointments as PatientAppointment records."""
+    rows = _archived("SELECT appointment_id, appointment_date, doctor_id FROM Appointment WHERE patient_id = ?",
+                     (patient_id,), directory)
+    if not rows:
+        return []
+    doctors = {doctor_id: (name, specialization) for doctor_id, name, specialization in conn.execute("""
+        SELECT D.doctor_id, U.name, D.specialization
+        FROM Doctor D
+        JOIN User U ON U.user_id = D.doctor_id
+        WHERE D.doctor_id IN (SELECT value FROM json_each(?))
+    """, (json.dumps(sorted({row[2] for row in rows})),))}
+    return [PatientAppointment(appointment_id, day, *doctors.get(doctor_id, (None, None)))
+            for appointment_id, day, doctor_id in rows]
+
+
+
+_ARCHIVED_TIMELINE_SQL = """
+    SELECT patient_id, appointment_date, appointment_time, 'appointment', appointment_id, doctor_id,
+           NULL, NULL, NULL
+    FROM Appointment WHERE patient_id IN (SELECT value FROM json_each(:ids)) AND appointment_date >= :since
+    UNION ALL
+    SELECT patient_id, report_date, NULL, 'report', report_id, doctor_id, NULL, report_details, NULL
+    FROM MedicalReport WHERE patient_id IN (SELECT value FROM json_each(:ids)) AND report_date >= :since
+    UNION ALL
+    SELECT patient_id, date, NULL, 'bill', bill_id, NULL, details, 'Paid', amount
+    FROM Billing WHERE patient_id IN (SELECT value FROM json_each(:ids)) AND date >= :since
+    UNION ALL
+    SELECT B.patient_id, R.date, NULL, 'payment', R.receipt_id, NULL, R.payment_method, 'Bill #' || B.bill_id,
+           B.amount
+    FROM Billing B JOIN Receipt R ON R.bill_id = B.bill_id
+    WHERE B.patient_id IN (SELECT value FROM json_each(:ids)) AND R.date >= :since
+"""
+
+
+def archived_timelines(conn, patient_ids, since=None, directory=ARCHIVE_DIR):
+    """Archived events of many patients as {patient_id: [TimelineEvent, ...]}, unordered.
+
+    One query per archive file, however many patients are asked for.
+    """
+    rows = _archived(_ARCHIVED_TIMELINE_SQL, {"ids": json.dumps(list(patient_ids)), "since": since or ""}, directory)
+    doctor_ids = sorted({row[5] for row in rows if row[5] is not None})
+    doctors = {doctor_id: (name, specialization) for doctor_id, name, specialization in conn.execute("""
+        SELECT D.doctor_id, U.name, D.specialization
+        FROM Doctor D
+        JOIN User U ON U.user_id = D.doctor_id
+        WHERE D.doctor_id IN (SELECT value FROM json_each(?))
+    """, (json.dumps(doctor_ids),))} if doctor_ids else {}
+
+    timelines = {}
+    for patient_id, day, hhmm, kind, event_id, doctor_id, title, detail, amount in rows:
+        if doctor_id is not None:
+            # Appointments and reports show the doctor; appointments also the specialization
+            title, specialization = doctors.get(doctor_id, (None, None))
+            if kind == "appointment":
+                detail = specialization
+        event = TimelineEvent(patient_id, day, hhmm, kind, event_id, title, detail, amount)
+        timelines.setdefault(patient_id, []).append(event)
+    return timelines
+
+if __name__ == "__main__":
+    from config import ANALYTICS_DATABASE
+    from connection import get_connection
+    from db import init_db
+    from logs import configure_logging
+
+    parser = argparse.ArgumentParser(description="Move old appointments, reports and paid bills to yearly archives.")
+    parser.add_argument("--before", help="Archive rows dated before YYYY-MM-DD "
+                                         f"(default: {ARCHIVE_AFTER_DAYS} days ago)")
+    parser.add_argument("--batch-size", type=int, default=ARCHIVE_BATCH_SIZE)
+    parser.add_argument("--status", action="store_true", help="Show what each archive file holds")
+    args = parser.parse_args()
+
+    configure_logging()
+    init_db()
+    if args.status:
+        for year, counts in archive_counts().items():
+            print(f"{year}: " + ", ".join(f"{table} {n}" for table, n in counts.items()))
+    else:
+        if os.path.exists(ANALYTICS_DATABASE):
+            # Rows archived before they are rolled up would never be counted
+            import analytics
+            rollups = analytics.connect_analytics()
+            analytics.refresh(rollups, progress=False)
+            rollups.close()
+        with get_connection() as conn:
+            moved = archive(conn, args.before, args.batch_size)
+        print("Archived " + ", ".join(f"{n} {table}" for table, n in moved.items()) + f" into {ARCHIVE_DIR}.")
@@ -0,0 +1,379 @@
+import argparse
+import gzip
+import hashlib
+import json
+import logging
+import os
+import shutil
+import sqlite3
+import sys
+import threading
+import time
+from datetime import datetime
+from config import (
+    DATABASE_NAME, BACKUP_DIR, BACKUP_PAGES_PER_STEP, BACKUP_STEP_SLEEP_MS, BACKUP_COMPRESS_LEVEL,
+    BACKUP_KEEP
+)
+from connection import connect
+
+# Online backups of the clinical database with the SQLite backup API, taken
+# while the menus and the API keep writing.
+#
+# The copy runs a few pages per step, but inside one read transaction on the
+# source. Without it, any commit from another connection restarts the backup
+# from page one, and under steady writes it never finishes. In WAL mode that
+# read transaction blocks no writer; the WAL just cannot be checkpointed past
+# it until the copy is done.
+#
+# Each backup is a standalone rollback-journal file (optionally gzipped) with
+# a JSON manifest next to it holding its SHA-256, page count and schema
+# version. restore() streams a backup into place and swaps it in atomically.
+
+log = logging.getLogger("hms.backup")
+
+CHUNK = 1 << 20
+GZIP_MAGIC = b"\x1f\x8b"
+
+
+def online_copy(path, source=None, pages=BACKUP_PAGES_PER_STEP, sleep_ms=BACKUP_STEP_SLEEP_MS, progress=None):
+    """Copies the source database to path as of one point in time. Returns pages copied.
+
+    progress, if given, is called as progress(remaining, total) after every step.
+    """
+    src = connect(source)
+    dst = sqlite3.connect(path)
+    try:
+        # Pin one snapshot of the source for the whole copy
+        src.execute("BEGIN")
+        src.execute("SELECT COUNT(*) FROM sqlite_master").fetchone()
+        total = [0]
+
+        def step(status, remaining, count):
+            total[0] = count
+            if progress:
+                progress(remaining, count)
+
+        src.backup(dst, pages=pages, progress=step, sleep=sleep_ms / 1000)
+        src.rollback()
+        # The copy inherits WAL mode; a backup should be a single self-contained file
+        dst.execute("PRAGMA journal_mode = DELETE")
+        return total[0]
+    finally:
+        dst.close()
+        src.close()
+
+
+def default_path(compress=False, directory=BACKUP_DIR):
+    """Returns BACKUP_DIR/<database>-<timestamp>.db, with .gz when compressed."""
+    stem = os.path.splitext(os.path.basename(DATABASE_NAME))[0]
+    name = f"{stem}-{datetime.now():%Y%m%d-%H%M%S}.db" + (".gz" if compress else "")
+    return os.path.join(directory, name)
+
+
+def _check(path, full=False):
+    """Runs quick_check (or the much slower integrity_check) on a database file.
+
+    Returns "ok" or the first problems found.
+    """
+    conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+    try:
+        rows = conn.execute(f"PRAGMA {'integrity_check' if full else 'quick_check'}(20)").fetchall()
+        return "ok" if rows == [("ok",)] else "; ".join(row[0] for row in rows)
+    finally:
+        conn.close()
+
+
+def _describe(path):
+    """Returns (user_version, page_count, page_size) of a database file."""
+    conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+    try:
+        return tuple(conn.execute(f"PRAGMA {pragma}").fetchone()[0]
+                     for pragma in ("user_version", "page_count", "page_size"))
+    finally:
+        conn.close()
+
+
+def _copy_stream(src, dst=None):
+    """Copies src to dst (or just reads it) in CHUNK-sized reads. Returns (bytes, sha256 hex digest)."""
+    digest, size = hashlib.sha256(), 0
+    while True:
+        chunk = src.read(CHUNK)
+        if not chunk:
+            return size, digest.hexdigest()
+        digest.update(chunk)
+        if dst is not None:
+            dst.write(chunk)
+        size += len(chunk)
+
+
+def backup(path=None, source=None, compress=False, check="quick", pages=BACKUP_PAGES_PER_STEP,
+           sleep_ms=BACKUP_STEP_SLEEP_MS, level=BACKUP_COMPRESS_LEVEL):
+    """Takes an online backup to path ("-" streams gzip to stdout). Returns its manifest.
+
+    check is "quick" (quick_check), "full" (integrity_check, which also
+    cross-checks every index and takes ten times as long) or None. The copy
+    is checked before it is published, and the manifest is written to
+    path + ".json" (except when streaming).
+    """
+    streaming = path == "-"
+    compress = compress or streaming or bool(path and path.endswith(".gz"))
+    path = path or default_path(compress)
+    workdir = BACKUP_DIR if streaming else os.path.dirname(os.path.abspath(path))
+    os.makedirs(workdir, exist_ok=True)
+    # An uncompressed backup is copied straight into place; others need a scratch copy first
+    raw = os.path.join(workdir, f".backup-{os.getpid()}.db") if compress else path + ".part"
+
+    started = time.perf_counter()
+    try:
+        online_copy(raw, source, pages, sleep_ms)
+        copied = time.perf_counter() - started
+        version, page_count, page_size = _describe(raw)
+        integrity = _check(raw, full=check == "full") if check else None
+        if integrity not in (None, "ok"):
+            raise RuntimeError(f"Backup copy failed {check} check: {integrity}")
+
+        with open(raw, "rb") as f:
+            if streaming:
+                with gzip.GzipFile(fileobj=sys.stdout.buffer, mode="wb", compresslevel=level, mtime=0) as out:
+                    size, sha256 = _copy_stream(f, out)
+            elif compress:
+                part = path + ".part"
+                with gzip.open(part, "wb", compresslevel=level) as out:
+                    size, sha256 = _copy_stream(f, out)
+                os.replace(part, path)
+            else:
+                size, sha256 = _copy_stream(f)
+        if not compress:
+            os.replace(raw, path)
+    finally:
+        for name in (raw, path + ".part"):
+            if os.path.exists(name):
+                os.remove(name)
+
+    elapsed = time.perf_counter() - started
+    manifest = {
+        "source": os.path.abspath(source or DATABASE_NAME),
+        "created": datetime.now().isoformat(timespec="seconds"),
+        "bytes": size,
+        "sha256": sha256,
+        "pages": page_count,
+        "page_size": page_size,
+        "user_version": version,
+        "compressed": compress,
+        "integrity": integrity,
+        "copy_seconds": round(copied, 3),
+        "seconds": round(elapsed, 3),
+        "mb_per_sec": round(size / 1e6 / elapsed, 1) if elapsed else None,
+    }
+    if not streaming:
+        manifest["path"] = os.path.abspath(path)
+        manifest["file_bytes"] = os.path.getsize(path)
+        with open(path + ".json", "w") as f:
+            json.dump(manifest, f, indent=2)
+    log.info(f"Backed up {size / 1e6:.1f} MB in {elapsed:.2f}s ({manifest['mb_per_sec']} MB/s)",
+             extra={key: manifest[key] for key in ("bytes", "sha256", "seconds", "mb_per_sec")})
+    return manifest
+
+
+def _manifest(path):
+    try:
+        with open(path + ".json") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _is_gzip(path):
+    with open(path, "rb") as f:
+        return f.read(2) == GZIP_MAGIC
+
+
+def _open_backup(path):
+    """Opens a backup file (or "-" for stdin), transparently un-gzipping it."""
+    if path != "-":
+        return gzip.open(path, "rb") if _is_gzip(path) else open(path, "rb")
+    # stdin cannot seek, so peek at the header instead
+    f = sys.stdin.buffer
+    return gzip.GzipFile(fileobj=f, mode="rb") if f.peek(2)[:2] == GZIP_MAGIC else f
+
+
+def _unpack(path, dst_path):
+    """Writes the database held in a backup file to dst_path and fsyncs it. Returns (bytes, sha256)."""
+    src = _open_backup(path)
+    try:
+        with open(dst_path, "wb") as dst:
+            result = _copy_stream(src, dst)
+            dst.flush()
+            os.fsync(dst.fileno())
+        return result
+    finally:
+        if src is not sys.stdin.buffer:
+            src.close()
+
+
+def verify_backup(path, full=False):
+    """Checks a backup against its manifest and with integrity_check (or quick_check). Returns a report dict."""
+    manifest = _manifest(path)
+    scratch = os.path.join(os.path.dirname(os.path.abspath(path)), f".verify-{os.getpid()}.db")
+    try:
+        size, sha256 = _unpack(path, scratch)
+        report = {"path": path, "bytes": size, "sha256": sha256, "integrity": _check(scratch, full)}
+        report["user_version"] = _describe(scratch)[0]
+    finally:
+        if os.path.exists(scratch):
+            os.remove(scratch)
+    report["manifest"] = manifest is not None
+    report["checksum_ok"] = manifest is None or manifest["sha256"] == sha256
+    report["ok"] = report["checksum_ok"] and report["integrity"] == "ok"
+    return report
+
+
+def restore(path, target=None, verify=True, force=False):
+    """Replaces target (the configured database by default) with the database in a backup.
+
+    The backup is unpacked next to target, checked, fsynced and renamed over
+    it, so a failure at any point leaves the old file untouched. Stop the
+    menus and the API first; their open connections would keep using the
+    replaced file. Returns a report dict.
+    """
+    target = target or DATABASE_NAME
+    if os.path.exists(target) and not force:
+        raise FileExistsError(f"'{target}' exists; pass force=True (--force) to replace it.")
+    wal = target + "-wal"
+    if os.path.exists(wal) and os.path.getsize(wal) and not force:
+        raise RuntimeError(f"'{target}' looks open (non-empty {wal}); stop the application first.")
+
+    started = time.perf_counter()
+    part = target + ".restore"
+    manifest = _manifest(path) if path != "-" else None
+    try:
+        if path != "-" and not verify and not _is_gzip(path):
+            # Uncompressed and unchecked: let the kernel copy it (copy_file_range/sendfile)
+            shutil.copyfile(path, part)
+            size, sha256 = os.path.getsize(part), None
+        else:
+            size, sha256 = _unpack(path, part)
+        if verify:
+            if manifest and manifest["sha256"] != sha256:
+                raise RuntimeError(f"Checksum mismatch: manifest {manifest['sha256']}, backup {sha256}")
+            integrity = _check(part)
+            if integrity != "ok":
+                raise RuntimeError(f"Restored copy failed quick_check: {integrity}")
+        for stale in (wal, target + "-shm"):
+            if os.path.exists(stale):
+                os.remove(stale)
+        os.replace(part, target)
+    finally:
+        if os.path.exists(part):
+            os.remove(part)
+
+    elapsed = time.perf_counter() - started
+    log.info(f"Restored {size / 1e6:.1f} MB into {target} in {elapsed:.2f}s",
+             extra={"target": target, "bytes": size, "seconds": round(elapsed, 3)})
+    return {"target": target, "bytes": size, "seconds": round(elapsed, 3),
+            "mb_per_sec": round(size / 1e6 / elapsed, 1) if elapsed else None}
+
+
+def list_backups(directory=BACKUP_DIR):
+    """Returns the backup files in directory, oldest first."""
+    if not os.path.isdir(directory):
+        return []
+    return sorted(os.path.join(directory, name) for name in os.listdir(directory)
+                  if name.endswith((".db", ".db.gz")) and not name.startswith("."))
+
+
+def prune(keep=BACKUP_KEEP, directory=BACKUP_DIR):
+    """Deletes all but the newest keep backups and their manifests. Returns the paths removed."""
+    removed = list_backups(directory)[:-keep] if keep > 0 else list_backups(directory)
+    for path in removed:
+        for name in (path, path + ".json"):
+            if os.path.exists(name):
+                os.remove(name)
+    return removed
+
+
+# --- Write-stall measurement ---
+
+def measure_stall(source=None, compress=False, path=None, interval_ms=2):
+    """Takes a backup while a thread keeps committing small writes. Returns latency stats.
+
+    Each probe write is an UPDATE that leaves LedgerTotals as it was, so the
+    data is untouched; its commit latency is measured for a few seconds
+    before the backup (baseline) and for the whole backup.
+    """
+    stop = threading.Event()
+    samples, phase = {"baseline": [], "backup": []}, ["baseline"]
+
+    def writer():
+        conn = connect(source)
+        try:
+            while not stop.is_set():
+                started = time.perf_counter()
+                conn.execute("BEGIN IMMEDIATE")
+                conn.execute("UPDATE LedgerTotals SET open_bills = open_bills WHERE id = 1")
+                conn.commit()
+                samples[phase[0]].append((time.perf_counter() - started) * 1000)
+                time.sleep(interval_ms / 1000)
+        finally:
+            conn.close()
+
+    thread = threading.Thread(target=writer, daemon=True)
+    thread.start()
+    time.sleep(2)
+    phase[0] = "backup"
+    manifest = backup(path, source, compress)
+    stop.set()
+    thread.join()
+
+    def summary(values):
+        values = sorted(values) or [0.0]
+        return {"writes": len(values), "p50_ms": round(values[len(values) // 2], 2),
+                "p99_ms": round(values[min(len(values) - 1, int(len(values) * 0.99))], 2),
+                "max_ms": round(values[-1], 2)}
+
+    return {"backup": manifest, "baseline_writes": summary(samples["baseline"]),
+            "writes_during_backup": summary(samples["backup"])}
+
+
+if __name__ == "__main__":
+    from logs import configure_logging
+
+    parser = argparse.ArgumentParser(description="Back up, verify and restore the clinical database.")
+    parser.add_argument("--output", "-o", help=f"Backup file, or - for a gzip stream on stdout "
+                                               f"(default: a timestamped file in {BACKUP_DIR})")
+    parser.add_argument("--compress", "-z", action="store_true", help="gzip the backup")
+    parser.add_argument("--check", choices=("quick", "full", "none"), default="quick",
+                        help="How to check a new backup: quick_check, integrity_check or not at all")
+    parser.add_argument("--no-verify", action="store_true", help="Skip the checksum and quick_check on --restore")
+    parser.add_argument("--verify", metavar="BACKUP", help="Check a backup file and exit")
+    parser.add_argument("--restore", metavar="BACKUP", help="Replace the database with a backup (- reads stdin)")
+    parser.add_argument("--target", help="Database file to restore into (default: the configured one)")
+    parser.add_argument("--force", action="store_true", help="Allow --restore to replace an existing (even open) file")
+    parser.add_argument("--list", action="store_true", help=f"List the backups in {BACKUP_DIR}")
+    parser.add_argument("--prune", action="store_true", help=f"Keep only the newest {BACKUP_KEEP} backups")
+    parser.add_argument("--measure-stall", action="store_true",
+                        help="Back up while timing concurrent writes, and report the longest stall")
+    args = parser.parse_args()
+
+    # Progress goes to stderr so a backup can be streamed to stdout
+    configure_logging(stream=sys.stderr)
+    if args.verify:
+        report = verify_backup(args.verify, full=args.check == "full")
+        print(json.dumps(report, indent=2))
+        sys.exit(0 if report["ok"] else 1)
+    elif args.restore:
+        print(json.dumps(restore(args.restore, args.target, not args.no_verify, args.force), indent=2))
+    elif args.list:
+        for path in list_backups():
+            manifest = _manifest(path) or {}
+            print(f"{path}  {os.path.getsize(path) / 1e6:>9.1f} MB  v{manifest.get('user_version', '?')}  "
+                  f"{manifest.get('created', '')}")
+    elif args.measure_stall:
+        print(json.dumps(measure_stall(compress=args.compress, path=args.output), indent=2))
+    else:
+        manifest = backup(args.output, compress=args.compress, check=None if args.check == "none" else args.check)
+        if args.output != "-":
+            print(json.dumps(manifest, indent=2))
+        if args.prune:
+            for path in prune():
+                log.info(f"Removed old backup {path}")
@@ -0,0 +1,333 @@
+import argparse
+import contextlib
+import inspect
+import io
+import json
+import os
+import random
+import sqlite3
+import sys
+import time
+from datetime import datetime, timedelta
+
+DEFAULT_ITERATIONS = 200
+DEFAULT_BUDGET = 5.0          # Max seconds spent on any one function
+REGRESSION_TOLERANCE = 0.25   # Allowed p95 slowdown before --compare fails
+MIN_REGRESSION_MS = 0.05      # Ignore slowdowns smaller than timer noise
+
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, int(round(pct / 100.0 * len(sorted_values))))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+def summarize(latencies, rows=0):
+    """Turns per-call latencies (seconds) into the baseline's summary fields."""
+    latencies = sorted(latencies)
+    total = sum(latencies)
+    return {
+        "calls": len(latencies),
+        "p50_ms": round(percentile(latencies, 50) * 1000, 4),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 4),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 4),
+        "rows_per_sec": round(rows / total, 1) if total else 0.0,
+    }
+
+
+def measure(call, iterations=DEFAULT_ITERATIONS, budget=DEFAULT_BUDGET, prepare=None):
+    """Calls call() up to iterations times (or until budget seconds pass).
+
+    If prepare is given it runs untimed before each call and its return value
+    is passed as call's arguments. Returns the summary dict; rows counts the
+    lengths of list results.
+    """
+    latencies = []
+    rows = 0
+    deadline = time.perf_counter() + budget
+    for _ in range(iterations):
+        args = prepare() if prepare else ()
+        start = time.perf_counter()
+        result = call(*args)
+        latencies.append(time.perf_counter() - start)
+        if isinstance(result, list):
+            rows += len(result)
+        elif result is not None:
+            rows += 1
+        if time.perf_counter() > deadline:
+            break
+    return summarize(latencies, rows)
+
+
+def _sample_ids(conn, table, column, rng, count=200):
+    """Picks existing ids spread across the table's id range."""
+    lo, hi = conn.execute(f"SELECT MIN({column}), MAX({column}) FROM {table}").fetchone()
+    if lo is None:
+        return [0]
+    ids = []
+    for _ in range(count):
+        row = conn.execute(f"SELECT {column} FROM {table} WHERE {column} >= ? LIMIT 1",
+                           (rng.randint(lo, hi),)).fetchone()
+        ids.append(row[0])
+    return ids
+
+
+def benchmark_cases(conn, rng):
+    """Returns {db function name: call or (prepare, call)} covering every public db.py function."""
+    import db
+
+    doctors = _sample_ids(conn, "Doctor", "doctor_id", rng)
+    patients = _sample_ids(conn, "Patient", "patient_id", rng)
+    users = conn.execute("SELECT email FROM User WHERE user_id IN ({})".format(
+        ",".join(str(i) for i in patients + doctors))).fetchall() or [("nobody@example.com",)]
+    today = datetime.now().strftime("%Y-%m-%d")
+    counter = iter(range(1, 1 << 62))
+    # (doctor, day) pairs that have appointments, for the day-list timelines
+    doctor_days = [conn.execute("SELECT doctor_id, appointment_date FROM Appointment WHERE appointment_id = ?",
+                                (appointment_id,)).fetchone() or (0, today)
+                   for appointment_id in _sample_ids(conn, "Appointment", "appointment_id", rng, 50)]
+
+    def new_patient():
+        c = conn.execute("INSERT INTO User (name, email, password, role) VALUES (?, ?, ?, 'patient')",
+                         ("Bench Patient", f"bench-p{next(counter)}@example.com", "pass123"))
+        conn.execute("INSERT INTO Patient (patient_id) VALUES (?)", (c.lastrowid,))
+        return (c.lastrowid,)
+
+    def week(doctor_day):
+        doctor_id, day = doctor_day
+        return doctor_id, day, (datetime.strptime(day, "%Y-%m-%d") + timedelta(days=6)).strftime("%Y-%m-%d")
+
+    def new_bill():
+        c = conn.execute("INSERT INTO Billing (amount, date, patient_id) VALUES (10.0, ?, ?)",
+                         (today, rng.choice(patients)))
+        return (c.lastrowid,)
+
+    return {
+        "init_db": db.init_db,
+        "get_user_by_email": lambda: db.get_user_by_email(conn, rng.choice(users)[0]),
+        # Generated users all share the password "pass123"; repeated logins hit the verification cache
+        "login": lambda: db.login(rng.choice(users)[0], "pass123"),
+        "authenticate": lambda: db.authenticate(conn, rng.choice(users)[0], "pass123"),
+        "get_doctors": lambda: db.get_doctors(conn),
+        "get_patients": lambda: db.get_patients(conn),
+        "get_specializations": lambda: db.get_specializations(conn),
+        "get_doctors_by_specialization": lambda: db.get_doctors_by_specialization(conn, "Cardiology"),
+        "get_doctors_page": lambda: db.get_doctors_page(conn, rng.choice(doctors)),
+        "get_patients_page": lambda: db.get_patients_page(conn, rng.choice(patients)),
+        "get_appointments_by_doctor_page": lambda: db.get_appointments_by_doctor_page(conn, rng.choice(doctors)),
+        "get_appointments_by_patient_page": lambda: db.get_appointments_by_patient_page(conn, rng.choice(patients)),
+        "iter_doctors": lambda: list(db.iter_doctors(conn)),
+        "iter_patients": lambda: list(db.iter_patients(conn)),
+        "iter_appointments_by_doctor": lambda: list(db.iter_appointments_by_doctor(conn, rng.choice(doctors))),
+        "iter_appointments_by_patient": lambda: list(db.iter_appointments_by_patient(conn, rng.choice(patients))),
+        "get_appointments_by_doctor": lambda: db.get_appointments_by_doctor(conn, rng.choice(doctors)),
+        "get_appointments_by_patient": lambda: db.get_appointments_by_patient(conn, rng.choice(patients)),
+        "get_reports_by_patient": lambda: db.get_reports_by_patient(conn, rng.choice(patients)),
+        "get_unpaid_bills_by_patient": lambda: db.get_unpaid_bills_by_patient(conn, rng.choice(patients)),
+        "get_all_bills_by_patient": lambda: db.get_all_bills_by_patient(conn, rng.choice(patients)),
+        "get_all_bills_by_patient(full_history)":
+            lambda: db.get_all_bills_by_patient(conn, rng.choice(patients), True),
+        "get_reports_by_patient(full_history)": lambda: db.get_reports_by_patient(conn, rng.choice(patients), True),
+        "get_receipts_by_patient": lambda: db.get_receipts_by_patient(conn, rng.choice(patients)),
+        "get_open_bill_columns": lambda: db.get_open_bill_columns(conn),
+        "iter_open_bill_columns": lambda: next(db.iter_open_bill_columns(conn), None),
+        "get_patient_timeline": lambda: db.get_patient_timeline(conn, rng.choice(patients)),
+        "get_patient_timeline(full_history)":
+            lambda: db.get_patient_timeline(conn, rng.choice(patients), full_history=True),
+        "get_timelines": lambda: db.get_timelines(conn, rng.sample(patients, 25)),
+        "get_day_timelines": lambda: db.get_day_timelines(conn, *rng.choice(doctor_days)),
+        "get_doctor_schedule": lambda: db.get_doctor_schedule(conn, *rng.choice(doctor_days)),
+        "get_doctor_schedule(week)": lambda: db.get_doctor_schedule(conn, *week(rng.choice(doctor_days))),
+        "get_doctor_schedules": lambda: db.get_doctor_schedules(conn, rng.sample(doctors, 25),
+                                                                *week(rng.choice(doctor_days))[1:]),
+        # Hits the DaySheet cache only where daysheets.py has built the day
+        "get_day_sheet": lambda: db.get_day_sheet(conn, *rng.choice(doctor_days)),
+        "get_patient_profile": lambda: db.get_patient_profile(conn, rng.choice(patients)),
+        "get_patient_profiles": lambda: db.get_patient_profiles(conn, rng.sample(patients, 25)),
+        "invalidate_doctor_roster": lambda: db.invalidate_doctor_roster(conn),
+        "get_patient_balance": lambda: db.get_patient_balance(conn, rng.choice(patients)),
+        "get_total_receivables": lambda: db.get_total_receivables(conn),
+        "match_query": lambda: db.match_query("atrial fib* 2023"),
+        "search_reports": lambda: db.search_reports(conn, rng.choice(["atrial fibrillation", "pollen", "zzz"])),
+        "search_patient_history": lambda: db.search_patient_history(conn, rng.choice(["allergy", "zzz"])),
+        "find_users_by_prefix": lambda: db.find_users_by_prefix(conn, rng.choice(["Mar", "pat", "555-1", "Zz"])),
+        "fuzzy_find_users": lambda: db.fuzzy_find_users(conn, rng.choice(["Micheal Garsia", "Patrica Novk"])),
+        "lookup_users": lambda: db.lookup_users(conn, rng.choice(["Mar", "Jennifr Dvis"]), "patient"),
+        # Writes below run inside a transaction that is rolled back afterwards
+        "add_user": lambda: db.add_user(conn, "Bench User", f"bench{next(counter)}@example.com",
+                                        "pass123", "patient", address="-", phone="-"),
+        "add_patient_registration": (new_patient, lambda patient_id: db.add_patient_registration(
+            conn, today, "Benchmark history", patient_id)),
+        "add_appointment": lambda: db.add_appointment(conn, today, rng.choice(doctors), rng.choice(patients)),
+        "add_medical_report": lambda: db.add_medical_report(conn, "Benchmark report", today,
+                                                            rng.choice(patients), rng.choice(doctors)),
+        "add_billing": lambda: db.add_billing(conn, 10.0, today, rng.choice(patients), "Benchmark"),
+        "add_receipt": (new_bill, lambda bill_id: db.add_receipt(conn, today, bill_id, "Cash")),
+        "update_password": lambda: db.update_password(conn, rng.choice(patients), "new-pass"),
+        "update_patient_details": lambda: db.update_patient_details(conn, rng.choice(patients), "-", "-"),
+    }
+
+
+def public_db_functions():
+    """Names of the public functions defined in db.py."""
+    import db
+    return sorted(name for name, fn in inspect.getmembers(db, inspect.isfunction)
+                  if fn.__module__ == "db" and not name.startswith("_"))
+
+
+def run_benchmarks(conn, iterations=DEFAULT_ITERATIONS, budget=DEFAULT_BUDGET, seed=42, only=None):
+    """Times every public db.py function and returns the baseline document."""
+    rng = random.Random(seed)
+    cases = benchmark_cases(conn, rng)
+    missing = [name for name in public_db_functions() if name not in cases]
+    if missing:
+        print(f"Warning: no benchmark case for: {', '.join(missing)}", file=sys.stderr)
+
+    results = {}
+    for name, case in cases.items():
+        if only and name not in only:
+            continue
+        prepare, call = case if isinstance(case, tuple) else (None, case)
+        # Keep db.py's per-row prints out of the measurement output
+        with contextlib.redirect_stdout(io.StringIO()):
+            try:
+                results[name] = measure(call, iterations, budget, prepare)
+            except sqlite3.Error as e:
+                results[name] = {"error": str(e)}
+            finally:
+                conn.rollback()
+        print(f"{name:32} {json.dumps(results[name])}")
+
+    counts = {table: conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+              for table in ("User", "Doctor", "Patient", "Appointment", "MedicalReport", "Billing", "Receipt")}
+    return {
+        "meta": {"created": datetime.now().isoformat(timespec="seconds"), "seed": seed,
+                 "sqlite_version": sqlite3.sqlite_version, "python": sys.version.split()[0],
+                 "row_counts": counts},
+        "results": results,
+    }
+
+
+# --- Startup time ---
+
+STARTUP_RUNS = 10
+# Wall-clock time of fresh interpreters running one-shot commands, from exec to exit
+STARTUP_COMMANDS = {
+    "python -c pass": ["-c", "pass"],
+    "hms --help": ["hms.py", "--help"],
+    "hms doctors": ["hms.py", "doctors"],
+    "hms balance": ["hms.py", "balance"],
+    "hms bill list --unpaid": ["hms.py", "bill", "list", "--patient", "1", "--unpaid"],
+    "import main": ["-c", "import main"],
+}
+# Modules a one-shot hms query has no use for; importing any of them is a regression
+STARTUP_FORBIDDEN = {"api", "menus", "main", "seed", "importer", "archive", "scheduling", "analytics",
+                     "writer", "metrics", "asyncio", "concurrent.futures", "http.server"}
+
+
+def import_profile(argv):
+    """Runs python -X importtime argv. Returns ({module: self µs}, total µs)."""
+    import subprocess
+    result = subprocess.run([sys.executable, "-X", "importtime"] + argv,
+                            cwd=os.path.dirname(os.path.abspath(__file__)),
+                            stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+    modules = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, _, name = line[len("import time:"):].split("|")
+        modules[name.strip()] = int(self_us)
+    return modules, sum(modules.values())
+
+
+def startup_benchmarks(runs=STARTUP_RUNS, only=None):
+    """Times each STARTUP_COMMANDS entry in fresh interpreters. Returns the baseline document.
+
+    Besides the wall-clock percentiles, each result records the total import
+    time and module count from -X importtime, the slowest imports and any
+    STARTUP_FORBIDDEN module that an hms query pulled in.
+    """
+    import subprocess
+    here = os.path.dirname(os.path.abspath(__file__))
+    results = {}
+    for name, argv in STARTUP_COMMANDS.items():
+        if only and name not in only:
+            continue
+        latencies = []
+        for _ in range(runs):
+            start = time.perf_counter()
+            subprocess.run([sys.executable] + argv, cwd=here, stdout=subprocess.DEVNULL)
+            latencies.append(time.perf_counter() - start)
+        modules, total_us = import_profile(argv)
+        results[name] = summarize(latencies)
+        del results[name]["rows_per_sec"]
+        results[name].update({
+            "import_ms": round(total_us / 1000, 2),
+            "modules": len(modules),
+            "slowest_imports": sorted(modules, key=modules.get, reverse=True)[:5],
+            "unexpected_imports": sorted(STARTUP_FORBIDDEN & set(modules)) if argv[0] == "hms.py" else [],
+        })
+        print(f"{name:32} {json.dumps(results[name])}")
+    return {
+        "meta": {"created": datetime.now().isoformat(timespec="seconds"), "runs": runs,
+                 "python": sys.version.split()[0]},
+        "results": results,
+    }
+
+
+def compare(baseline, current, tolerance=REGRESSION_TOLERANCE):
+    """Returns (name, old p95, new p95) for every function slower than the tolerance allows."""
+    regressions = []
+    for name, new in current["results"].items():
+        old = baseline.get("results", {}).get(name)
+        if not old or "p95_ms" not in old or "p95_ms" not in new:
+            continue
+        if (new["p95_ms"] > old["p95_ms"] * (1 + tolerance)
+                and new["p95_ms"] - old["p95_ms"] > MIN_REGRESSION_MS):
+            regressions.append((name, old["p95_ms"], new["p95_ms"]))
+    return regressions
+
+
+if __name__ == "__main__":
+    from connection import get_connection
+
+    parser = argparse.ArgumentParser(description="Benchmark every public db.py function.")
+    parser.add_argument("--iterations", type=int, default=DEFAULT_ITERATIONS)
+    parser.add_argument("--budget", type=float, default=DEFAULT_BUDGET, help="Seconds per function")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--only", nargs="*", help="Benchmark only these functions")
+    parser.add_argument("--save", help="Write the results as a JSON baseline")
+    parser.add_argument("--compare", help="Fail if p95 regresses against this baseline")
+    parser.add_argument("--tolerance", type=float, default=REGRESSION_TOLERANCE)
+    parser.add_argument("--startup", action="store_true",
+                        help="Time interpreter startup for one-shot hms commands instead")
+    parser.add_argument("--runs", type=int, default=STARTUP_RUNS, help="Interpreter launches per --startup command")
+    args = parser.parse_args()
+
+    if args.startup:
+        report = startup_benchmarks(args.runs, args.only)
+        unexpected = {name: r["unexpected_imports"] for name, r in report["results"].items()
+                      if r["unexpected_imports"]}
+        for name, modules in unexpected.items():
+            print(f"REGRESSION {name}: imports {', '.join(modules)}")
+        if unexpected:
+            sys.exit(1)
+    else:
+        with get_connection() as conn:
+            report = run_benchmarks(conn, args.iterations, args.budget, args.seed, args.only)
+
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Baseline written to {args.save}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(json.load(f), report, args.tolerance)
+        for name, old, new in regressions:
+            print(f"REGRESSION {name}: p95 {old:.3f}ms -> {new:.3f}ms")
+        if regressions:
+            sys.exit(1)
+        print("No regressions against baseline.")
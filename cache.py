@@ -0,0 +1,123 @@
+import functools
+import threading
+import time
+from collections import OrderedDict
+from config import CACHE_ENABLED, CACHE_TTL, CACHE_MAXSIZE
+from replica import snapshot_reads
+
+
+class TTLCache:
+    """Thread-safe LRU cache whose entries also expire after ttl seconds."""
+
+    def __init__(self, maxsize=CACHE_MAXSIZE, ttl=CACHE_TTL):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    def get(self, key):
+        """Returns (True, value) on a fresh hit, else (False, None)."""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires, value = entry
+                if expires > now:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return True, value
+                del self._entries[key]
+                self.expirations += 1
+            self.misses += 1
+            return False, None
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, key):
+        with self._lock:
+            if self._entries.pop(key, None) is not None:
+                self.invalidations += 1
+
+    def clear(self):
+        with self._lock:
+            self.invalidations += len(self._entries)
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            return {"size": len(self._entries), "hits": self.hits, "misses": self.misses,
+                    "evictions": self.evictions, "expirations": self.expirations,
+                    "invalidations": self.invalidations}
+
+
+_caches = {}
+
+
+def cached(name, maxsize=CACHE_MAXSIZE, ttl=CACHE_TTL):
+    """Caches a db.py read function of the form f(conn, *args).
+
+    Entries are keyed by the connection's database file and the remaining
+    arguments, so results never leak between databases. List results are
+    stored as tuples and copied on the way out so callers cannot corrupt
+    the cache. None results are not cached, and neither are results a
+    replica snapshot answered: after an invalidation they could still be
+    the old data, kept for another ttl seconds. A read made inside a
+    transaction bypasses the cache altogether, since that transaction may
+    hold writes the cache has not seen.
+    """
+    cache = _caches[name] = TTLCache(maxsize, ttl)
+
+    def decorator(fn):
+        if not CACHE_ENABLED:
+            return fn
+
+        @functools.wraps(fn)
+        def wrapper(conn, *args):
+            if conn.in_transaction:
+                return fn(conn, *args)
+            key = (getattr(conn, "database", None),) + args
+            found, entry = cache.get(key)
+            if found:
+                is_list, value = entry
+                return list(value) if is_list else value
+            served = snapshot_reads()
+            value = fn(conn, *args)
+            if value is not None and snapshot_reads() == served:
+                is_list = isinstance(value, list)
+                cache.set(key, (is_list, tuple(value) if is_list else value))
+            return value
+
+        wrapper.cache = cache
+        return wrapper
+    return decorator
+
+
+def invalidate(name, conn=None, *args):
+    """Drops one cached entry, or the whole named cache when no arguments are given."""
+    cache = _caches[name]
+    if conn is None:
+        cache.clear()
+    else:
+        cache.invalidate((getattr(conn, "database", None),) + args)
+
+
+def clear_all():
+    """Empties every cache."""
+    for cache in _caches.values():
+        cache.clear()
+
+
+def cache_stats():
+    """Returns {cache name: hit/miss/eviction counters}."""
+    return {name: cache.stats() for name, cache in _caches.items()}
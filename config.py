@@ -1 +1,118 @@
-DATABASE_NAME = "hospital.db"
\ No newline at end of file
+import os
+
+DATABASE_NAME = os.environ.get("HMS_DATABASE", "hospital.db")
+
+# --- SQLite engine settings (applied to every pooled connection) ---
+POOL_SIZE = 8                 # Max connections kept per database file
+POOL_TIMEOUT = 30.0           # Seconds to wait for a free connection
+BUSY_TIMEOUT_MS = 5000        # How long a writer waits on a lock before SQLITE_BUSY
+JOURNAL_MODE = "WAL"          # WAL lets readers proceed while a writer commits
+SYNCHRONOUS = "NORMAL"        # Safe with WAL; fsyncs only at checkpoints
+CACHE_SIZE_KB = 64000         # Page cache per connection, in KiB
+FOREIGN_KEYS = True
+
+# --- Listings ---
+PAGE_SIZE = 20                # Rows shown per page in the menus
+STREAM_BATCH_SIZE = 1000      # Rows fetched per query by the iter_* streaming helpers
+
+# --- Password hashing ---
+PASSWORD_SCHEME = "scrypt"    # "scrypt" or "pbkdf2_sha256"
+SCRYPT_N = 2 ** 14            # CPU/memory cost; memory used is 128 * N * r bytes
+SCRYPT_R = 8
+SCRYPT_P = 1
+PBKDF2_ITERATIONS = 200000
+LOGIN_CACHE_SIZE = 1024       # Recent successful verifications kept in memory
+LOGIN_CACHE_TTL = 300         # Seconds a cached verification stays valid
+
+# --- Scheduling ---
+DEFAULT_WORKING_DAYS = (0, 1, 2, 3, 4)         # Monday..Friday, for doctors who never edited their week
+DEFAULT_WORKING_HOURS = ("09:00", "17:00")
+DEFAULT_SLOT_MINUTES = 30
+SLOT_INDEX_HORIZON_DAYS = 30  # Days of bookings held in the in-memory slot index
+SLOT_INDEX_TTL = 60           # Seconds before the index reloads bookings made elsewhere
+
+# --- Read-through cache for reference data ---
+CACHE_ENABLED = True
+CACHE_TTL = 300               # Seconds; also bounds staleness from writes in other processes
+CACHE_MAXSIZE = 4096          # Entries per cached function
+
+# --- HTTP API ---
+API_HOST = "127.0.0.1"
+API_PORT = 8080
+API_WORKERS = 8               # Threads running SQLite calls, each with its own connection
+API_MAX_PENDING = 256         # Requests allowed to wait for a worker before new ones queue in asyncio
+API_SESSION_TTL = 8 * 3600    # Seconds a login token stays valid
+API_SESSION_SWEEP = 300       # Seconds between sweeps that drop expired login tokens
+
+# --- Full-text search ---
+SEARCH_LIMIT = 50             # Default number of ranked hits returned
+SEARCH_SNIPPET_TOKENS = 12    # Tokens of context around each highlighted match
+SEARCH_HIGHLIGHT = ("[", "]") # Markers placed around matched terms in snippets
+
+# --- User lookup ---
+LOOKUP_LIMIT = 10             # Matches returned by the name/email/phone lookups
+FUZZY_CANDIDATES = 200        # Trigram hits re-ranked by similarity in fuzzy lookups
+FUZZY_POSTINGS = 20000        # Max index entries a fuzzy lookup ranks before falling back to exact trigrams
+FUZZY_MIN_SCORE = 0.4         # Similarity (0..1) below which a fuzzy hit is dropped
+
+# --- Group commit ---
+GROUP_COMMIT_ENABLED = True   # Route API writes through the shared writer thread
+GROUP_COMMIT_WINDOW_MS = 0    # Extra wait for more writes; 0 commits as soon as the writer is free
+GROUP_COMMIT_MAX_BATCH = 500  # Writes committed together at most
+GROUP_COMMIT_QUEUE_SIZE = 10000  # Pending writes before submit() blocks
+
+# --- Analytics rollups ---
+# Rollups live in their own file so dashboards never read the clinical database
+ANALYTICS_DATABASE = os.environ.get("HMS_ANALYTICS_DATABASE",
+                                    os.path.splitext(DATABASE_NAME)[0] + "_analytics.db")
+ANALYTICS_SNAPSHOT = os.path.splitext(DATABASE_NAME)[0] + "_snapshot.db"
+ANALYTICS_BATCH_SIZE = 50000  # Source rows folded into the rollups per transaction
+AGEING_BUCKETS = (30, 60, 90) # Receivables ageing bucket edges, in days
+SNAPSHOT_PAGES_PER_STEP = 4096  # Pages copied per backup step when taking a snapshot
+
+# --- Instrumentation and logging ---
+METRICS_ENABLED = os.environ.get("HMS_METRICS", "") == "1"  # Time db.py calls and SQL statements; off costs nothing
+SLOW_QUERY_MS = 100           # Calls and statements slower than this go to the slow-query log
+METRICS_STATEMENT_SAMPLE = 10 # Time one read statement in this many; writes and db.py calls are always timed
+SLOW_QUERY_LOG = os.environ.get("HMS_SLOW_QUERY_LOG")  # JSON-lines file for slow queries; None logs them as warnings
+LATENCY_BUCKETS_MS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+LOG_LEVEL = os.environ.get("HMS_LOG_LEVEL", "INFO")  # "OFF" silences the db.py messages entirely
+LOG_FORMAT = os.environ.get("HMS_LOG_FORMAT", "text")  # "text" (just the message) or "json"
+API_LOG_LEVEL = os.environ.get("HMS_LOG_LEVEL", "WARNING")  # The API logs only problems by default
+
+# --- Archival ---
+# Old appointments, reports and paid bills move to one SQLite file per year in this directory
+ARCHIVE_DIR = os.environ.get("HMS_ARCHIVE_DIR", os.path.splitext(DATABASE_NAME)[0] + "_archive")
+ARCHIVE_AFTER_DAYS = 730      # Rows dated more than this many days ago are archived
+ARCHIVE_BATCH_SIZE = 5000     # Rows moved per transaction
+
+# --- Backups ---
+BACKUP_DIR = os.environ.get("HMS_BACKUP_DIR", os.path.splitext(DATABASE_NAME)[0] + "_backups")
+BACKUP_PAGES_PER_STEP = 1024  # Pages copied per backup step
+BACKUP_STEP_SLEEP_MS = 1      # Pause between steps so writers and the checkpointer get the CPU
+BACKUP_COMPRESS_LEVEL = 1     # gzip level for compressed backups; 1 is several times faster than 9
+BACKUP_KEEP = 7               # Backups kept in BACKUP_DIR by --prune
+
+# --- Doctor day sheets ---
+DAYSHEET_DIR = os.environ.get("HMS_DAYSHEET_DIR", os.path.splitext(DATABASE_NAME)[0] + "_daysheets")
+DAYSHEET_DAYS = 7             # Days built from the start date when no end date is given
+DAYSHEET_CHUNK = 100          # Doctors per worker task (and per cache-write transaction)
+DAYSHEET_PROCESSES = os.cpu_count() or 1  # Worker processes building sheets
+DAYSHEET_RETRIES = 3          # Rebuilds of a chunk whose appointments changed while it was being built
+
+# --- Receivables and dunning ---
+RECEIVABLES_BATCH_SIZE = 20000  # Unpaid bills read per query by the ageing run
+DUNNING_MIN_AMOUNT = 10.0     # Overdue totals below this get no dunning notice
+DUNNING_NOTICES = ("Reminder", "Second notice", "Final notice")  # By oldest overdue bucket; the last repeats
+PAYMENT_FILE_METHOD = "Bank Transfer"  # Payment method for payment-file rows that do not name one
+
+# --- Read replica ---
+# Listing and search reads marked @replica_read in db.py are sent to a replica:
+# "off" keeps every read on the primary, "wal" uses read-only connections to the
+# primary file, and "snapshot" uses a copy refreshed with the SQLite backup API
+REPLICA_MODE = os.environ.get("HMS_REPLICA", "off")
+REPLICA_PATH = os.environ.get("HMS_REPLICA_PATH", os.path.splitext(DATABASE_NAME)[0] + "_replica.db")
+REPLICA_MAX_LAG = 60.0        # Seconds; reads skip a snapshot older than this and go to the primary
+REPLICA_REFRESH_AFTER = 30.0  # Seconds; a routed read finding the snapshot older starts a background refresh
+REPLICA_POOL_SIZE = 4         # Read-only connections per replica file
+REPLICA_CHECK_INTERVAL = 1.0  # Seconds between looks at the snapshot file for a newer copy
@@ -0,0 +1,172 @@
+import queue
+import sqlite3
+import threading
+from contextlib import contextmanager
+from urllib.parse import quote
+from config import (
+    DATABASE_NAME, POOL_SIZE, POOL_TIMEOUT, BUSY_TIMEOUT_MS, JOURNAL_MODE,
+    SYNCHRONOUS, CACHE_SIZE_KB, FOREIGN_KEYS, METRICS_ENABLED
+)
+
+
+def configure(conn, readonly=False):
+    """Applies the engine pragmas from config.py to a connection.
+
+    A read-only connection keeps the file's journal mode, which only a
+    writer can change, and refuses writes even on a writable file.
+    """
+    c = conn.cursor()
+    c.execute(f"PRAGMA busy_timeout = {int(BUSY_TIMEOUT_MS)}")
+    if readonly:
+        c.execute("PRAGMA query_only = ON")
+    else:
+        c.execute(f"PRAGMA journal_mode = {JOURNAL_MODE}")
+        c.execute(f"PRAGMA synchronous = {SYNCHRONOUS}")
+    # A negative cache_size is interpreted by SQLite as KiB rather than pages
+    c.execute(f"PRAGMA cache_size = {-abs(int(CACHE_SIZE_KB))}")
+    c.execute(f"PRAGMA foreign_keys = {'ON' if FOREIGN_KEYS else 'OFF'}")
+    return conn
+
+
+class Connection(sqlite3.Connection):
+    """sqlite3 connection that remembers which database file it was opened on."""
+    database = None
+    readonly = False
+    _after_commit = ()
+
+    def after_commit(self, callback):
+        """Runs callback once the open transaction commits (at once if none is open); a rollback drops it.
+
+        For in-memory state that must only reflect committed rows, such as
+        caches and the slot index.
+        """
+        if not self.in_transaction:
+            callback()
+        elif self._after_commit:
+            self._after_commit.append(callback)
+        else:
+            self._after_commit = [callback]
+
+    def commit(self):
+        super().commit()
+        callbacks, self._after_commit = self._after_commit, ()
+        for callback in callbacks:
+            callback()
+
+    def rollback(self):
+        self._after_commit = ()
+        super().rollback()
+
+
+def connect(database=None, readonly=False):
+    """Opens a new, tuned connection that is not managed by a pool.
+
+    readonly opens the file with a mode=ro URI, so the connection can never
+    write to it or take its write lock.
+    """
+    database = database or DATABASE_NAME
+    factory = Connection
+    if METRICS_ENABLED:
+        from metrics import InstrumentedConnection as factory
+    target, uri = database, False
+    if readonly:
+        target, uri = f"file:{quote(database)}?mode=ro", True
+    conn = sqlite3.connect(target, timeout=BUSY_TIMEOUT_MS / 1000, check_same_thread=False,
+                           factory=factory, uri=uri)
+    conn.database = database
+    conn.readonly = readonly
+    return configure(conn, readonly)
+
+
+class ConnectionPool:
+    """A bounded pool of tuned connections to a single database file.
+
+    Connections may be used from any thread, but only by one holder at a time.
+    """
+
+    def __init__(self, database=None, size=POOL_SIZE, timeout=POOL_TIMEOUT, readonly=False):
+        self.database = database or DATABASE_NAME
+        self.size = size
+        self.timeout = timeout
+        self.readonly = readonly
+        self._idle = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._opened = 0
+
+    def acquire(self):
+        """Returns an idle connection, opening a new one while under the size limit."""
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+
+        with self._lock:
+            if self._opened < self.size:
+                self._opened += 1
+                try:
+                    return connect(self.database, self.readonly)
+                except Exception:
+                    self._opened -= 1
+                    raise
+
+        try:
+            return self._idle.get(timeout=self.timeout)
+        except queue.Empty:
+            raise TimeoutError(f"No free connection to '{self.database}' after {self.timeout}s.")
+
+    def release(self, conn):
+        """Returns a connection to the pool, discarding any open transaction."""
+        if conn.in_transaction:
+            conn.rollback()
+        self._idle.put(conn)
+
+    @contextmanager
+    def connection(self):
+        """Checks out a connection; commits on success and rolls back on error."""
+        conn = self.acquire()
+        try:
+            yield conn
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+        finally:
+            self.release(conn)
+
+    def close(self):
+        """Closes every idle connection held by the pool."""
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            conn.close()
+            with self._lock:
+                self._opened -= 1
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(database=None, readonly=False):
+    """Returns the process-wide pool for a database file, creating it on first use."""
+    database = database or DATABASE_NAME
+    with _pools_lock:
+        pool = _pools.get((database, readonly))
+        if pool is None:
+            pool = _pools[database, readonly] = ConnectionPool(database, readonly=readonly)
+        return pool
+
+
+def get_connection(database=None, readonly=False):
+    """Context manager yielding a pooled connection to the given (or default) database."""
+    return get_pool(database, readonly).connection()
+
+
+def close_all():
+    """Closes the idle connections of every pool in this process."""
+    with _pools_lock:
+        pools = list(_pools.values())
+    for pool in pools:
+        pool.close()
@@ -0,0 +1,236 @@
+import argparse
+import csv
+import glob
+import json
+import logging
+import os
+import sys
+import time
+from datetime import date, datetime, timedelta
+from config import (
+    DATABASE_NAME, DAYSHEET_DIR, DAYSHEET_DAYS, DAYSHEET_CHUNK, DAYSHEET_PROCESSES, DAYSHEET_RETRIES
+)
+from connection import close_all, connect
+import db
+
+# Batch builder for doctors' day sheets: each doctor's appointments for each
+# day of a date range, in time order, with the patient's name and phone.
+#
+# Doctors are split into chunks of DAYSHEET_CHUNK. A worker process reads a
+# chunk with one get_doctor_schedules() query, which seeks the date range of
+# each doctor in idx_appointment_doctor_date, renders every doctor-day as a
+# compact JSON array and, if asked, writes the chunk's part files:
+#
+#     <DAYSHEET_DIR>/<start>_<end>/part-0000.jsonl   one sheet per line
+#     <DAYSHEET_DIR>/<start>_<end>/part-0000.csv     one appointment per row
+#
+# The parent stores the sheets in the DaySheet table, which get_day_sheet()
+# (and so the doctor menu) reads with one primary-key lookup. Days with
+# nothing booked are stored as empty sheets, so a missing sheet always means
+# "not built, or changed since".
+#
+# Triggers drop the sheets a later booking, cancellation or contact change
+# affects. A change that lands between a worker's read and the cache write
+# would be missed by them, so each read also records the chunk's doctors'
+# generations in DaySheetGeneration, which those triggers bump per doctor; if
+# any of them has moved by the time the chunk is stored, the chunk is rebuilt
+# (up to DAYSHEET_RETRIES times). Bookings for other doctors leave it alone.
+
+log = logging.getLogger("hms.daysheets")
+
+CSV_HEADER = ("doctor_id", "date", "time", "appointment_id", "patient_id", "patient_name", "phone")
+
+
+def days_between(start, end):
+    """Every date from start to end (YYYY-MM-DD, inclusive), as strings."""
+    first, last = date.fromisoformat(start), date.fromisoformat(end)
+    return [(first + timedelta(days=i)).isoformat() for i in range((last - first).days + 1)]
+
+
+def generations(conn, doctor_ids):
+    """Returns {doctor_id: generation} for doctor_ids; doctors whose sheets never changed are at 0."""
+    found = dict(conn.execute("SELECT doctor_id, generation FROM DaySheetGeneration "
+                              "WHERE doctor_id IN (SELECT value FROM json_each(?))", (json.dumps(doctor_ids),)))
+    return {doctor_id: found.get(doctor_id, 0) for doctor_id in doctor_ids}
+
+
+def build_chunk(database, number, doctor_ids, start, end, directory=None, formats=()):
+    """Reads and renders one chunk of doctors. Returns (number, generations, sheets).
+
+    sheets holds a (doctor_id, date, appointments, sheet JSON) tuple for every
+    doctor and day. The doctors' generations are read in the same snapshot as
+    the schedules. Part files for the requested formats are written to directory.
+    """
+    conn = connect(database)
+    try:
+        conn.execute("BEGIN")
+        read_at = generations(conn, doctor_ids)
+        schedules = db.get_doctor_schedules(conn, doctor_ids, start, end)
+        conn.rollback()
+    finally:
+        conn.close()
+
+    days = days_between(start, end)
+    sheets = []
+    for doctor_id, entries in schedules.items():
+        by_day = {}
+        for entry in entries:
+            by_day.setdefault(entry.date, []).append(
+                [entry.appointment_id, entry.time, entry.patient_id, entry.patient_name, entry.phone])
+        for day in days:
+            rows = by_day.get(day, [])
+            sheets.append((doctor_id, day, len(rows), json.dumps(rows, separators=(",", ":"))))
+
+    if directory and "json" in formats:
+        with open(os.path.join(directory, f"part-{number:04d}.jsonl"), "w") as f:
+            for doctor_id, day, count, sheet in sheets:
+                if count:
+                    f.write(f'{{"doctor_id":{doctor_id},"date":"{day}","appointments":{sheet}}}\n')
+    if directory and "csv" in formats:
+        with open(os.path.join(directory, f"part-{number:04d}.csv"), "w", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(CSV_HEADER)
+            for doctor_id, entries in schedules.items():
+                writer.writerows((doctor_id, e.date, e.time, e.appointment_id, e.patient_id, e.patient_name, e.phone)
+                                 for e in entries)
+    return number, read_at, sheets
+
+
+def store(conn, read_at, sheets):
+    """Writes sheets to the DaySheet cache unless one of their doctors' generations has moved.
+
+    read_at is the {doctor_id: generation} build_chunk returned. Returns True if stored.
+    """
+    if conn.in_transaction:
+        conn.commit()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        if generations(conn, list(read_at)) != read_at:
+            conn.rollback()
+            return False
+        built_at = datetime.now().isoformat(timespec="seconds")
+        conn.executemany("INSERT OR REPLACE INTO DaySheet (doctor_id, date, appointments, sheet, built_at) "
+                         "VALUES (?, ?, ?, ?, ?)",
+                         [(doctor_id, day, count, sheet, built_at) for doctor_id, day, count, sheet in sheets])
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return True
+
+
+def prune(conn, before):
+    """Deletes cached sheets dated before a day. Returns the number deleted."""
+    deleted = conn.execute("DELETE FROM DaySheet WHERE date < ?", (before,)).rowcount
+    conn.commit()
+    return deleted
+
+
+def _results(tasks, processes):
+    """Runs build_chunk over tasks, yielding results as they finish."""
+    if processes <= 1 or len(tasks) <= 1:
+        for task in tasks:
+            yield build_chunk(*task)
+        return
+    from concurrent.futures import ProcessPoolExecutor, as_completed
+    # Workers open their own connections; none of ours should cross the fork
+    close_all()
+    with ProcessPoolExecutor(min(processes, len(tasks))) as pool:
+        for future in as_completed([pool.submit(build_chunk, *task) for task in tasks]):
+            yield future.result()
+
+
+def build(start, end=None, database=None, processes=DAYSHEET_PROCESSES, chunk=DAYSHEET_CHUNK,
+          directory=DAYSHEET_DIR, formats=("json",), cache=True):
+    """Builds every doctor's day sheets from start to end (default DAYSHEET_DAYS days). Returns a summary dict.
+
+    With cache, sheets go to the DaySheet table; with formats ("json", "csv"),
+    part files go to <directory>/<start>_<end>/.
+    """
+    database = database or DATABASE_NAME
+    end = end or (date.fromisoformat(start) + timedelta(days=DAYSHEET_DAYS - 1)).isoformat()
+    if end < start:
+        raise ValueError(f"End date {end} is before start date {start}.")
+    started = time.perf_counter()
+
+    conn = connect(database)
+    doctor_ids = [row[0] for row in conn.execute("SELECT doctor_id FROM Doctor ORDER BY doctor_id")]
+    chunks = [doctor_ids[i:i + chunk] for i in range(0, len(doctor_ids), chunk)]
+
+    target = None
+    if formats:
+        target = os.path.join(directory, f"{start}_{end}")
+        os.makedirs(target, exist_ok=True)
+        # A rebuild with a different chunk size must not leave old parts behind
+        for path in glob.glob(os.path.join(target, "part-*")):
+            os.remove(path)
+
+    summary = {"start": start, "end": end, "doctors": len(doctor_ids), "chunks": len(chunks),
+               "sheets": 0, "appointments": 0, "rebuilt_chunks": 0, "uncached_chunks": 0,
+               "directory": target}
+    pending = list(range(len(chunks)))
+    try:
+        for attempt in range(DAYSHEET_RETRIES + 1):
+            tasks = [(database, number, chunks[number], start, end, target, formats) for number in pending]
+            stale = []
+            for number, read_at, sheets in _results(tasks, processes):
+                if cache and not store(conn, read_at, sheets):
+                    stale.append(number)
+                    continue
+                summary["sheets"] += len(sheets)
+                summary["appointments"] += sum(count for _, _, count, _ in sheets)
+            if not stale:
+                break
+            summary["rebuilt_chunks"] += len(stale)
+            pending = sorted(stale)
+            log.info(f"{len(stale)} chunk(s) changed while being built; rebuilding.", extra={"chunks": len(stale)})
+        else:
+            summary["uncached_chunks"] = len(pending)
+            log.warning(f"{len(pending)} chunk(s) kept changing and were not cached.",
+                        extra={"chunks": len(pending)})
+    finally:
+        conn.close()
+
+    summary["seconds"] = round(time.perf_counter() - started, 3)
+    log.info(f"Built {summary['sheets']} day sheets ({summary['appointments']} appointments) "
+             f"for {start}..{end} in {summary['seconds']}s.",
+             extra={k: summary[k] for k in ("sheets", "appointments", "seconds")})
+    return summary
+
+
+if __name__ == "__main__":
+    from db import init_db
+    from logs import configure_logging
+
+    parser = argparse.ArgumentParser(description="Build doctors' day sheets for a date range.")
+    parser.add_argument("--start", default=date.today().isoformat(), help="First day, YYYY-MM-DD (default: today)")
+    parser.add_argument("--end", help=f"Last day, YYYY-MM-DD (default: {DAYSHEET_DAYS} days from --start)")
+    parser.add_argument("--processes", type=int, default=DAYSHEET_PROCESSES)
+    parser.add_argument("--chunk", type=int, default=DAYSHEET_CHUNK, help="Doctors per worker task")
+    parser.add_argument("--format", choices=("json", "csv", "both", "none"), default="json",
+                        help="Files to write under --directory")
+    parser.add_argument("--directory", default=DAYSHEET_DIR)
+    parser.add_argument("--no-cache", action="store_true", help="Only write files; leave the DaySheet table alone")
+    parser.add_argument("--prune", action="store_true", help="Drop cached sheets dated before --start")
+    args = parser.parse_args()
+
+    configure_logging(stream=sys.stderr)
+    init_db()
+    formats = {"json": ("json",), "csv": ("csv",), "both": ("json", "csv"), "none": ()}[args.format]
+    try:
+        summary = build(args.start, args.end, processes=args.processes, chunk=max(1, args.chunk),
+                        directory=args.directory, formats=formats, cache=not args.no_cache)
+    except ValueError as e:
+        sys.exit(str(e))
+    print(f"{summary['sheets']} day sheets, {summary['appointments']} appointments, "
+          f"{summary['doctors']} doctors in {summary['chunks']} chunk(s), {summary['seconds']}s")
+    if summary["directory"]:
+        print(f"Files in {summary['directory']}")
+    if summary["uncached_chunks"]:
+        print(f"{summary['uncached_chunks']} chunk(s) were not cached; their days are read live.")
+    if args.prune:
+        conn = connect()
+        try:
+            print(f"Pruned {prune(conn, args.start)} sheet(s) dated before {args.start}.")
+        finally:
+            conn.close()
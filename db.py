@@ -1,126 +1,68 @@
+import json
+import logging
 import sqlite3
-from config import DATABASE_NAME
+from difflib import SequenceMatcher
+from cache import cached, invalidate
+from config import (
+    PAGE_SIZE, STREAM_BATCH_SIZE, SEARCH_LIMIT, SEARCH_SNIPPET_TOKENS, SEARCH_HIGHLIGHT,
+    LOOKUP_LIMIT, FUZZY_CANDIDATES, FUZZY_POSTINGS, FUZZY_MIN_SCORE, METRICS_ENABLED
+)
+from connection import get_connection
+from ledger import record_bill, record_payment
+from migrations import migrate
+from passwords import check_password, hash_password, needs_rehash, remember_verified
+from records import (
+    Balance, Bill, ColumnBatch, Doctor, DoctorAppointment, HistoryHit, Patient, PatientAppointment,
+    PatientProfile, Receipt, Report, ReportHit, ScheduleEntry, TimelineEvent, UserMatch, row_factory
+)
+from replica import replica_read
 
-def init_db():
-    """Initializes all database tables."""
-    with sqlite3.connect(DATABASE_NAME) as conn:
-        c = conn.cursor()
+log = logging.getLogger("hms.db")
 
-        # User Table (Central)
-        c.execute("""
-            CREATE TABLE IF NOT EXISTS User (
-                user_id INTEGER PRIMARY KEY AUTOINCREMENT,
-                name TEXT NOT NULL,
-                email TEXT UNIQUE NOT NULL,
-                password TEXT NOT NULL,
-                role TEXT CHECK(role IN ('doctor','patient','admin')) NOT NULL
-            );
-        """)
-
-        # Doctor Table (Links to User)
-        c.execute("""
-            CREATE TABLE IF NOT EXISTS Doctor (
-                doctor_id INTEGER PRIMARY KEY,
-                specialization TEXT,
-                FOREIGN KEY(doctor_id) REFERENCES User(user_id)
-            );
-        """)
-
-        # Patient Table (Links to User)
-        c.execute("""
-            CREATE TABLE IF NOT EXISTS Patient (
-                patient_id INTEGER PRIMARY KEY,
-                address TEXT,
-                phone TEXT,
-                FOREIGN KEY(patient_id) REFERENCES User(user_id)
-            );
-        """)
-
-        # Administrator Table (Links to User)
-        c.execute("""
-            CREATE TABLE IF NOT EXISTS Administrator (
-                admin_id INTEGER PRIMARY KEY,
-                FOREIGN KEY(admin_id) REFERENCES User(user_id)
-            );
-        """)
+def init_db():
+    """Brings the database schema up to the latest migration. Returns the migrations applied.
 
-        # Appointment Table
-        c.execute("""
-            CREATE TABLE IF NOT EXISTS Appointment (
-                appointment_id INTEGER PRIMARY KEY AUTOINCREMENT,
-                appointment_date TEXT NOT NULL,
-                doctor_id INTEGER NOT NULL,
-                patient_id INTEGER NOT NULL,
-                FOREIGN KEY(doctor_id) REFERENCES Doctor(doctor_id),
-                FOREIGN KEY(patient_id) REFERENCES Patient(patient_id)
-            );
-        """)
-
-        # Medical Report Table
-        c.execute("""
-            CREATE TABLE IF NOT EXISTS MedicalReport (
-                report_id INTEGER PRIMARY KEY AUTOINCREMENT,
-                report_details TEXT NOT NULL,
-                report_date TEXT NOT NULL,
-                patient_id INTEGER NOT NULL,
-                doctor_id INTEGER NOT NULL,
-                FOREIGN KEY(patient_id) REFERENCES Patient(patient_id),
-                FOREIGN KEY(doctor_id) REFERENCES Doctor(doctor_id)
-            );
-        """)
-
-        # Billing Table
-        c.execute("""
-            CREATE TABLE IF NOT EXISTS Billing (
-                bill_id INTEGER PRIMARY KEY AUTOINCREMENT,
-                amount REAL NOT NULL,
-                date TEXT NOT NULL,
-                patient_id INTEGER NOT NULL,
-                details TEXT,
-                FOREIGN KEY(patient_id) REFERENCES Patient(patient_id)
-            );
-        """)
-
-        # Receipt Table (Links to Billing)
-        c.execute("""
-            CREATE TABLE IF NOT EXISTS Receipt (
-                receipt_id INTEGER PRIMARY KEY AUTOINCREMENT,
-                date TEXT NOT NULL,
-                bill_id INTEGER UNIQUE NOT NULL,
-                payment_method TEXT DEFAULT 'Cash',
-                FOREIGN KEY(bill_id) REFERENCES Billing(bill_id)
-            );
-        """)
-
-        # Patient Registration Details Table
-        c.execute("""
-            CREATE TABLE IF NOT EXISTS PatientRegistration (
-                regn_id INTEGER PRIMARY KEY AUTOINCREMENT,
-                date TEXT NOT NULL,
-                patient_history TEXT,
-                patient_id INTEGER UNIQUE NOT NULL,
-                FOREIGN KEY(patient_id) REFERENCES Patient(patient_id)
-            );
-        """)
-        
-        conn.commit()
-    print("Database initialized successfully.")
+    When the schema is already current this is a single PRAGMA read.
+    """
+    with get_connection() as conn:
+        applied = migrate(conn)
+    if applied:
+        log.info("Database initialized successfully.")
+    return applied
 
 
 # --- Core Database Functions ---
 
+def get_user_by_email(conn, email):
+    """Returns (user_id, role, name, password) for an email, or None."""
+    c = conn.cursor()
+    c.execute("SELECT user_id, role, name, password FROM User WHERE email=?", (email,))
+    return c.fetchone()
+
+def authenticate(conn, email, password):
+    """Checks credentials on an existing connection. Returns user info dict or None."""
+    result = get_user_by_email(conn, email)
+    
+    if result:
+        user_id, role, name, stored_password = result
+        if check_password(password, stored_password):
+            # Upgrade plaintext or outdated hashes while we know the password
+            if needs_rehash(stored_password):
+                remember_verified(update_password(conn, user_id, password), password)
+            return {"user_id": user_id, "role": role, "name": name}
+    return None
+
 def login(email, password):
     """Attempts to log a user in. Returns user info dict or None."""
-    with sqlite3.connect(DATABASE_NAME) as conn:
-        c = conn.cursor()
-        c.execute("SELECT user_id, role, name, password FROM User WHERE email=?", (email,))
-        result = c.fetchone()
-        
-        if result:
-            user_id, role, name, stored_password = result
-            if stored_password == password:
-                return {"user_id": user_id, "role": role, "name": name}
-    return None
+    with get_connection() as conn:
+        return authenticate(conn, email, password)
+
+def update_password(conn, user_id, password):
+    """Stores a freshly salted hash of password for a user. Returns the new hash."""
+    password_hash = hash_password(password)
+    c = conn.cursor()
+    c.execute("UPDATE User SET password = ? WHERE user_id = ?", (password_hash, user_id))
+    return password_hash
 
 def add_user(conn, name, email, password, role, **kwargs):
     """
@@ -131,12 +73,13 @@ def add_user(conn, name, email, password, role, **kwargs):
     
     try:
         c.execute("INSERT INTO User (name, email, password, role) VALUES (?, ?, ?, ?)",
-                  (name, email, password, role))
+                  (name, email, hash_password(password), role))
         user_id = c.lastrowid
         
         if role == "doctor":
             spec = kwargs.get("specialization", "General")
             c.execute("INSERT INTO Doctor (doctor_id, specialization) VALUES (?, ?)", (user_id, spec))
+            invalidate_doctor_roster(conn, spec)
         
         elif role == "patient":
             addr = kwargs.get("address", "N/A")
@@ -146,11 +89,11 @@ def add_user(conn, name, email, password, role, **kwargs):
         elif role == "admin":
             c.execute("INSERT INTO Administrator (admin_id) VALUES (?)", (user_id,))
             
-        print(f"User '{name}' ({role}) created with ID: {user_id}")
+        log.info(f"User '{name}' ({role}) created with ID: {user_id}", extra={"user_id": user_id, "role": role})
         return user_id
         
     except sqlite3.IntegrityError:
-        print(f"Error: Email '{email}' already exists.")
+        log.warning(f"Error: Email '{email}' already exists.", extra={"email": email})
         return None
 
 def add_patient_registration(conn, date, history, patient_id):
@@ -158,21 +101,23 @@ def add_patient_registration(conn, date, history, patient_id):
     c = conn.cursor()
     c.execute("INSERT INTO PatientRegistration (date, patient_history, patient_id) VALUES (?, ?, ?)",
               (date, history, patient_id))
-    print(f"Registration details added for patient ID: {patient_id}")
+    log.info(f"Registration details added for patient ID: {patient_id}", extra={"patient_id": patient_id})
 
-def add_appointment(conn, date, doctor_id, patient_id):
-    """Adds a new appointment."""
+def add_appointment(conn, date, doctor_id, patient_id, time=None):
+    """Adds a new appointment, optionally in a specific HH:MM slot. Returns its ID."""
     c = conn.cursor()
-    c.execute("INSERT INTO Appointment (appointment_date, doctor_id, patient_id) VALUES (?, ?, ?)",
-              (date, doctor_id, patient_id))
-    print("Appointment added successfully.")
+    c.execute("INSERT INTO Appointment (appointment_date, doctor_id, patient_id, appointment_time) VALUES (?, ?, ?, ?)",
+              (date, doctor_id, patient_id, time))
+    log.info("Appointment added successfully.", extra={"appointment_id": c.lastrowid})
+    return c.lastrowid
 
 def add_medical_report(conn, details, date, patient_id, doctor_id):
-    """Adds a new medical report."""
+    """Adds a new medical report. Returns its ID."""
     c = conn.cursor()
     c.execute("INSERT INTO MedicalReport (report_details, report_date, patient_id, doctor_id) VALUES (?, ?, ?, ?)",
               (details, date, patient_id, doctor_id))
-    print("Medical report added successfully.")
+    log.info("Medical report added successfully.", extra={"report_id": c.lastrowid})
+    return c.lastrowid
 
 def add_billing(conn, amount, date, patient_id, details):
     """Adds a new bill for a patient."""
@@ -180,22 +125,44 @@ def add_billing(conn, amount, date, patient_id, details):
     c.execute("INSERT INTO Billing (amount, date, patient_id, details) VALUES (?, ?, ?, ?)",
               (amount, date, patient_id, details))
     bill_id = c.lastrowid
-    print(f"Bill #{bill_id} created for patient ID {patient_id} for ${amount}.")
+    record_bill(conn, bill_id, patient_id, amount)
+    log.info(f"Bill #{bill_id} created for patient ID {patient_id} for ${amount}.",
+             extra={"bill_id": bill_id, "patient_id": patient_id, "amount": amount})
     return bill_id
 
 def add_receipt(conn, date, bill_id, payment_method):
-    """Adds a receipt, marking a bill as paid."""
+    """Adds a receipt, marking a bill as paid. Returns the receipt ID, or None if it failed."""
     c = conn.cursor()
     try:
         c.execute("INSERT INTO Receipt (date, bill_id, payment_method) VALUES (?, ?, ?)",
                   (date, bill_id, payment_method))
-        print(f"Receipt created for Bill #{bill_id} via {payment_method}.")
+        receipt_id = c.lastrowid
+        record_payment(conn, bill_id, date)
+        log.info(f"Receipt created for Bill #{bill_id} via {payment_method}.",
+                 extra={"receipt_id": receipt_id, "bill_id": bill_id})
+        return receipt_id
     except sqlite3.IntegrityError:
-        print(f"Error: Bill #{bill_id} has already been paid or does not exist.")
+        log.warning(f"Error: Bill #{bill_id} has already been paid or does not exist.", extra={"bill_id": bill_id})
+        return None
+
+def invalidate_doctor_roster(conn, specialization=None):
+    """Drops cached doctor listings once the roster change on conn commits."""
+    def drop():
+        invalidate("doctor_roster")
+        invalidate("specializations")
+        if specialization is None:
+            invalidate("doctors_by_specialization")
+        else:
+            invalidate("doctors_by_specialization", conn, specialization)
+    # Dropping them before the commit would let another reader cache the old roster again
+    conn.after_commit(drop)
 
+@cached("doctor_roster")
+@replica_read
 def get_doctors(conn):
     """Returns a list of all doctors."""
     c = conn.cursor()
+    c.row_factory = row_factory(Doctor)
     c.execute("""
         SELECT U.user_id, U.name, D.specialization 
         FROM User U
@@ -203,9 +170,59 @@ def get_doctors(conn):
     """)
     return c.fetchall()
 
+@cached("specializations")
+@replica_read
+def get_specializations(conn):
+    """Returns the distinct doctor specializations, alphabetically."""
+    c = conn.cursor()
+    c.execute("SELECT DISTINCT specialization FROM Doctor WHERE specialization IS NOT NULL ORDER BY specialization")
+    return [row[0] for row in c.fetchall()]
+
+@cached("doctors_by_specialization")
+@replica_read
+def get_doctors_by_specialization(conn, specialization):
+    """Returns a Doctor (user_id, name, specialization) for every doctor with a specialization."""
+    c = conn.cursor()
+    c.row_factory = row_factory(Doctor)
+    c.execute("""
+        SELECT U.user_id, U.name, D.specialization
+        FROM Doctor D
+        JOIN User U ON U.user_id = D.doctor_id
+        WHERE D.specialization = ?
+        ORDER BY D.doctor_id
+    """, (specialization,))
+    return c.fetchall()
+
+@cached("patient_profile")
+def get_patient_profile(conn, patient_id):
+    """Returns a PatientProfile (user_id, name, email, phone, address), or None."""
+    c = conn.cursor()
+    c.row_factory = row_factory(PatientProfile)
+    c.execute("""
+        SELECT U.user_id, U.name, U.email, P.phone, P.address
+        FROM Patient P
+        JOIN User U ON U.user_id = P.patient_id
+        WHERE P.patient_id = ?
+    """, (patient_id,))
+    return c.fetchone()
+
+def get_patient_profiles(conn, patient_ids):
+    """Returns {patient_id: PatientProfile} for many patients from one query; unknown IDs are left out."""
+    c = conn.cursor()
+    c.row_factory = row_factory(PatientProfile)
+    c.execute("""
+        SELECT U.user_id, U.name, U.email, P.phone, P.address
+        FROM Patient P
+        JOIN User U ON U.user_id = P.patient_id
+        WHERE P.patient_id IN (SELECT value FROM json_each(?))
+    """, (json.dumps(list(patient_ids)),))
+    return {profile.patient_id: profile for profile in c}
+
+@replica_read
 def get_patients(conn):
     """Returns a list of all patients."""
     c = conn.cursor()
+    c.row_factory = row_factory(Patient)
     c.execute("""
         SELECT U.user_id, U.name, P.phone, P.address
         FROM User U
@@ -214,20 +231,29 @@ def get_patients(conn):
     return c.fetchall()
 
 def get_appointments_by_doctor(conn, doctor_id):
-    """Gets all appointments for a specific doctor."""
+    """Gets all appointments for a specific doctor, oldest first.
+
+    For a day or a date range use get_doctor_schedule or get_day_sheet.
+    """
     c = conn.cursor()
+    c.row_factory = row_factory(DoctorAppointment)
     c.execute("""
         SELECT A.appointment_id, A.appointment_date, U.name AS patient_name, P.phone
         FROM Appointment A
         JOIN Patient P ON A.patient_id = P.patient_id
         JOIN User U ON P.patient_id = U.user_id
         WHERE A.doctor_id = ?
+        ORDER BY A.appointment_date, A.appointment_id
     """, (doctor_id,))
     return c.fetchall()
 
-def get_appointments_by_patient(conn, patient_id):
-    """Gets all appointments for a specific patient."""
+def get_appointments_by_patient(conn, patient_id, full_history=False):
+    """Gets all appointments for a specific patient.
+
+    With full_history, archived appointments are included, oldest first.
+    """
     c = conn.cursor()
+    c.row_factory = row_factory(PatientAppointment)
     c.execute("""
         SELECT A.appointment_id, A.appointment_date, U.name AS doctor_name, D.specialization
         FROM Appointment A
@@ -235,33 +261,50 @@ def get_appointments_by_patient(conn, patient_id):
         JOIN User U ON D.doctor_id = U.user_id
         WHERE A.patient_id = ?
     """, (patient_id,))
-    return c.fetchall()
+    rows = c.fetchall()
+    if full_history:
+        import archive
+        rows = archive.merge_history(rows, archive.archived_appointments_by_patient(conn, patient_id))
+    return rows
 
-def get_reports_by_patient(conn, patient_id):
-    """Gets all medical reports for a specific patient."""
+def get_reports_by_patient(conn, patient_id, full_history=False):
+    """Gets all medical reports for a specific patient.
+
+    With full_history, archived reports are included, oldest first.
+    """
     c = conn.cursor()
+    c.row_factory = row_factory(Report)
     c.execute("""
         SELECT R.report_id, R.report_date, R.report_details, U.name AS doctor_name
         FROM MedicalReport R
         JOIN User U ON R.doctor_id = U.user_id
         WHERE R.patient_id = ?
     """, (patient_id,))
-    return c.fetchall()
+    rows = c.fetchall()
+    if full_history:
+        import archive
+        rows = archive.merge_history(rows, archive.archived_reports_by_patient(conn, patient_id))
+    return rows
 
 def get_unpaid_bills_by_patient(conn, patient_id):
     """Gets all bills for a patient that do not have a receipt."""
     c = conn.cursor()
+    c.row_factory = row_factory(Bill)
     c.execute("""
-        SELECT B.bill_id, B.date, B.details, B.amount
+        SELECT B.bill_id, B.date, B.details, B.amount, 'Unpaid' AS status
         FROM Billing B
         LEFT JOIN Receipt R ON B.bill_id = R.bill_id
         WHERE B.patient_id = ? AND R.receipt_id IS NULL
     """, (patient_id,))
     return c.fetchall()
 
-def get_all_bills_by_patient(conn, patient_id):
-    """Gets all bills for a patient, indicating if paid."""
+def get_all_bills_by_patient(conn, patient_id, full_history=False):
+    """Gets all bills for a patient, indicating if paid.
+
+    With full_history, archived (always paid) bills are included, oldest first.
+    """
     c = conn.cursor()
+    c.row_factory = row_factory(Bill)
     c.execute("""
         SELECT B.bill_id, B.date, B.details, B.amount,
                CASE WHEN R.receipt_id IS NOT NULL THEN 'Paid' ELSE 'Unpaid' END AS status
@@ -269,11 +312,555 @@ def get_all_bills_by_patient(conn, patient_id):
         LEFT JOIN Receipt R ON B.bill_id = R.bill_id
         WHERE B.patient_id = ?
     """, (patient_id,))
+    rows = c.fetchall()
+    if full_history:
+        import archive
+        rows = archive.merge_history(rows, archive.archived_bills_by_patient(conn, patient_id))
+    return rows
+
+def get_receipts_by_patient(conn, patient_id):
+    """Gets every receipt for a patient's bills, oldest bill first."""
+    c = conn.cursor()
+    c.row_factory = row_factory(Receipt)
+    c.execute("""
+        SELECT R.receipt_id, R.date, R.bill_id, B.amount, R.payment_method
+        FROM Billing B
+        JOIN Receipt R ON R.bill_id = B.bill_id
+        WHERE B.patient_id = ?
+        ORDER BY B.date, B.bill_id
+    """, (patient_id,))
     return c.fetchall()
 
+# --- Patient timeline ---
+# Every event in a patient's chart comes back from one UNION ALL query, each
+# branch an index range on its table's (patient_id, date), already merged in
+# date order: no per-table round trips and no sorting in Python. {match} is
+# "= :patient_id" for one chart or an IN over a JSON array for many; :since
+# ("" for everything) trims long histories inside the index range.
+
+# Same-day events sort in the order they happen: registered, seen, reported on, billed, paid
+TIMELINE_KINDS = ("registration", "appointment", "report", "bill", "payment")
+
+_TIMELINE_SQL = """
+    SELECT patient_id, date, time, kind, event_id, title, detail, amount FROM (
+        SELECT G.patient_id, G.date, NULL AS time, 'registration' AS kind, 0 AS rank, G.regn_id AS event_id,
+               'Registration' AS title, G.patient_history AS detail, NULL AS amount
+        FROM PatientRegistration G
+        WHERE G.patient_id {match} AND G.date >= :since
+        UNION ALL
+        SELECT A.patient_id, A.appointment_date, A.appointment_time, 'appointment', 1, A.appointment_id,
+               U.name, D.specialization, NULL
+        FROM Appointment A
+        JOIN Doctor D ON D.doctor_id = A.doctor_id
+        JOIN User U ON U.user_id = A.doctor_id
+        WHERE A.patient_id {match} AND A.appointment_date >= :since
+        UNION ALL
+        SELECT M.patient_id, M.report_date, NULL, 'report', 2, M.report_id, U.name, M.report_details, NULL
+        FROM MedicalReport M
+        JOIN User U ON U.user_id = M.doctor_id
+        WHERE M.patient_id {match} AND M.report_date >= :since
+        UNION ALL
+        SELECT B.patient_id, B.date, NULL, 'bill', 3, B.bill_id, B.details, COALESCE(S.status, 'Unpaid'), B.amount
+        FROM Billing B
+        LEFT JOIN BillStatus S ON S.bill_id = B.bill_id
+        WHERE B.patient_id {match} AND B.date >= :since
+        UNION ALL
+        SELECT B.patient_id, R.date, NULL, 'payment', 4, R.receipt_id, R.payment_method, 'Bill #' || B.bill_id,
+               B.amount
+        FROM Billing B
+        JOIN Receipt R ON R.bill_id = B.bill_id
+        WHERE B.patient_id {match} AND R.date >= :since
+    )
+    ORDER BY patient_id, date, rank, time, event_id
+"""
+
+_TIMELINE_ONE = _TIMELINE_SQL.format(match="= :patient_id")
+_TIMELINE_MANY = _TIMELINE_SQL.format(match="IN (SELECT value FROM json_each(:patient_ids))")
+_KIND_RANK = {kind: rank for rank, kind in enumerate(TIMELINE_KINDS)}
+
+def _timeline_key(event):
+    return event.date, _KIND_RANK[event.kind], event.time or "", event.event_id
+
+def _with_archived(events, archived):
+    """Merges archived events into a timeline, dropping any event found in both."""
+    if not archived:
+        return events
+    live = {(event.kind, event.event_id) for event in events}
+    return sorted(events + [event for event in archived if (event.kind, event.event_id) not in live],
+                  key=_timeline_key)
+
+def get_patient_timeline(conn, patient_id, since=None, full_history=False):
+    """Returns a patient's chart as TimelineEvent records, oldest first, in one query.
+
+    since (YYYY-MM-DD) keeps only events on or after that date.
+    """
+    c = conn.cursor()
+    c.row_factory = row_factory(TimelineEvent)
+    c.execute(_TIMELINE_ONE, {"patient_id": patient_id, "since": since or ""})
+    events = c.fetchall()
+    if full_history:
+        import archive
+        archived = archive.archived_timelines(conn, [patient_id], since).get(patient_id)
+        events = _with_archived(events, archived)
+    return events
+
+def get_timelines(conn, patient_ids, since=None, full_history=False):
+    """Returns {patient_id: [TimelineEvent, ...]} for many patients from one query.
+
+    Keys keep the order of patient_ids; patients with no events map to [].
+    """
+    timelines = {patient_id: [] for patient_id in patient_ids}
+    if not timelines:
+        return timelines
+    c = conn.cursor()
+    c.row_factory = row_factory(TimelineEvent)
+    c.execute(_TIMELINE_MANY, {"patient_ids": json.dumps(list(timelines)), "since": since or ""})
+    for event in c:
+        timelines[event.patient_id].append(event)
+    if full_history:
+        import archive
+        for patient_id, archived in archive.archived_timelines(conn, list(timelines), since).items():
+            timelines[patient_id] = _with_archived(timelines[patient_id], archived)
+    return timelines
+
+def get_day_timelines(conn, doctor_id, day, since=None, full_history=False):
+    """Returns get_timelines() for everyone a doctor sees on a day, in appointment order.
+
+    Two queries however many patients are booked, rather than one per chart.
+    """
+    c = conn.cursor()
+    c.execute("""
+        SELECT patient_id FROM Appointment
+        WHERE doctor_id = ? AND appointment_date = ?
+        ORDER BY appointment_time, appointment_id
+    """, (doctor_id, day))
+    return get_timelines(conn, [row[0] for row in c], since, full_history)
+
+# --- Doctor schedules and day sheets ---
+# A date range is one seek into idx_appointment_doctor_date per doctor. Slot
+# times sort after the date; untimed legacy bookings come first in their day.
+
+_SCHEDULE_SQL = """
+    SELECT A.doctor_id, A.appointment_id, A.appointment_date, A.appointment_time, A.patient_id,
+           U.name AS patient_name, P.phone
+    FROM Appointment A
+    JOIN Patient P ON P.patient_id = A.patient_id
+    JOIN User U ON U.user_id = A.patient_id
+    WHERE A.doctor_id {match} AND A.appointment_date BETWEEN :start AND :end
+    ORDER BY A.doctor_id, A.appointment_date, A.appointment_time, A.appointment_id
+"""
+_SCHEDULE_ONE = _SCHEDULE_SQL.format(match="= :doctor_id")
+_SCHEDULE_MANY = _SCHEDULE_SQL.format(match="IN (SELECT value FROM json_each(:doctor_ids))")
+
+def _schedule_entry(cursor, row):
+    return tuple.__new__(ScheduleEntry, row[1:])
+
+def get_doctor_schedule(conn, doctor_id, start, end=None):
+    """Returns a doctor's ScheduleEntry records from start to end (YYYY-MM-DD, inclusive), in time order.
+
+    end defaults to start, giving a single day.
+    """
+    c = conn.cursor()
+    c.row_factory = _schedule_entry
+    c.execute(_SCHEDULE_ONE, {"doctor_id": doctor_id, "start": start, "end": end or start})
+    return c.fetchall()
+
+def get_doctor_schedules(conn, doctor_ids, start, end=None):
+    """Returns {doctor_id: [ScheduleEntry, ...]} for many doctors from one query.
+
+    Keys keep the order of doctor_ids; doctors with nothing booked map to [].
+    """
+    schedules = {doctor_id: [] for doctor_id in doctor_ids}
+    if not schedules:
+        return schedules
+    c = conn.cursor()
+    c.execute(_SCHEDULE_MANY, {"doctor_ids": json.dumps(list(schedules)), "start": start, "end": end or start})
+    new = tuple.__new__
+    for row in c:
+        schedules[row[0]].append(new(ScheduleEntry, row[1:]))
+    return schedules
+
+def get_day_sheet(conn, doctor_id, day):
+    """Returns a doctor's ScheduleEntry records for one day, from the DaySheet cache when it holds the day.
+
+    daysheets.py fills the cache ahead of time; writes that change a day drop
+    its sheet, and a missing sheet is read live with get_doctor_schedule.
+    """
+    row = conn.execute("SELECT sheet FROM DaySheet WHERE doctor_id = ? AND date = ?", (doctor_id, day)).fetchone()
+    if row is None:
+        return get_doctor_schedule(conn, doctor_id, day)
+    new = tuple.__new__
+    return [new(ScheduleEntry, (appointment_id, day, time, patient_id, name, phone))
+            for appointment_id, time, patient_id, name, phone in json.loads(row[0])]
+
+def get_patient_balance(conn, patient_id):
+    """Returns a Balance (billed_total, paid_total, outstanding, open_bills) for a patient."""
+    c = conn.cursor()
+    c.execute("SELECT billed_total, paid_total, open_bills FROM PatientBalance WHERE patient_id = ?",
+              (patient_id,))
+    row = c.fetchone()
+    if row is None:
+        return Balance(0.0, 0.0, 0.0, 0)
+    billed, paid, open_bills = row
+    return Balance(billed, paid, round(billed - paid, 2), open_bills)
+
+def get_total_receivables(conn):
+    """Returns a Balance (billed_total, paid_total, outstanding, open_bills) across the hospital."""
+    c = conn.cursor()
+    c.execute("SELECT billed_total, paid_total, open_bills FROM LedgerTotals WHERE id = 1")
+    row = c.fetchone()
+    if row is None:
+        return Balance(0.0, 0.0, 0.0, 0)
+    billed, paid, open_bills = row
+    return Balance(billed, paid, round(billed - paid, 2), open_bills)
+
+# Typed columns for ColumnBatch: 'q' is a 64-bit integer array, 'd' a double array
+OPEN_BILL_COLUMNS = [("bill_id", "q"), ("patient_id", "q"), ("date", None), ("amount", "d")]
+
+@replica_read
+def get_open_bill_columns(conn, batch_size=STREAM_BATCH_SIZE):
+    """Returns every unpaid bill as a ColumnBatch of bill_id, patient_id, date and amount.
+
+    Hospital-wide reports over all open bills would otherwise hold one tuple
+    per bill; the IDs and amounts are stored in flat arrays instead.
+    """
+    c = conn.cursor()
+    c.execute("""
+        SELECT S.bill_id, S.patient_id, B.date, S.amount
+        FROM BillStatus S
+        JOIN Billing B ON B.bill_id = S.bill_id
+        WHERE S.status = 'Unpaid'
+        ORDER BY S.bill_id
+    """)
+    return ColumnBatch.fetch(c, OPEN_BILL_COLUMNS, batch_size)
+
+def iter_open_bill_columns(conn, batch_size=STREAM_BATCH_SIZE):
+    """Streams every unpaid bill in bill_id order as ColumnBatch chunks of up to batch_size bills.
+
+    Each chunk is its own query seeking past the last bill_id seen, so memory
+    stays bounded by one chunk however many bills are open.
+    """
+    after = 0
+    while True:
+        c = conn.cursor()
+        c.execute("""
+            SELECT S.bill_id, S.patient_id, B.date, S.amount
+            FROM BillStatus S
+            JOIN Billing B ON B.bill_id = S.bill_id
+            WHERE S.status = 'Unpaid' AND S.bill_id > ?
+            ORDER BY S.bill_id
+            LIMIT ?
+        """, (after, batch_size))
+        batch = ColumnBatch.fetch(c, OPEN_BILL_COLUMNS, batch_size)
+        if not batch:
+            return
+        yield batch
+        after = batch["bill_id"][-1]
+
 def update_patient_details(conn, patient_id, address, phone):
     """Updates a patient's address and phone."""
     c = conn.cursor()
     c.execute("UPDATE Patient SET address = ?, phone = ? WHERE patient_id = ?",
               (address, phone, patient_id))
-    print("Patient details updated.")
\ No newline at end of file
+    conn.after_commit(lambda: invalidate("patient_profile", conn, patient_id))
+    log.info("Patient details updated.", extra={"patient_id": patient_id})
+
+# --- Paginated and streaming listings ---
+# Pages seek past the last key seen instead of using OFFSET, so every page
+# costs the same no matter how deep into the table it is.
+
+@replica_read
+def get_doctors_page(conn, after_id=0, limit=PAGE_SIZE):
+    """Returns up to limit doctors with an ID greater than after_id, in ID order."""
+    c = conn.cursor()
+    c.row_factory = row_factory(Doctor)
+    c.execute("""
+        SELECT U.user_id, U.name, D.specialization
+        FROM Doctor D
+        JOIN User U ON U.user_id = D.doctor_id
+        WHERE D.doctor_id > ?
+        ORDER BY D.doctor_id
+        LIMIT ?
+    """, (after_id, limit))
+    return c.fetchall()
+
+@replica_read
+def get_patients_page(conn, after_id=0, limit=PAGE_SIZE):
+    """Returns up to limit patients with an ID greater than after_id, in ID order."""
+    c = conn.cursor()
+    c.row_factory = row_factory(Patient)
+    c.execute("""
+        SELECT U.user_id, U.name, P.phone, P.address
+        FROM Patient P
+        JOIN User U ON U.user_id = P.patient_id
+        WHERE P.patient_id > ?
+        ORDER BY P.patient_id
+        LIMIT ?
+    """, (after_id, limit))
+    return c.fetchall()
+
+def get_appointments_by_doctor_page(conn, doctor_id, after=None, limit=PAGE_SIZE):
+    """Returns a doctor's appointments ordered by date, after the (date, appointment_id) key."""
+    after_date, after_id = after or ("", 0)
+    c = conn.cursor()
+    c.row_factory = row_factory(DoctorAppointment)
+    c.execute("""
+        SELECT A.appointment_id, A.appointment_date, U.name AS patient_name, P.phone
+        FROM Appointment A
+        JOIN Patient P ON A.patient_id = P.patient_id
+        JOIN User U ON P.patient_id = U.user_id
+        WHERE A.doctor_id = ? AND (A.appointment_date, A.appointment_id) > (?, ?)
+        ORDER BY A.appointment_date, A.appointment_id
+        LIMIT ?
+    """, (doctor_id, after_date, after_id, limit))
+    return c.fetchall()
+
+def get_appointments_by_patient_page(conn, patient_id, after=None, limit=PAGE_SIZE):
+    """Returns a patient's appointments ordered by date, after the (date, appointment_id) key."""
+    after_date, after_id = after or ("", 0)
+    c = conn.cursor()
+    c.row_factory = row_factory(PatientAppointment)
+    c.execute("""
+        SELECT A.appointment_id, A.appointment_date, U.name AS doctor_name, D.specialization
+        FROM Appointment A
+        JOIN Doctor D ON A.doctor_id = D.doctor_id
+        JOIN User U ON D.doctor_id = U.user_id
+        WHERE A.patient_id = ? AND (A.appointment_date, A.appointment_id) > (?, ?)
+        ORDER BY A.appointment_date, A.appointment_id
+        LIMIT ?
+    """, (patient_id, after_date, after_id, limit))
+    return c.fetchall()
+
+def _id_key(row):
+    return row[0]
+
+def _appointment_key(row):
+    return (row[1], row[0])
+
+def _iter_pages(fetch_page, key=_id_key):
+    """Yields successive pages from fetch_page(after) until one comes back empty."""
+    after = None
+    while True:
+        page = fetch_page(after)
+        if not page:
+            return
+        yield page
+        after = key(page[-1])
+
+def iter_doctors(conn, batch_size=STREAM_BATCH_SIZE):
+    """Streams every doctor in ID order without loading them all at once."""
+    for page in _iter_pages(lambda after: get_doctors_page(conn, after or 0, batch_size)):
+        yield from page
+
+def iter_patients(conn, batch_size=STREAM_BATCH_SIZE):
+    """Streams every patient in ID order without loading them all at once."""
+    for page in _iter_pages(lambda after: get_patients_page(conn, after or 0, batch_size)):
+        yield from page
+
+def iter_appointments_by_doctor(conn, doctor_id, batch_size=STREAM_BATCH_SIZE):
+    """Streams a doctor's appointments in date order."""
+    for page in _iter_pages(lambda after: get_appointments_by_doctor_page(conn, doctor_id, after, batch_size),
+                           _appointment_key):
+        yield from page
+
+def iter_appointments_by_patient(conn, patient_id, batch_size=STREAM_BATCH_SIZE):
+    """Streams a patient's appointments in date order."""
+    for page in _iter_pages(lambda after: get_appointments_by_patient_page(conn, patient_id, after, batch_size),
+                           _appointment_key):
+        yield from page
+
+
+# --- Full-text search ---
+
+def match_query(text):
+    """Turns free text into an FTS5 query that matches documents containing every word.
+
+    Words are quoted so punctuation cannot break the query syntax; a trailing
+    '*' keeps prefix matching. Text that already contains double quotes is
+    taken to be an FTS5 query (phrases, OR, NEAR) and passed through as is.
+    """
+    if '"' in text:
+        return text
+    terms = []
+    for word in text.split():
+        prefix = word.endswith("*")
+        word = word.rstrip("*")
+        if word:
+            terms.append(f'"{word}"*' if prefix else f'"{word}"')
+    return " ".join(terms)
+
+def search_reports(conn, text, since=None, limit=SEARCH_LIMIT):
+    """Searches every medical report, best matches first.
+
+    Returns ReportHit (report_id, date, patient_id, patient_name, doctor_name, snippet)
+    rows; since is an optional 'YYYY-MM-DD' lower bound on the report date.
+    """
+    query = match_query(text)
+    if not query:
+        return []
+    start, end = SEARCH_HIGHLIGHT
+    c = conn.cursor()
+    c.row_factory = row_factory(ReportHit)
+    c.execute("""
+        SELECT R.report_id, R.report_date, R.patient_id, PU.name AS patient_name, DU.name AS doctor_name,
+               snippet(ReportSearch, 0, ?, ?, '...', ?)
+        FROM ReportSearch
+        JOIN MedicalReport R ON R.report_id = ReportSearch.rowid
+        JOIN User PU ON PU.user_id = R.patient_id
+        JOIN User DU ON DU.user_id = R.doctor_id
+        WHERE ReportSearch MATCH ? AND R.report_date >= ?
+        ORDER BY ReportSearch.rank
+        LIMIT ?
+    """, (start, end, SEARCH_SNIPPET_TOKENS, query, since or "", limit))
+    return c.fetchall()
+
+def search_patient_history(conn, text, limit=SEARCH_LIMIT):
+    """Searches registration histories, best matches first.
+
+    Returns HistoryHit (patient_id, patient_name, date, snippet) rows.
+    """
+    query = match_query(text)
+    if not query:
+        return []
+    start, end = SEARCH_HIGHLIGHT
+    c = conn.cursor()
+    c.row_factory = row_factory(HistoryHit)
+    c.execute("""
+        SELECT PR.patient_id, U.name AS patient_name, PR.date,
+               snippet(HistorySearch, 0, ?, ?, '...', ?)
+        FROM HistorySearch
+        JOIN PatientRegistration PR ON PR.regn_id = HistorySearch.rowid
+        JOIN User U ON U.user_id = PR.patient_id
+        WHERE HistorySearch MATCH ?
+        ORDER BY HistorySearch.rank
+        LIMIT ?
+    """, (start, end, SEARCH_SNIPPET_TOKENS, query, limit))
+    return c.fetchall()
+
+
+# --- Name, email and phone lookup ---
+# Lookups return UserMatch (user_id, name, email, phone, role) rows; phone is None for
+# non-patients. role narrows the search to 'patient', 'doctor' or 'admin'.
+
+_LOOKUP_COLUMNS = "U.user_id, U.name, U.email, P.phone, U.role"
+
+def _prefix_bounds(prefix):
+    """Range [lo, hi) holding every string that starts with prefix."""
+    return prefix, prefix + "\U0010ffff"
+
+def find_users_by_prefix(conn, prefix, role=None, limit=LOOKUP_LIMIT):
+    """Users whose name, email or phone starts with prefix (case-insensitive), by name.
+
+    Each branch walks its index in order and stops after limit rows, so a
+    short, common prefix costs no more than a long one.
+    """
+    prefix = prefix.strip()
+    if not prefix:
+        return []
+    lo, hi = _prefix_bounds(prefix)
+    role_filter = "AND role = :role" if role else ""
+    c = conn.cursor()
+    c.row_factory = row_factory(UserMatch)
+    c.execute(f"""
+        SELECT {_LOOKUP_COLUMNS} FROM (
+            SELECT user_id FROM (
+                SELECT user_id FROM User
+                WHERE name >= :lo COLLATE NOCASE AND name < :hi COLLATE NOCASE {role_filter}
+                ORDER BY name COLLATE NOCASE LIMIT :limit)
+            UNION
+            SELECT user_id FROM (
+                SELECT user_id FROM User
+                WHERE email >= :lo COLLATE NOCASE AND email < :hi COLLATE NOCASE {role_filter}
+                ORDER BY email COLLATE NOCASE LIMIT :limit)
+            UNION
+            SELECT patient_id FROM (
+                SELECT patient_id FROM Patient
+                WHERE phone >= :lo AND phone < :hi AND COALESCE(:role, 'patient') = 'patient'
+                ORDER BY phone LIMIT :limit)
+        ) M
+        JOIN User U ON U.user_id = M.user_id
+        LEFT JOIN Patient P ON P.patient_id = U.user_id
+        ORDER BY U.name COLLATE NOCASE, U.user_id
+        LIMIT :limit
+    """, {"lo": lo, "hi": hi, "role": role, "limit": limit})
+    return c.fetchall()
+
+def _similarity(text, row):
+    """Similarity (0..1) of text to whichever of the row's name, email or phone it looks like."""
+    if "@" in text:
+        value = row.email
+    elif sum(ch.isdigit() for ch in text) * 2 > len(text):
+        value = row.phone
+    else:
+        value = row.name
+    return SequenceMatcher(None, text.lower(), (value or "").lower()).ratio()
+
+def _fuzzy_match_query(conn, text):
+    """Builds the trigram MATCH query for text, or returns None if nothing can match.
+
+    Trigrams are taken rarest first until their combined document count would
+    exceed FUZZY_POSTINGS, which bounds the cost of ranking. If even the
+    rarest is that common, the text is matched as a whole instead.
+    """
+    trigrams = {text[i:i + 3].lower() for i in range(len(text) - 2)}
+    if not trigrams:
+        return None
+    placeholders = ", ".join("?" for _ in trigrams)
+    counts = conn.execute(f"SELECT term, doc FROM UserLookupTerms WHERE term IN ({placeholders}) ORDER BY doc",
+                          sorted(trigrams)).fetchall()
+    if not counts:
+        return None
+
+    quote = lambda term: '"{}"'.format(term.replace('"', '""'))
+    chosen, postings = [], 0
+    for term, doc in counts:
+        if postings + doc > FUZZY_POSTINGS:
+            break
+        chosen.append(term)
+        postings += doc
+    if not chosen:
+        return " AND ".join(quote(term) for term, _ in counts), False
+    return " OR ".join(quote(term) for term in chosen), True
+
+def fuzzy_find_users(conn, text, role=None, limit=LOOKUP_LIMIT):
+    """Typo-tolerant lookup: users sharing trigrams with text, most similar first.
+
+    The trigram index narrows millions of users to FUZZY_CANDIDATES (of the
+    given role, if any), which are then re-ranked by edit similarity in Python.
+    """
+    text = " ".join(text.split())
+    match = _fuzzy_match_query(conn, text)
+    if match is None:
+        return []
+    query, ranked = match
+    # The role is filtered before the candidate LIMIT, or a common name could
+    # fill every candidate slot with users of other roles
+    role_join = "JOIN User R ON R.user_id = UserLookup.rowid AND R.role = ?" if role else ""
+    c = conn.cursor()
+    c.row_factory = row_factory(UserMatch)
+    c.execute(f"""
+        SELECT {_LOOKUP_COLUMNS}
+        FROM (SELECT UserLookup.rowid AS user_id FROM UserLookup {role_join}
+              WHERE UserLookup MATCH ? {"ORDER BY rank" if ranked else ""} LIMIT ?) M
+        JOIN User U ON U.user_id = M.user_id
+        LEFT JOIN Patient P ON P.patient_id = U.user_id
+    """, ((role,) if role else ()) + (query, FUZZY_CANDIDATES))
+    scored = [(_similarity(text, row), row) for row in c.fetchall()]
+    scored = [item for item in scored if item[0] >= FUZZY_MIN_SCORE]
+    scored.sort(key=lambda item: (-item[0], item[1].user_id))
+    return [row for _, row in scored[:limit]]
+
+def lookup_users(conn, text, role=None, limit=LOOKUP_LIMIT):
+    """Prefix matches first, topped up with fuzzy matches when there are too few."""
+    rows = find_users_by_prefix(conn, text, role, limit)
+    if len(rows) < limit:
+        seen = {row.user_id for row in rows}
+        rows += [row for row in fuzzy_find_users(conn, text, role, limit)
+                 if row.user_id not in seen][:limit - len(rows)]
+    return rows
+
+
+if METRICS_ENABLED:
+    # Replaces the functions above with timed wrappers before anything imports them
+    from metrics import instrument_module
+    instrument_module(globals())
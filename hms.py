@@ -0,0 +1,325 @@
+import argparse
+import os
+import sys
+
+# One-shot command-line interface for scripts and cron jobs:
+#
+#     python hms.py appointments --doctor 5
+#     python hms.py bill create --patient 12 --amount 80 --details "X-ray"
+#     python hms.py backup --list
+#
+# Only argparse, os and sys are imported up front. Each command imports the
+# modules it needs when it runs, so listing a doctor's appointments never
+# loads the API, the menus or the seeder, and --database takes effect because
+# config.py has not been read yet. The schema is migrated only when the stored
+# version is behind the code's, which costs a single PRAGMA otherwise.
+#
+# Results are written as tab-separated rows under a header line, or as one
+# JSON object per line with --json. Log messages go to stderr.
+
+# Tools with their own command line, run as if invoked directly: hms <tool> [args]
+TOOLS = {
+    "menu": ("main", "Interactive menus"),
+    "serve": ("api", "HTTP/JSON API server"),
+    "migrate": ("migrations", "Schema migrations (--status, --dry-run)"),
+    "seed": ("seed", "Sample or synthetic data"),
+    "import": ("importer", "Bulk CSV/JSONL import"),
+    "backup": ("backup", "Online backup, verify and restore"),
+    "replica": ("replica", "Refresh or check the read replica snapshot"),
+    "archive": ("archive", "Move old rows to yearly archives"),
+    "daysheets": ("daysheets", "Build doctors' day sheets for a date range"),
+    "analytics": ("analytics", "Refresh and query the rollups"),
+    "ledger": ("ledger", "Verify or rebuild the billing ledger"),
+    "receivables": ("receivables", "Ageing, dunning lists and payment files"),
+    "fts": ("search", "Check or rebuild the full-text indexes"),
+    "plans": ("indexes", "Check that query plans use indexes"),
+    "bench": ("bench", "Benchmark db.py functions and startup"),
+    "stress": ("stress", "Concurrent sessions and lock-contention report"),
+}
+
+
+def run_tool(name, argv):
+    """Runs a tool module's command line with argv as its arguments."""
+    import runpy
+    module = TOOLS[name][0]
+    sys.argv = [f"{module}.py"] + list(argv)
+    runpy.run_module(module, run_name="__main__", alter_sys=True)
+
+
+def _connection():
+    """Returns a pooled connection context, migrating the schema first if it is behind."""
+    from connection import get_connection
+    from db import init_db
+    init_db()
+    return get_connection()
+
+
+def emit(rows, as_json=False, out=None):
+    """Writes records (NamedTuples) as TSV with a header, or as JSON lines. Returns the row count."""
+    out = out or sys.stdout
+    count = 0
+    if as_json:
+        import json
+        for count, row in enumerate(rows, 1):
+            out.write(json.dumps(row._asdict(), default=str) + "\n")
+        return count
+    for count, row in enumerate(rows, 1):
+        if count == 1:
+            out.write("\t".join(row._fields) + "\n")
+        out.write("\t".join("" if value is None else str(value) for value in row) + "\n")
+    return count
+
+
+def fail(message):
+    print(message, file=sys.stderr)
+    sys.exit(1)
+
+
+# --- Commands ---
+# Each takes an open connection and the parsed arguments, imports db.py and
+# friends only when called, and returns the records to write (or None when
+# it printed already). Generators are written as they stream, while the
+# connection is still open.
+
+def cmd_doctors(conn, args):
+    import db
+    if args.specialization:
+        return db.get_doctors_by_specialization(conn, args.specialization)
+    return db.iter_doctors(conn)
+
+
+def cmd_patient(conn, args):
+    import db
+    profile = db.get_patient_profile(conn, args.patient_id)
+    if profile is None:
+        fail(f"No patient #{args.patient_id}.")
+    return [profile]
+
+
+def cmd_appointments(conn, args):
+    import db
+    if args.doctor is not None:
+        return db.iter_appointments_by_doctor(conn, args.doctor)
+    if args.full_history:
+        return db.get_appointments_by_patient(conn, args.patient, full_history=True)
+    return db.iter_appointments_by_patient(conn, args.patient)
+
+
+def cmd_reports(conn, args):
+    import db
+    return db.get_reports_by_patient(conn, args.patient, full_history=args.full_history)
+
+
+def cmd_timeline(conn, args):
+    import db
+    if args.doctor is not None:
+        timelines = db.get_day_timelines(conn, args.doctor, args.date or _today(), args.since, args.full_history)
+        return (event for events in timelines.values() for event in events)
+    return db.get_patient_timeline(conn, args.patient, args.since, args.full_history)
+
+
+def cmd_schedule(conn, args):
+    import db
+    day = args.date or _today()
+    if args.end:
+        return db.get_doctor_schedule(conn, args.doctor, day, args.end)
+    return db.get_day_sheet(conn, args.doctor, day)
+
+
+def cmd_search(conn, args):
+    import db
+    return db.search_reports(conn, args.text, since=args.since, limit=args.limit)
+
+
+def cmd_lookup(conn, args):
+    import db
+    return db.lookup_users(conn, args.text, role=args.role, limit=args.limit)
+
+
+def cmd_slots(conn, args):
+    import scheduling
+    return scheduling.find_free_slots(conn, args.specialization, args.days, args.limit)
+
+
+def cmd_book(conn, args):
+    import scheduling
+    scheduling.slot_index.ensure_current(conn)
+    try:
+        appointment_id = scheduling.book_slot(conn, args.doctor, args.patient, args.date, args.time)
+    except ValueError as e:
+        fail(str(e))
+    if appointment_id is None:
+        fail(f"{args.date} {args.time} is already booked.")
+    print(appointment_id)
+
+
+def cmd_bill_list(conn, args):
+    import db
+    if args.unpaid:
+        return db.get_unpaid_bills_by_patient(conn, args.patient)
+    return db.get_all_bills_by_patient(conn, args.patient, full_history=args.full_history)
+
+
+def cmd_bill_create(conn, args):
+    import sqlite3
+    import db
+    if args.amount <= 0:
+        fail("Amount must be positive.")
+    try:
+        print(db.add_billing(conn, args.amount, args.date or _today(), args.patient, args.details))
+    except sqlite3.IntegrityError:
+        fail(f"No patient #{args.patient}.")
+
+
+def cmd_bill_pay(conn, args):
+    import db
+    receipt_id = db.add_receipt(conn, args.date or _today(), args.bill_id, args.method)
+    if receipt_id is None:
+        sys.exit(1)  # db.py has logged why
+    print(receipt_id)
+
+
+def cmd_balance(conn, args):
+    import db
+    if args.patient is None:
+        return [db.get_total_receivables(conn)]
+    return [db.get_patient_balance(conn, args.patient)]
+
+
+def _today():
+    from datetime import date
+    return date.today().isoformat()
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        prog="hms", description="Hospital management from the command line.",
+        epilog="tools (run with their own options, e.g. 'hms backup --help'):\n"
+               + "\n".join(f"  {name:<12} {help_text}" for name, (_, help_text) in TOOLS.items()),
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--database", help="Database file (default: $HMS_DATABASE or hospital.db)")
+    parser.add_argument("--json", action="store_true", help="Write one JSON object per line")
+    parser.add_argument("--verbose", "-v", action="store_true", help="Log progress messages to stderr")
+    commands = parser.add_subparsers(dest="command", metavar="command")
+    commands.required = True
+
+    p = commands.add_parser("doctors", help="List doctors")
+    p.add_argument("--specialization")
+    p.set_defaults(handler=cmd_doctors)
+
+    p = commands.add_parser("patient", help="Show a patient's profile")
+    p.add_argument("patient_id", type=int)
+    p.set_defaults(handler=cmd_patient)
+
+    p = commands.add_parser("appointments", help="List a doctor's or a patient's appointments")
+    who = p.add_mutually_exclusive_group(required=True)
+    who.add_argument("--doctor", type=int)
+    who.add_argument("--patient", type=int)
+    p.add_argument("--full-history", action="store_true", help="Include archived appointments (patients only)")
+    p.set_defaults(handler=cmd_appointments)
+
+    p = commands.add_parser("reports", help="List a patient's medical reports")
+    p.add_argument("--patient", type=int, required=True)
+    p.add_argument("--full-history", action="store_true", help="Include archived reports")
+    p.set_defaults(handler=cmd_reports)
+
+    p = commands.add_parser("timeline", help="A patient's chart, or the charts of a doctor's day list, by date")
+    who = p.add_mutually_exclusive_group(required=True)
+    who.add_argument("--patient", type=int)
+    who.add_argument("--doctor", type=int, help="Everyone the doctor sees on --date")
+    p.add_argument("--date", help="Day list date, YYYY-MM-DD (default: today)")
+    p.add_argument("--since", help="Only events on or after YYYY-MM-DD")
+    p.add_argument("--full-history", action="store_true", help="Include archived events")
+    p.set_defaults(handler=cmd_timeline)
+
+    p = commands.add_parser("schedule", help="A doctor's day sheet, or appointments over a date range")
+    p.add_argument("--doctor", type=int, required=True)
+    p.add_argument("--date", help="YYYY-MM-DD (default: today)")
+    p.add_argument("--end", help="Last day of a range, YYYY-MM-DD")
+    p.set_defaults(handler=cmd_schedule)
+
+    p = commands.add_parser("search", help="Full-text search over medical reports")
+    p.add_argument("text")
+    p.add_argument("--since", help="Only reports on or after YYYY-MM-DD")
+    p.add_argument("--limit", type=int, default=50)
+    p.set_defaults(handler=cmd_search)
+
+    p = commands.add_parser("lookup", help="Find users by name, email or phone")
+    p.add_argument("text")
+    p.add_argument("--role", choices=("doctor", "patient", "admin"))
+    p.add_argument("--limit", type=int, default=10)
+    p.set_defaults(handler=cmd_lookup)
+
+    p = commands.add_parser("slots", help="Next free appointment slots for a specialization")
+    p.add_argument("specialization")
+    p.add_argument("--days", type=int, default=7)
+    p.add_argument("--limit", type=int, default=10)
+    p.set_defaults(handler=cmd_slots)
+
+    p = commands.add_parser("book", help="Book a slot; prints the appointment ID")
+    p.add_argument("--doctor", type=int, required=True)
+    p.add_argument("--patient", type=int, required=True)
+    p.add_argument("--date", required=True, help="YYYY-MM-DD")
+    p.add_argument("--time", required=True, help="HH:MM")
+    p.set_defaults(handler=cmd_book)
+
+    p = commands.add_parser("bill", help="List, create or pay bills")
+    bill = p.add_subparsers(dest="action", metavar="action")
+    bill.required = True
+    b = bill.add_parser("list", help="List a patient's bills")
+    b.add_argument("--patient", type=int, required=True)
+    b.add_argument("--unpaid", action="store_true")
+    b.add_argument("--full-history", action="store_true", help="Include archived bills")
+    b.set_defaults(handler=cmd_bill_list)
+    b = bill.add_parser("create", help="Create a bill; prints its ID")
+    b.add_argument("--patient", type=int, required=True)
+    b.add_argument("--amount", type=float, required=True)
+    b.add_argument("--details", default="")
+    b.add_argument("--date", help="YYYY-MM-DD (default: today)")
+    b.set_defaults(handler=cmd_bill_create)
+    b = bill.add_parser("pay", help="Record payment of a bill; prints the receipt ID")
+    b.add_argument("bill_id", type=int)
+    b.add_argument("--method", default="Cash")
+    b.add_argument("--date", help="YYYY-MM-DD (default: today)")
+    b.set_defaults(handler=cmd_bill_pay)
+
+    p = commands.add_parser("balance", help="A patient's balance, or the hospital's receivables")
+    p.add_argument("--patient", type=int)
+    p.set_defaults(handler=cmd_balance)
+    return parser
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else list(argv)
+    # Global options may come before a tool name
+    head = []
+    while argv and argv[0].split("=")[0] in ("--database", "--verbose", "-v", "--json"):
+        head.append(argv.pop(0))
+        if head[-1] == "--database" and argv:
+            head.append(argv.pop(0))
+    database = argparse.ArgumentParser(add_help=False)
+    database.add_argument("--database")
+    database = database.parse_known_args(head)[0].database
+    if database:
+        # Before anything imports config.py
+        os.environ["HMS_DATABASE"] = database
+
+    if argv and argv[0] in TOOLS:
+        return run_tool(argv[0], argv[1:])
+
+    args = build_parser().parse_args(head + argv)
+    from logs import configure_logging
+    configure_logging("INFO" if args.verbose else "WARNING", stream=sys.stderr)
+    try:
+        with _connection() as conn:
+            result = args.handler(conn, args)
+            if result is not None:
+                emit(result, args.json)
+        sys.stdout.flush()
+    except BrokenPipeError:
+        # The reader (head, grep -m) stopped early; that is not an error
+        os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,270 @@
+import argparse
+import csv
+import json
+import os
+import time
+from datetime import date
+from itertools import islice
+from db import invalidate_doctor_roster
+from ledger import record_bills
+from passwords import hash_password, is_hashed
+
+DEFAULT_CHUNK_SIZE = 5000
+
+ROLE_TABLES = {
+    "doctor": ("INSERT INTO Doctor (doctor_id, specialization) VALUES (?, ?)",
+               lambda uid, row: (uid, row.get("specialization") or "General")),
+    "patient": ("INSERT INTO Patient (patient_id, address, phone) VALUES (?, ?, ?)",
+                lambda uid, row: (uid, row.get("address") or "N/A", row.get("phone") or "N/A")),
+    "admin": ("INSERT INTO Administrator (admin_id) VALUES (?)",
+              lambda uid, row: (uid,)),
+}
+
+# Input kind -> role forced onto every row (None means the row's own 'role' column)
+USER_KINDS = {"users": None, "doctors": "doctor", "patients": "patient", "admins": "admin"}
+KINDS = list(USER_KINDS) + ["appointments", "bills"]
+
+
+def read_rows(path):
+    """Streams dict rows from a .csv or .jsonl file, numbered from 1."""
+    with open(path, newline="", encoding="utf-8") as f:
+        if path.endswith(".csv"):
+            for n, row in enumerate(csv.DictReader(f), 1):
+                yield n, row
+        else:
+            for n, line in enumerate(f, 1):
+                if line.strip():
+                    yield n, json.loads(line)
+
+
+def chunked(iterable, size):
+    """Yields lists of up to size items."""
+    it = iter(iterable)
+    while True:
+        chunk = list(islice(it, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def _existing(conn, sql, values):
+    """Returns the subset of values already present, querying in IN-list batches."""
+    found = set()
+    values = list(values)
+    for i in range(0, len(values), 500):
+        batch = values[i:i + 500]
+        marks = ",".join("?" * len(batch))
+        found.update(r[0] for r in conn.execute(sql.format(marks), batch))
+    return found
+
+
+def _int_or_none(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _is_date(value):
+    """True for a YYYY-MM-DD string; archive.py and the reports take the year from its first four characters."""
+    try:
+        return date.fromisoformat(value).isoformat() == value
+    except (TypeError, ValueError):
+        return False
+
+
+def _next_id(conn, table, column):
+    """Returns the next id for a table, honouring AUTOINCREMENT's high-water mark."""
+    seq = conn.execute("SELECT seq FROM sqlite_sequence WHERE name = ?", (table,)).fetchone()
+    top = conn.execute(f"SELECT MAX({column}) FROM {table}").fetchone()[0]
+    return max(seq[0] if seq else 0, top or 0) + 1
+
+
+def _hash_passwords(chunk):
+    """Hashes a chunk's plaintext passwords on a thread pool. Returns {line number: hash}.
+
+    Runs before the chunk's transaction: at tens of milliseconds per hash,
+    hashing under the write lock would hold off every other writer for minutes.
+    """
+    plain = [(n, row["password"]) for n, row in chunk
+             if row.get("password") and isinstance(row["password"], str) and not is_hashed(row["password"])]
+    if len(plain) <= 1:
+        return {n: hash_password(password) for n, password in plain}
+    from concurrent.futures import ThreadPoolExecutor
+    # hashlib releases the GIL while hashing, so threads use every core
+    with ThreadPoolExecutor(os.cpu_count() or 1) as pool:
+        return dict(zip([n for n, _ in plain], pool.map(hash_password, [password for _, password in plain])))
+
+
+def _load_users(conn, chunk, forced_role, reject, hashed):
+    seen = set()
+    emails = {row.get("email") for _, row in chunk if isinstance(row.get("email"), str)}
+    taken = _existing(conn, "SELECT email FROM User WHERE email IN ({})", emails)
+
+    accepted = []
+    for n, row in chunk:
+        role = forced_role or row.get("role")
+        email = row.get("email")
+        if not row.get("name") or not email or not row.get("password"):
+            reject(n, row, "missing name, email or password")
+        elif not all(isinstance(row[key], str) for key in ("name", "email", "password")):
+            # JSON lines can carry numbers or lists; CSV values are always text
+            reject(n, row, "name, email and password must be text")
+        elif role not in ROLE_TABLES:
+            reject(n, row, f"invalid role '{role}'")
+        elif email in taken or email in seen:
+            reject(n, row, f"duplicate email '{email}'")
+        else:
+            seen.add(email)
+            accepted.append((n, role, row))
+
+    user_id = _next_id(conn, "User", "user_id")
+    users = []
+    role_rows = {role: [] for role in ROLE_TABLES}
+    for n, role, row in accepted:
+        password = hashed.get(n, row["password"])
+        users.append((user_id, row["name"], row["email"], password, role))
+        role_rows[role].append(ROLE_TABLES[role][1](user_id, row))
+        user_id += 1
+
+    conn.executemany("INSERT INTO User (user_id, name, email, password, role) VALUES (?, ?, ?, ?, ?)",
+                     users)
+    for role, rows in role_rows.items():
+        if rows:
+            conn.executemany(ROLE_TABLES[role][0], rows)
+    if role_rows["doctor"]:
+        invalidate_doctor_roster(conn)
+    return len(users)
+
+
+def _load_appointments(conn, chunk, reject):
+    doctors = _existing(conn, "SELECT doctor_id FROM Doctor WHERE doctor_id IN ({})",
+                        {_int_or_none(row.get("doctor_id")) for _, row in chunk} - {None})
+    patients = _existing(conn, "SELECT patient_id FROM Patient WHERE patient_id IN ({})",
+                         {_int_or_none(row.get("patient_id")) for _, row in chunk} - {None})
+
+    rows = []
+    for n, row in chunk:
+        day = row.get("appointment_date") or row.get("date")
+        doctor_id = _int_or_none(row.get("doctor_id"))
+        patient_id = _int_or_none(row.get("patient_id"))
+        if not day:
+            reject(n, row, "missing appointment_date")
+        elif not _is_date(day):
+            reject(n, row, f"invalid appointment_date {day!r}")
+        elif doctor_id not in doctors:
+            reject(n, row, f"unknown doctor_id {doctor_id}")
+        elif patient_id not in patients:
+            reject(n, row, f"unknown patient_id {patient_id}")
+        else:
+            rows.append((day, doctor_id, patient_id))
+
+    conn.executemany("INSERT INTO Appointment (appointment_date, doctor_id, patient_id) VALUES (?, ?, ?)",
+                     rows)
+    return len(rows)
+
+
+def _load_bills(conn, chunk, reject):
+    patients = _existing(conn, "SELECT patient_id FROM Patient WHERE patient_id IN ({})",
+                         {_int_or_none(row.get("patient_id")) for _, row in chunk} - {None})
+
+    rows = []
+    bill_id = _next_id(conn, "Billing", "bill_id")
+    for n, row in chunk:
+        patient_id = _int_or_none(row.get("patient_id"))
+        try:
+            amount = float(row.get("amount"))
+        except (TypeError, ValueError):
+            reject(n, row, f"invalid amount {row.get('amount')!r}")
+            continue
+        if not row.get("date"):
+            reject(n, row, "missing date")
+        elif not _is_date(row["date"]):
+            reject(n, row, f"invalid date {row['date']!r}")
+        elif patient_id not in patients:
+            reject(n, row, f"unknown patient_id {patient_id}")
+        else:
+            rows.append((bill_id, amount, row["date"], patient_id, row.get("details")))
+            bill_id += 1
+
+    conn.executemany("INSERT INTO Billing (bill_id, amount, date, patient_id, details) VALUES (?, ?, ?, ?, ?)",
+                     rows)
+    record_bills(conn, [(bill_id, patient_id, amount) for bill_id, amount, _, patient_id, _ in rows])
+    return len(rows)
+
+
+def bulk_load(conn, kind, rows, rejects_file=None, chunk_size=DEFAULT_CHUNK_SIZE, progress=True):
+    """Loads numbered dict rows of the given kind, one transaction per chunk.
+
+    Plaintext user passwords are hashed on the way in; values already in a
+    supported hash format are stored as given.
+
+    Rows that cannot be inserted (duplicate emails, unknown ids, missing
+    fields) are written as JSON lines to rejects_file instead of aborting the
+    load. Returns a dict with inserted/rejected counts and elapsed seconds.
+    """
+    if kind not in KINDS:
+        raise ValueError(f"Unknown import kind '{kind}'. Expected one of: {', '.join(KINDS)}")
+
+    stats = {"inserted": 0, "rejected": 0, "seconds": 0.0}
+
+    def reject(n, row, reason):
+        stats["rejected"] += 1
+        if rejects_file is not None:
+            rejects_file.write(json.dumps({"line": n, "reason": reason, "row": row}) + "\n")
+
+    start = time.perf_counter()
+    for chunk in chunked(rows, chunk_size):
+        hashed = _hash_passwords(chunk) if kind in USER_KINDS else None
+        if conn.in_transaction:
+            conn.commit()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            if kind in USER_KINDS:
+                inserted = _load_users(conn, chunk, USER_KINDS[kind], reject, hashed)
+            elif kind == "appointments":
+                inserted = _load_appointments(conn, chunk, reject)
+            else:
+                inserted = _load_bills(conn, chunk, reject)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        stats["inserted"] += inserted
+
+        if progress:
+            elapsed = time.perf_counter() - start
+            rate = stats["inserted"] / elapsed if elapsed else 0.0
+            print(f"{kind}: {stats['inserted']} inserted, {stats['rejected']} rejected "
+                  f"({rate:,.0f} rows/sec)")
+
+    stats["seconds"] = time.perf_counter() - start
+    return stats
+
+
+def import_file(conn, kind, path, rejects_path=None, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Streams a CSV or JSONL file into the database. Returns the load stats."""
+    rejects_path = rejects_path or path + ".rejects.jsonl"
+    with open(rejects_path, "w", encoding="utf-8") as rejects_file:
+        stats = bulk_load(conn, kind, read_rows(path), rejects_file, chunk_size)
+    if stats["rejected"]:
+        print(f"{stats['rejected']} rejected row(s) written to {rejects_path}")
+    return stats
+
+
+if __name__ == "__main__":
+    from connection import get_connection
+    from db import init_db
+
+    parser = argparse.ArgumentParser(description="Bulk import CSV or JSONL records.")
+    parser.add_argument("kind", choices=KINDS)
+    parser.add_argument("path", help="Input file (.csv or .jsonl)")
+    parser.add_argument("--rejects", help="Where to write rejected rows (default: <path>.rejects.jsonl)")
+    parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE)
+    args = parser.parse_args()
+
+    init_db()
+    with get_connection() as conn:
+        stats = import_file(conn, args.kind, args.path, args.rejects, args.chunk_size)
+    print(f"Done: {stats['inserted']} inserted, {stats['rejected']} rejected "
+          f"in {stats['seconds']:.1f}s.")
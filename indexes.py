@@ -0,0 +1,139 @@
+import re
+import sys
+
+# (index name, table, indexed columns)
+INDEXES = [
+    ("idx_appointment_doctor_date", "Appointment", "doctor_id, appointment_date"),
+    ("idx_appointment_patient_date", "Appointment", "patient_id, appointment_date"),
+    ("idx_report_patient_date", "MedicalReport", "patient_id, report_date"),
+    ("idx_billing_patient_date", "Billing", "patient_id, date"),
+]
+
+# Functions that list a whole table and are expected to scan it.
+FULL_SCAN_ALLOWED = {"get_doctors", "get_patients", "get_specializations", "get_open_bill_columns"}
+
+# Statements FTS5 issues against its own shadow tables show up in the trace too
+FTS_SHADOW_TABLE = re.compile(r"'\w+_(config|data|idx|docsize|content)'")
+VIRTUAL_INDEX = re.compile(r"VIRTUAL TABLE INDEX (\d+):(\S*)")
+
+
+def index_statements(indexes):
+    """Returns the CREATE INDEX statements for a list of index definitions."""
+    return [f"CREATE INDEX IF NOT EXISTS {name} ON {table} ({columns})"
+            for name, table, columns in indexes]
+
+
+def _plan_checks():
+    """Returns (function name, call) pairs exercising every query in db.py."""
+    import db
+    return [
+        ("get_user_by_email", lambda conn: db.get_user_by_email(conn, "probe@example.com")),
+        ("get_doctors", db.get_doctors),
+        ("get_patients", db.get_patients),
+        ("get_specializations", db.get_specializations),
+        ("get_doctors_by_specialization", lambda conn: db.get_doctors_by_specialization(conn, "General")),
+        ("get_appointments_by_doctor", lambda conn: db.get_appointments_by_doctor(conn, 1)),
+        ("get_appointments_by_patient", lambda conn: db.get_appointments_by_patient(conn, 1)),
+        ("get_reports_by_patient", lambda conn: db.get_reports_by_patient(conn, 1)),
+        ("get_unpaid_bills_by_patient", lambda conn: db.get_unpaid_bills_by_patient(conn, 1)),
+        ("get_all_bills_by_patient", lambda conn: db.get_all_bills_by_patient(conn, 1)),
+        ("get_receipts_by_patient", lambda conn: db.get_receipts_by_patient(conn, 1)),
+        ("get_patient_timeline", lambda conn: db.get_patient_timeline(conn, 1)),
+        ("get_timelines", lambda conn: db.get_timelines(conn, [1, 2, 3])),
+        ("get_day_timelines", lambda conn: db.get_day_timelines(conn, 1, "2024-01-01")),
+        ("get_doctor_schedule", lambda conn: db.get_doctor_schedule(conn, 1, "2024-01-01", "2024-01-07")),
+        ("get_doctor_schedules", lambda conn: db.get_doctor_schedules(conn, [1, 2, 3], "2024-01-01", "2024-01-07")),
+        ("get_day_sheet", lambda conn: db.get_day_sheet(conn, 1, "2024-01-01")),
+        ("get_open_bill_columns", db.get_open_bill_columns),
+        ("iter_open_bill_columns", lambda conn: next(db.iter_open_bill_columns(conn), None)),
+        ("get_doctors_page", lambda conn: db.get_doctors_page(conn, 1)),
+        ("get_patients_page", lambda conn: db.get_patients_page(conn, 1)),
+        ("get_appointments_by_doctor_page",
+         lambda conn: db.get_appointments_by_doctor_page(conn, 1, ("2024-01-01", 1))),
+        ("get_appointments_by_patient_page",
+         lambda conn: db.get_appointments_by_patient_page(conn, 1, ("2024-01-01", 1))),
+        ("get_patient_balance", lambda conn: db.get_patient_balance(conn, 1)),
+        ("get_total_receivables", db.get_total_receivables),
+        ("get_patient_profile", lambda conn: db.get_patient_profile(conn, 1)),
+        ("get_patient_profiles", lambda conn: db.get_patient_profiles(conn, [1, 2, 3])),
+        ("update_patient_details", lambda conn: db.update_patient_details(conn, 1, "-", "-")),
+        ("search_reports", lambda conn: db.search_reports(conn, "pain", "2023-01-01")),
+        ("search_patient_history", lambda conn: db.search_patient_history(conn, "asthma")),
+        ("find_users_by_prefix", lambda conn: db.find_users_by_prefix(conn, "jo", "patient")),
+        ("fuzzy_find_users", lambda conn: db.fuzzy_find_users(conn, "Jonh Smtih", "patient")),
+    ]
+
+
+def explain(conn, sql):
+    """Returns the EXPLAIN QUERY PLAN detail lines for a fully bound statement."""
+    return [row[3] for row in conn.execute("EXPLAIN QUERY PLAN " + sql)]
+
+
+def check_query_plans(conn):
+    """Runs EXPLAIN QUERY PLAN on every db.py query.
+
+    Returns a list of (function name, sql, plan line) for each unexpected full
+    table SCAN. An empty list means every lookup is served by an index.
+    """
+    from cache import clear_all
+
+    failures = []
+    for name, call in _plan_checks():
+        # A cache hit would skip the query we want to explain
+        clear_all()
+        statements = []
+        conn.set_trace_callback(statements.append)
+        try:
+            # With a transaction open, reads marked @replica_read stay on this connection
+            conn.execute("BEGIN")
+            call(conn)
+        finally:
+            conn.set_trace_callback(None)
+            conn.rollback()
+
+        for sql in statements:
+            if FTS_SHADOW_TABLE.search(sql):
+                continue
+            if sql.lstrip().upper().startswith(("SELECT", "UPDATE", "DELETE")):
+                plan = explain(conn, sql)
+                derived = {line.split()[1] for line in plan if line.startswith(("MATERIALIZE", "CO-ROUTINE"))}
+                for line in plan:
+                    if _scans(line, derived) and name not in FULL_SCAN_ALLOWED:
+                        failures.append((name, " ".join(sql.split()), line))
+    return failures
+
+
+def _scans(line, derived):
+    """True if an EXPLAIN QUERY PLAN line reads a whole table."""
+    # An AUTOMATIC index is built by scanning the table on every run
+    if "AUTOMATIC" in line:
+        return True
+    if not line.startswith("SCAN"):
+        return False
+    # Subquery results are already bounded by the plan that produced them
+    if line.split()[1] in derived:
+        return False
+    # json_each walks the bound JSON argument (a list of IDs), not a table
+    if line.split()[1] == "json_each":
+        return False
+    virtual = VIRTUAL_INDEX.search(line)
+    if virtual:
+        # FTS5 marks a MATCH constraint with "M"; fts5vocab sets bit 1 for term =
+        idx_num, idx_str = int(virtual.group(1)), virtual.group(2)
+        return "M" not in idx_str and not ("Terms" in line and idx_num & 1)
+    return True
+
+
+if __name__ == "__main__":
+    from connection import get_connection
+    from db import init_db
+
+    init_db()
+    with get_connection() as conn:
+        failures = check_query_plans(conn)
+
+    if failures:
+        for name, sql, line in failures:
+            print(f"FAIL {name}: {line}\n    {sql}")
+        sys.exit(1)
+    print("All query plans use indexes.")
@@ -0,0 +1,212 @@
+import argparse
+import json
+import sys
+from collections import defaultdict
+
+# BillStatus, PatientBalance and LedgerTotals are maintained incrementally in
+# the same transaction as the Billing/Receipt write that changes them, so a
+# patient's outstanding balance or the hospital-wide receivables are a single
+# primary-key read. rebuild() and verify() recompute everything from Billing
+# and Receipt for recovery and auditing, adding back the per-patient totals
+# of paid bills that archive.py has moved out (ArchivedBalance).
+
+# Amounts are REAL, so sums accumulated in different orders can differ slightly
+TOLERANCE = 0.005
+
+
+def record_bill(conn, bill_id, patient_id, amount):
+    """Adds a new unpaid bill to the ledger."""
+    record_bills(conn, [(bill_id, patient_id, amount)])
+
+
+def record_bills(conn, bills):
+    """Adds many new unpaid bills, given as (bill_id, patient_id, amount) tuples."""
+    if not bills:
+        return
+    c = conn.cursor()
+    c.executemany("INSERT INTO BillStatus (bill_id, patient_id, amount, status) VALUES (?, ?, ?, 'Unpaid')",
+                  bills)
+
+    per_patient = defaultdict(lambda: [0.0, 0])
+    for _, patient_id, amount in bills:
+        per_patient[patient_id][0] += amount
+        per_patient[patient_id][1] += 1
+    c.executemany("""
+        INSERT INTO PatientBalance (patient_id, billed_total, paid_total, open_bills) VALUES (?, ?, 0, ?)
+        ON CONFLICT(patient_id) DO UPDATE SET
+            billed_total = billed_total + excluded.billed_total,
+            open_bills = open_bills + excluded.open_bills
+    """, [(patient_id, total, count) for patient_id, (total, count) in per_patient.items()])
+
+    _bump_totals(c, billed=sum(amount for _, _, amount in bills), open_bills=len(bills))
+
+
+def record_payment(conn, bill_id, paid_date):
+    """Marks a bill paid in the ledger. Returns False if it was unknown or already paid."""
+    return not record_payments(conn, [(bill_id, paid_date)])
+
+
+def record_payments(conn, payments):
+    """Marks many bills paid, given as (bill_id, paid_date) tuples.
+
+    Returns the bill IDs that were unknown or already paid (or repeated), which are left alone.
+    """
+    if not payments:
+        return []
+    c = conn.cursor()
+    open_bills = {bill_id: (patient_id, amount) for bill_id, patient_id, amount in c.execute(
+        "SELECT bill_id, patient_id, amount FROM BillStatus "
+        "WHERE bill_id IN (SELECT value FROM json_each(?)) AND status = 'Unpaid'",
+        (json.dumps([bill_id for bill_id, _ in payments]),))}
+
+    paid, skipped = [], []
+    per_patient = defaultdict(lambda: [0.0, 0])
+    for bill_id, paid_date in payments:
+        bill = open_bills.pop(bill_id, None)
+        if bill is None:
+            skipped.append(bill_id)
+            continue
+        paid.append((paid_date, bill_id))
+        per_patient[bill[0]][0] += bill[1]
+        per_patient[bill[0]][1] += 1
+    if not paid:
+        return skipped
+
+    c.executemany("UPDATE BillStatus SET status = 'Paid', paid_date = ? WHERE bill_id = ?", paid)
+    c.executemany("UPDATE PatientBalance SET paid_total = paid_total + ?, open_bills = open_bills - ? "
+                  "WHERE patient_id = ?",
+                  [(total, count, patient_id) for patient_id, (total, count) in per_patient.items()])
+    _bump_totals(c, paid=sum(total for total, _ in per_patient.values()), open_bills=-len(paid))
+    return skipped
+
+
+def _bump_totals(c, billed=0.0, paid=0.0, open_bills=0):
+    c.execute("""
+        INSERT INTO LedgerTotals (id, billed_total, paid_total, open_bills) VALUES (1, ?, ?, ?)
+        ON CONFLICT(id) DO UPDATE SET
+            billed_total = billed_total + excluded.billed_total,
+            paid_total = paid_total + excluded.paid_total,
+            open_bills = open_bills + excluded.open_bills
+    """, (billed, paid, open_bills))
+
+
+# --- Rebuild and verification ---
+
+_EXPECTED_STATUS = """
+    SELECT B.bill_id, B.patient_id, B.amount,
+           CASE WHEN R.receipt_id IS NULL THEN 'Unpaid' ELSE 'Paid' END AS status, R.date AS paid_date
+    FROM Billing B
+    LEFT JOIN Receipt R ON R.bill_id = B.bill_id
+"""
+
+# Archived bills were all paid, so they count fully towards both totals
+_BALANCE_FROM = """
+    SELECT patient_id, SUM(billed) AS billed_total, TOTAL(paid) AS paid_total, SUM(open_bill) AS open_bills
+    FROM (
+        SELECT patient_id, amount AS billed, CASE WHEN status = 'Paid' THEN amount END AS paid,
+               status = 'Unpaid' AS open_bill
+        FROM ({})
+        UNION ALL
+        SELECT patient_id, billed_total, billed_total, 0 FROM ArchivedBalance
+    ) GROUP BY patient_id
+"""
+
+_EXPECTED_BALANCE = _BALANCE_FROM.format(_EXPECTED_STATUS)
+
+
+def verify(conn, limit=20):
+    """Recomputes the ledger from Billing and Receipt and compares it with the stored one.
+
+    Returns a dict with drift counts and up to limit sample rows of each kind.
+    """
+    drift = {}
+    drift["bill_status"] = conn.execute(f"""
+        SELECT E.bill_id, E.status, S.status, E.amount, S.amount
+        FROM ({_EXPECTED_STATUS}) E
+        LEFT JOIN BillStatus S ON S.bill_id = E.bill_id
+        WHERE S.bill_id IS NULL OR S.status <> E.status OR ABS(S.amount - E.amount) > {TOLERANCE}
+        UNION ALL
+        SELECT S.bill_id, NULL, S.status, NULL, S.amount
+        FROM BillStatus S WHERE NOT EXISTS (SELECT 1 FROM Billing B WHERE B.bill_id = S.bill_id)
+    """).fetchall()
+    drift["patient_balance"] = conn.execute(f"""
+        SELECT E.patient_id, E.billed_total, P.billed_total, E.paid_total, P.paid_total,
+               E.open_bills, P.open_bills
+        FROM ({_EXPECTED_BALANCE}) E
+        LEFT JOIN PatientBalance P ON P.patient_id = E.patient_id
+        WHERE P.patient_id IS NULL OR ABS(P.billed_total - E.billed_total) > {TOLERANCE}
+           OR ABS(P.paid_total - E.paid_total) > {TOLERANCE} OR P.open_bills <> E.open_bills
+    """).fetchall()
+
+    expected = conn.execute(f"""
+        SELECT TOTAL(billed_total), TOTAL(paid_total), COALESCE(SUM(open_bills), 0)
+        FROM ({_EXPECTED_BALANCE})
+    """).fetchone()
+    stored = conn.execute("SELECT billed_total, paid_total, open_bills FROM LedgerTotals WHERE id = 1"
+                          ).fetchone() or (0.0, 0.0, 0)
+    totals_ok = (abs(expected[0] - stored[0]) <= TOLERANCE * max(1, expected[2])
+                 and abs(expected[1] - stored[1]) <= TOLERANCE * max(1, expected[2])
+                 and expected[2] == stored[2])
+
+    return {
+        "bill_status_drift": len(drift["bill_status"]),
+        "patient_balance_drift": len(drift["patient_balance"]),
+        "totals_ok": totals_ok,
+        "expected_totals": expected,
+        "stored_totals": tuple(stored),
+        "samples": {kind: rows[:limit] for kind, rows in drift.items()},
+    }
+
+
+def rebuild(conn):
+    """Replaces the whole ledger with one recomputed from Billing and Receipt."""
+    if conn.in_transaction:
+        conn.commit()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        conn.execute("DELETE FROM BillStatus")
+        conn.execute(f"INSERT INTO BillStatus (bill_id, patient_id, amount, status, paid_date) {_EXPECTED_STATUS}")
+        conn.execute("DELETE FROM PatientBalance")
+        conn.execute("INSERT INTO PatientBalance (patient_id, billed_total, paid_total, open_bills) "
+                     + _BALANCE_FROM.format("SELECT patient_id, amount, status FROM BillStatus"))
+        conn.execute("""
+            INSERT OR REPLACE INTO LedgerTotals (id, billed_total, paid_total, open_bills)
+            SELECT 1, TOTAL(billed_total), TOTAL(paid_total), COALESCE(SUM(open_bills), 0) FROM PatientBalance
+        """)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+
+
+if __name__ == "__main__":
+    from connection import get_connection
+    from db import init_db
+
+    parser = argparse.ArgumentParser(description="Verify or rebuild the billing ledger.")
+    parser.add_argument("--rebuild", action="store_true", help="Recompute the ledger from scratch")
+    parser.add_argument("--repair", action="store_true", help="Rebuild only if drift is found")
+    args = parser.parse_args()
+
+    init_db()
+    with get_connection() as conn:
+        if args.rebuild:
+            rebuild(conn)
+            print("Ledger rebuilt.")
+            sys.exit(0)
+
+        report = verify(conn)
+        print(f"Bill status drift: {report['bill_status_drift']} row(s)")
+        print(f"Patient balance drift: {report['patient_balance_drift']} row(s)")
+        print(f"Totals: stored {report['stored_totals']} vs expected {report['expected_totals']}"
+              f" ({'ok' if report['totals_ok'] else 'DRIFT'})")
+        for kind, rows in report["samples"].items():
+            for row in rows:
+                print(f"  {kind}: {row}")
+
+        clean = not report["bill_status_drift"] and not report["patient_balance_drift"] and report["totals_ok"]
+        if not clean and args.repair:
+            rebuild(conn)
+            print("Ledger rebuilt.")
+        elif not clean:
+            sys.exit(1)
@@ -0,0 +1,147 @@
+import argparse
+import asyncio
+import json
+import random
+import time
+from urllib.parse import quote, urlsplit
+from bench import summarize
+from connection import get_connection
+
+PASSWORD = "pass123"
+
+
+class Client:
+    """One keep-alive HTTP/1.1 connection speaking JSON."""
+
+    def __init__(self, host, port):
+        self.host, self.port = host, port
+        self.reader = self.writer = None
+        self.token = None
+
+    async def request(self, method, path, payload=None):
+        if self.writer is None:
+            self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+        body = json.dumps(payload).encode() if payload is not None else b""
+        headers = f"{method} {path} HTTP/1.1\r\nHost: {self.host}\r\nContent-Length: {len(body)}\r\n"
+        if self.token:
+            headers += f"Authorization: Bearer {self.token}\r\n"
+        self.writer.write(headers.encode() + b"\r\n" + body)
+        await self.writer.drain()
+
+        status = int((await self.reader.readline()).split()[1])
+        length, close = 0, False
+        while True:
+            line = await self.reader.readline()
+            if line in (b"\r\n", b""):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            name = name.strip().lower()
+            if name == "content-length":
+                length = int(value)
+            elif name == "connection" and value.strip().lower() == "close":
+                close = True
+        data = json.loads(await self.reader.readexactly(length)) if length else None
+        if close:
+            self.close()
+        return status, data
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+            self.reader = self.writer = None
+
+
+def sample_accounts(limit):
+    """Returns (emails of some patients, list of specializations) from the local database."""
+    with get_connection() as conn:
+        emails = [row[0] for row in conn.execute(
+            "SELECT email FROM User WHERE role = 'patient' ORDER BY random() LIMIT ?", (limit,))]
+        specializations = [row[0] for row in conn.execute(
+            "SELECT DISTINCT specialization FROM Doctor WHERE specialization IS NOT NULL")]
+    return emails, specializations
+
+
+async def session(client, email, specializations, deadline, rng, results):
+    """Logs in as one patient and issues a weighted mix of reads and bookings until deadline."""
+    status, data = await client.request("POST", "/login", {"email": email, "password": PASSWORD})
+    if status != 200:
+        results["errors"][f"login {status}"] = results["errors"].get(f"login {status}", 0) + 1
+        return
+    client.token = data["token"]
+
+    while time.monotonic() < deadline:
+        roll = rng.random()
+        if roll < 0.25:
+            name, call = "doctors", ("GET", f"/doctors?after={rng.randint(0, 50)}&limit=20", None)
+        elif roll < 0.45:
+            name, call = "appointments", ("GET", "/appointments", None)
+        elif roll < 0.60:
+            name, call = "bills", ("GET", "/bills?unpaid=1", None)
+        elif roll < 0.75:
+            name, call = "balance", ("GET", "/balance", None)
+        elif roll < 0.85:
+            name, call = "reports", ("GET", "/reports", None)
+        elif roll < 0.95 or not specializations:
+            spec = rng.choice(specializations) if specializations else ""
+            name, call = "slots", ("GET", f"/slots?specialization={quote(spec)}&limit=5", None)
+        else:
+            name = "book"
+            spec = rng.choice(specializations)
+            status, slots = await client.request("GET", f"/slots?specialization={quote(spec)}&limit=5")
+            if status != 200 or not slots:
+                continue
+            slot = rng.choice(slots)
+            call = ("POST", "/appointments",
+                    {"doctor_id": slot["doctor_id"], "date": slot["date"], "time": slot["time"]})
+
+        started = time.perf_counter()
+        status, _ = await client.request(*call)
+        results["latencies"].setdefault(name, []).append(time.perf_counter() - started)
+        # A lost booking race is an expected outcome, not an error
+        if status != 200 and not (name == "book" and status == 409):
+            key = f"{name} {status}"
+            results["errors"][key] = results["errors"].get(key, 0) + 1
+
+
+async def run(url, clients, duration, seed=None):
+    parts = urlsplit(url)
+    emails, specializations = sample_accounts(clients)
+    if not emails:
+        raise SystemExit("No patients in the database; run seed.py --generate first.")
+
+    rng = random.Random(seed)
+    results = {"latencies": {}, "errors": {}}
+    pool = [Client(parts.hostname, parts.port or 80) for _ in range(clients)]
+    deadline = time.monotonic() + duration
+    started = time.monotonic()
+    try:
+        await asyncio.gather(*(
+            session(client, emails[i % len(emails)], specializations, deadline,
+                    random.Random(rng.random()), results)
+            for i, client in enumerate(pool)))
+    finally:
+        for client in pool:
+            client.close()
+    elapsed = time.monotonic() - started
+
+    all_latencies = [t for values in results["latencies"].values() for t in values]
+    print(f"{clients} clients, {elapsed:.1f}s, {len(all_latencies)} requests, "
+          f"{len(all_latencies) / elapsed:.0f} req/s")
+    print(f"{'request':<14}{'count':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for name, values in sorted(results["latencies"].items()) + [("all", all_latencies)]:
+        stats = summarize(values, 0)
+        print(f"{name:<14}{stats['calls']:>8}{stats['p50_ms']:>10.2f}{stats['p95_ms']:>10.2f}"
+              f"{stats['p99_ms']:>10.2f}")
+    for key, count in sorted(results["errors"].items()):
+        print(f"  error {key}: {count}")
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Drive the HTTP API with many concurrent keep-alive clients.")
+    parser.add_argument("--url", default="http://127.0.0.1:8080")
+    parser.add_argument("--clients", type=int, default=200)
+    parser.add_argument("--duration", type=float, default=10.0, help="Seconds to run")
+    parser.add_argument("--seed", type=int)
+    args = parser.parse_args()
+    asyncio.run(run(args.url, args.clients, args.duration, args.seed))
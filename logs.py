@@ -0,0 +1,53 @@
+import json
+import logging
+import sys
+from config import LOG_LEVEL, LOG_FORMAT, SLOW_QUERY_LOG
+
+# Library modules log under the "hms" logger instead of printing, so nothing
+# reaches stdout unless an entry point asks for it. Extra fields passed with
+# extra={...} are kept as structured data by the JSON format.
+
+_STANDARD_FIELDS = set(vars(logging.makeLogRecord({}))) | {"message", "asctime"}
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line: time, level, logger, message and any extra fields."""
+
+    def format(self, record):
+        entry = {"time": round(record.created, 3), "level": record.levelname, "logger": record.name,
+                 "message": record.getMessage()}
+        entry.update((key, value) for key, value in vars(record).items() if key not in _STANDARD_FIELDS)
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+def configure_logging(level=LOG_LEVEL, fmt=LOG_FORMAT, stream=None):
+    """Routes "hms" log records to stream (stdout by default) at the given level.
+
+    level "OFF" drops them all. The text format prints just the message, so the
+    menus read exactly as they did when db.py printed. Slow queries go to
+    SLOW_QUERY_LOG as JSON lines instead when that is set.
+    """
+    logger = logging.getLogger("hms")
+    for handler in list(logger.handlers):
+        logger.removeHandler(handler)
+    logger.propagate = False
+    if str(level).upper() == "OFF":
+        logger.setLevel(logging.CRITICAL + 1)
+        return logger
+
+    logger.setLevel(str(level).upper())
+    handler = logging.StreamHandler(stream or sys.stdout)
+    handler.setFormatter(JsonFormatter() if fmt == "json" else logging.Formatter("%(message)s"))
+    logger.addHandler(handler)
+
+    slow = logging.getLogger("hms.slow")
+    for handler in list(slow.handlers):
+        slow.removeHandler(handler)
+    slow.propagate = not SLOW_QUERY_LOG
+    if SLOW_QUERY_LOG:
+        handler = logging.FileHandler(SLOW_QUERY_LOG)
+        handler.setFormatter(JsonFormatter())
+        slow.addHandler(handler)
+    return logger
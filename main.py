@@ -1,14 +1,19 @@
 import sys
+from connection import get_connection
 from db import init_db, login
 from menus import doctor_menu, patient_menu, admin_menu, main_registration
 from utils import get_int_input, get_yes_no_input
-from seed import seed_data
+from logs import configure_logging
 
 if __name__ == "__main__":
+    configure_logging()
     init_db()
     
-    # Ask to seed data only if DB was likely just created (or on request)
-    if get_yes_no_input("Do you want to add initial sample data (for testing)?"):
+    # Ask to seed data only if the DB was just created (no users yet) or on request
+    with get_connection() as conn:
+        empty = conn.execute("SELECT NOT EXISTS (SELECT 1 FROM User)").fetchone()[0]
+    if ("--seed" in sys.argv or empty) and get_yes_no_input("Do you want to add initial sample data (for testing)?"):
+        from seed import seed_data
         seed_data()
 
     print("\n--- Hospital Management System ---")
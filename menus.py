@@ -1,39 +1,71 @@
 import sqlite3
 from datetime import datetime
-from config import DATABASE_NAME
-from utils import get_int_input, get_date_input
+from config import PAGE_SIZE
+from connection import get_connection
+from receivables import age_receivables, dunning
+from scheduling import book_slot, clear_working_day, find_free_slots, set_working_hours
+from utils import get_int_input, get_date_input, get_yes_no_input, show_paged
 from db import (
-    add_appointment, get_appointments_by_doctor, add_medical_report, get_doctors,
-    get_appointments_by_patient, get_reports_by_patient, get_all_bills_by_patient,
-    get_unpaid_bills_by_patient, add_receipt, update_patient_details, add_user,
-    add_billing, get_patients, add_patient_registration
+    add_medical_report, get_reports_by_patient, get_specializations, get_all_bills_by_patient,
+    get_unpaid_bills_by_patient, get_patient_balance, get_patient_profile, add_receipt,
+    update_patient_details, add_user, add_billing, add_patient_registration, iter_appointments_by_doctor,
+    iter_appointments_by_patient, iter_doctors, iter_patients, lookup_users, search_reports, get_day_timelines,
+    get_patient_timeline, get_day_sheet
 )
 
+def choose_user(conn, prompt, role):
+    """Asks for an ID, or a name/email/phone to look up. Returns the chosen user ID or None."""
+    while True:
+        text = input(prompt).strip()
+        if text.isdigit():
+            return int(text)
+        matches = lookup_users(conn, text, role)
+        if not matches:
+            print("No matches. Try another name, email or phone, or enter an ID.")
+            continue
+        for i, m in enumerate(matches, 1):
+            print(f"{i}. {m.name} | {m.email}" + (f" | {m.phone}" if m.phone else "") + f" (ID {m.user_id})")
+        pick = get_int_input("Choose a number (0 to search again): ")
+        if 1 <= pick <= len(matches):
+            return matches[pick - 1].user_id
+
 def doctor_menu(user):
     """Menu for logged-in doctors."""
     print(f"\n--- Welcome Dr. {user['name']} (Doctor) ---")
-    with sqlite3.connect(DATABASE_NAME) as conn:
+    with get_connection() as conn:
         while True:
             print("\n[Doctor Menu]")
             print("1. View My Appointments")
             print("2. Add Medical Report for Patient")
-            print("3. Logout")
+            print("3. Search Medical Reports")
+            print("4. View Patient Timeline")
+            print("5. Today's Patient Charts")
+            print("6. Logout")
             choice = get_int_input("Enter choice: ")
 
             if choice == 1:
-                # View Appointments
+                # View Appointments: one day's sheet (precomputed by daysheets.py), or everything
                 print("\n-- My Appointments --")
-                appts = get_appointments_by_doctor(conn, user['user_id'])
-                if not appts:
-                    print("You have no upcoming appointments.")
-                else:
-                    for appt in appts:
-                        print(f"ID: {appt[0]} | Date: {appt[1]} | Patient: {appt[2]} (Phone: {appt[3]})")
+                day = input("Date (YYYY-MM-DD, blank for today, 'all' for every appointment): ").strip().lower()
+                if day == "all":
+                    show_paged(iter_appointments_by_doctor(conn, user['user_id'], PAGE_SIZE),
+                               lambda appt: print(f"ID: {appt.appointment_id} | Date: {appt.date} | Patient: {appt.patient_name} (Phone: {appt.phone})"),
+                               "You have no appointments.")
+                    continue
+                day = day or datetime.now().strftime("%Y-%m-%d")
+                try:
+                    datetime.strptime(day, "%Y-%m-%d")
+                except ValueError:
+                    print("Invalid date format. Please use YYYY-MM-DD.")
+                    continue
+                show_paged(get_day_sheet(conn, user['user_id'], day),
+                           lambda appt: print(f"{appt.time or '--:--'} | ID: {appt.appointment_id} | Patient: {appt.patient_name} (ID {appt.patient_id}, Phone: {appt.phone})"),
+                           f"You have no appointments on {day}.")
             
             elif choice == 2:
                 # Add Medical Report
                 print("\n-- Add Medical Report --")
-                patient_id = get_int_input("Enter Patient ID: ")
+                patient_id = choose_user(conn, "Enter Patient ID or name/email/phone: ", "patient")
                 report_date = get_date_input("Enter Report Date (YYYY-MM-DD): ")
                 details = input("Enter Report Details: ")
                 
@@ -44,15 +76,64 @@ def doctor_menu(user):
                     print(f"Error: Patient ID {patient_id} does not exist.")
 
             elif choice == 3:
+                # Search all reports
+                print("\n-- Search Medical Reports --")
+                text = input("Search for: ")
+                since = input("Only reports since (YYYY-MM-DD, blank for all): ").strip() or None
+                try:
+                    results = search_reports(conn, text, since)
+                except sqlite3.OperationalError:
+                    print("Error: Invalid search syntax.")
+                    continue
+                show_paged(results,
+                           lambda r: print(f"Report #{r.report_id} | {r.date} | Patient: {r.patient_name} (ID {r.patient_id}) | Dr. {r.doctor_name}: {r.snippet}"),
+                           "No reports match.")
+
+            elif choice == 4:
+                # One patient's whole chart, oldest first
+                print("\n-- Patient Timeline --")
+                patient_id = choose_user(conn, "Enter Patient ID or name/email/phone: ", "patient")
+                full = get_yes_no_input("Include archived history?")
+                show_paged(get_patient_timeline(conn, patient_id, full_history=full), print_event,
+                           "No history on file for this patient.")
+
+            elif choice == 5:
+                # Every chart for today's appointments, loaded together
+                print("\n-- Today's Patient Charts --")
+                since = input("Only events since (YYYY-MM-DD, blank for all): ").strip() or None
+                timelines = get_day_timelines(conn, user['user_id'], datetime.now().strftime("%Y-%m-%d"), since)
+                if not timelines:
+                    print("You have no appointments today.")
+                for patient_id, events in timelines.items():
+                    print(f"\n== Patient ID {patient_id} ({len(events)} event(s)) ==")
+                    for event in events:
+                        print_event(event)
+
+            elif choice == 6:
                 print("Logging out...")
                 break
             else:
                 print("Invalid choice. Try again.")
 
+def print_event(event):
+    """Prints one TimelineEvent as a single line."""
+    when = f"{event.date} {event.time}" if event.time else event.date
+    if event.kind == "appointment":
+        text = f"Appointment with Dr. {event.title} ({event.detail})"
+    elif event.kind == "report":
+        text = f"Report by Dr. {event.title}: {event.detail}"
+    elif event.kind == "bill":
+        text = f"Bill #{event.event_id} ${event.amount:.2f} [{event.detail}]: {event.title}"
+    elif event.kind == "payment":
+        text = f"Paid ${event.amount:.2f} for {event.detail} via {event.title}"
+    else:
+        text = f"Registered: {event.detail}"
+    print(f"{when} | {text}")
+
 def patient_menu(user):
     """Menu for logged-in patients."""
     print(f"\n--- Welcome {user['name']} (Patient) ---")
-    with sqlite3.connect(DATABASE_NAME) as conn:
+    with get_connection() as conn:
         while True:
             print("\n[Patient Menu]")
             print("1. Book Appointment")
@@ -67,48 +148,66 @@ def patient_menu(user):
             if choice == 1:
                 # Book Appointment
                 print("\n-- Book Appointment --")
-                print("Available Doctors:")
-                doctors = get_doctors(conn)
-                for doc in doctors:
-                    print(f"ID: {doc[0]} | Name: Dr. {doc[1]} | Specialization: {doc[2]}")
-                
-                doctor_id = get_int_input("Enter Doctor ID: ")
-                date = get_date_input("Enter Desired Date (YYYY-MM-DD): ")
-                try:
-                    add_appointment(conn, date, doctor_id, user['user_id'])
+                specializations = get_specializations(conn)
+                if not specializations:
+                    print("No doctors are available.")
+                    continue
+                for i, spec in enumerate(specializations, 1):
+                    print(f"{i}. {spec}")
+                spec_choice = get_int_input("Choose specialization: ")
+                if not 1 <= spec_choice <= len(specializations):
+                    print("Invalid choice.")
+                    continue
+
+                slots = find_free_slots(conn, specializations[spec_choice - 1])
+                if not slots:
+                    print("No free slots in the next 7 days.")
+                    continue
+                print("Next available slots:")
+                for i, slot in enumerate(slots, 1):
+                    print(f"{i}. {slot.date} {slot.time} | Dr. {slot.doctor_name} (ID: {slot.doctor_id})")
+                slot_choice = get_int_input("Choose slot: ")
+                if not 1 <= slot_choice <= len(slots):
+                    print("Invalid choice.")
+                    continue
+
+                slot = slots[slot_choice - 1]
+                if book_slot(conn, slot.doctor_id, user['user_id'], slot.date, slot.time):
                     conn.commit()
-                except sqlite3.IntegrityError:
-                    print(f"Error: Doctor ID {doctor_id} does not exist.")
+                    print(f"Booked with Dr. {slot.doctor_name} on {slot.date} at {slot.time}.")
+                else:
+                    print("Sorry, that slot was just taken. Please choose another.")
 
             elif choice == 2:
                 # View My Appointments
                 print("\n-- My Appointments --")
-                appts = get_appointments_by_patient(conn, user['user_id'])
-                if not appts:
-                    print("You have no appointments.")
-                else:
-                    for appt in appts:
-                        print(f"ID: {appt[0]} | Date: {appt[1]} | Doctor: Dr. {appt[2]} ({appt[3]})")
+                show_paged(iter_appointments_by_patient(conn, user['user_id'], PAGE_SIZE),
+                           lambda appt: print(f"ID: {appt.appointment_id} | Date: {appt.date} | Doctor: Dr. {appt.doctor_name} ({appt.specialization})"),
+                           "You have no appointments.")
             
             elif choice == 3:
                 # View My Medical Reports
                 print("\n-- My Medical Reports --")
-                reports = get_reports_by_patient(conn, user['user_id'])
+                full = get_yes_no_input("Include archived reports?")
+                reports = get_reports_by_patient(conn, user['user_id'], full)
                 if not reports:
                     print("You have no medical reports.")
                 else:
                     for r in reports:
-                        print(f"ID: {r[0]} | Date: {r[1]} | Doctor: Dr. {r[3]}\nDetails: {r[2]}\n---")
+                        print(f"ID: {r.report_id} | Date: {r.date} | Doctor: Dr. {r.doctor_name}\nDetails: {r.details}\n---")
             
             elif choice == 4:
                 # View My Bills
                 print("\n-- My Bills --")
-                bills = get_all_bills_by_patient(conn, user['user_id'])
+                full = get_yes_no_input("Include archived bills?")
+                bills = get_all_bills_by_patient(conn, user['user_id'], full)
                 if not bills:
                     print("You have no bills on file.")
                 else:
                     for b in bills:
-                        print(f"ID: {b[0]} | Date: {b[1]} | Amount: ${b[3]:.2f} | Status: {b[4]}\nDetails: {b[2]}\n---")
+                        print(f"ID: {b.bill_id} | Date: {b.date} | Amount: ${b.amount:.2f} | Status: {b.status}\nDetails: {b.details}\n---")
+                    balance = get_patient_balance(conn, user['user_id'])
+                    print(f"Outstanding balance: ${balance.outstanding:.2f} across {balance.open_bills} unpaid bill(s).")
 
             elif choice == 5:
                 # Pay Bill
@@ -120,11 +219,11 @@ def patient_menu(user):
                 
                 print("Your unpaid bills:")
                 for b in bills:
-                    print(f"ID: {b[0]} | Date: {b[1]} | Details: {b[2]} | Amount: ${b[3]:.2f}")
+                    print(f"ID: {b.bill_id} | Date: {b.date} | Details: {b.details} | Amount: ${b.amount:.2f}")
                 
                 bill_id = get_int_input("Enter Bill ID to pay: ")
                 # Check if the entered ID is valid
-                if bill_id not in [b[0] for b in bills]:
+                if bill_id not in [b.bill_id for b in bills]:
                     print("Invalid Bill ID.")
                     continue
 
@@ -137,6 +236,9 @@ def patient_menu(user):
             elif choice == 6:
                 # Update My Profile
                 print("\n-- Update My Profile --")
+                profile = get_patient_profile(conn, user['user_id'])
+                if profile:
+                    print(f"Current address: {profile.address} | Current phone: {profile.phone}")
                 address = input("Enter new address: ")
                 phone = input("Enter new phone number: ")
                 update_patient_details(conn, user['user_id'], address, phone)
@@ -151,14 +253,16 @@ def patient_menu(user):
 def admin_menu(user):
     """Menu for logged-in administrators."""
     print(f"\n--- Welcome {user['name']} (Admin) ---")
-    with sqlite3.connect(DATABASE_NAME) as conn:
+    with get_connection() as conn:
         while True:
             print("\n[Admin Menu]")
             print("1. Register New User")
             print("2. Create Bill for Patient")
             print("3. View All Patients")
             print("4. View All Doctors")
-            print("5. Logout")
+            print("5. Set Doctor Working Hours")
+            print("6. Receivables Ageing")
+            print("7. Logout")
             choice = get_int_input("Enter choice: ")
 
             if choice == 1:
@@ -189,7 +293,7 @@ def admin_menu(user):
             elif choice == 2:
                 # Create Bill
                 print("\n-- Create Bill --")
-                patient_id = get_int_input("Enter Patient ID to bill: ")
+                patient_id = choose_user(conn, "Enter Patient ID or name/email/phone to bill: ", "patient")
                 amount = float(input("Enter bill amount: $"))
                 date = get_date_input("Enter Bill Date (YYYY-MM-DD): ")
                 details = input("Enter bill details (e.g., 'Consultation Fee'): ")
@@ -203,24 +307,49 @@ def admin_menu(user):
             elif choice == 3:
                 # View All Patients
                 print("\n-- All Patients --")
-                patients = get_patients(conn)
-                if not patients:
-                    print("No patients found.")
-                else:
-                    for p in patients:
-                        print(f"ID: {p[0]} | Name: {p[1]} | Phone: {p[2]} | Address: {p[3]}")
+                show_paged(iter_patients(conn, PAGE_SIZE),
+                           lambda p: print(f"ID: {p.patient_id} | Name: {p.name} | Phone: {p.phone} | Address: {p.address}"),
+                           "No patients found.")
             
             elif choice == 4:
                 # View All Doctors
                 print("\n-- All Doctors --")
-                doctors = get_doctors(conn)
-                if not doctors:
-                    print("No doctors found.")
-                else:
-                    for d in doctors:
-                        print(f"ID: {d[0]} | Name: Dr. {d[1]} | Specialization: {d[2]}")
+                show_paged(iter_doctors(conn, PAGE_SIZE),
+                           lambda d: print(f"ID: {d.doctor_id} | Name: Dr. {d.name} | Specialization: {d.specialization}"),
+                           "No doctors found.")
             
             elif choice == 5:
+                # Set Doctor Working Hours
+                print("\n-- Set Doctor Working Hours --")
+                doctor_id = choose_user(conn, "Enter Doctor ID or name/email: ", "doctor")
+                weekday = get_int_input("Weekday (0=Mon ... 6=Sun): ")
+                start = input("Start time (HH:MM, blank for a day off): ").strip()
+                try:
+                    if not start:
+                        clear_working_day(conn, doctor_id, weekday)
+                    else:
+                        end = input("End time (HH:MM): ").strip()
+                        slot = get_int_input("Slot length in minutes: ")
+                        set_working_hours(conn, doctor_id, weekday, start, end, slot)
+                    conn.commit()
+                    print("Working hours updated.")
+                except (ValueError, sqlite3.IntegrityError) as e:
+                    print(f"Error: {e}")
+
+            elif choice == 6:
+                # Receivables Ageing
+                print("\n-- Receivables Ageing --")
+                ageing = age_receivables(conn)
+                for label, amount, bills in ageing.totals():
+                    print(f"{label:>7} days: ${amount:,.2f} ({bills} bills)")
+                notices = dunning(conn, ageing)
+                print(f"{len(notices)} patient(s) due a dunning notice:")
+                show_paged(notices,
+                           lambda n: print(f"ID: {n.patient_id} | {n.name} | {n.phone} | {n.notice} | "
+                                           f"Overdue: ${n.overdue:,.2f} | Oldest: {n.oldest_days} days"),
+                           "No overdue balances.")
+
+            elif choice == 7:
                 print("Logging out...")
                 break
             else:
@@ -237,7 +366,7 @@ def main_registration():
     history = input("Enter any brief medical history (or 'None'): ")
     reg_date = datetime.now().strftime('%Y-%m-%d')
     
-    with sqlite3.connect(DATABASE_NAME) as conn:
+    with get_connection() as conn:
         # Add the user and patient records
         patient_id = add_user(conn, name, email, password, "patient", address=address, phone=phone)
         
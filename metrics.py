@@ -0,0 +1,402 @@
+import functools
+import inspect
+import json
+import logging
+import re
+import sqlite3
+import threading
+import time
+from bisect import bisect_left
+from config import METRICS_ENABLED, METRICS_STATEMENT_SAMPLE, SLOW_QUERY_MS, LATENCY_BUCKETS_MS
+from connection import Connection
+
+# Instrumentation for db.py. When METRICS_ENABLED is set, db.py wraps every
+# public function with a timer and connect() hands out InstrumentedConnection,
+# whose cursors time SQL statements. When it is off nothing is wrapped, so
+# the hot path is exactly the uninstrumented code.
+#
+# Recorded per db.py function: calls, errors, rows returned and a latency
+# histogram. Per connection: statement latency, commit latency and lock wait,
+# i.e. the time spent in statements that must take the write lock (BEGIN
+# IMMEDIATE, or the first write of a transaction). That includes waiting out
+# busy_timeout behind another writer, plus the statement itself, so it is an
+# upper bound on the wait.
+#
+# Call figures are exact. Statement figures are sampled, because timing every
+# read doubles the cost of the cheapest calls: each thread times one read in
+# METRICS_STATEMENT_SAMPLE and records it with that weight, so statement
+# counts and totals are estimates and a slow read shows up in the slow log
+# only when it was sampled (the db.py call around it always does). Statements
+# that take the write lock are always timed, so lock wait stays exact.
+
+slow_log = logging.getLogger("hms.slow")
+
+BUCKETS = tuple(ms / 1000 for ms in LATENCY_BUCKETS_MS)
+SLOW_SECONDS = SLOW_QUERY_MS / 1000
+perf_counter = time.perf_counter
+
+_WRITE_LOCK = re.compile(r"\s*(INSERT|UPDATE|DELETE|REPLACE|BEGIN\s+(IMMEDIATE|EXCLUSIVE))", re.IGNORECASE)
+
+
+class Histogram:
+    """Counts of observations (in seconds) per latency bucket, plus their total."""
+    __slots__ = ("counts", "count", "sum")
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, seconds, weight=1):
+        self.counts[bisect_left(BUCKETS, seconds)] += weight
+        self.count += weight
+        self.sum += seconds * weight
+
+    def merge(self, other):
+        self.counts = [a + b for a, b in zip(self.counts, other.counts)]
+        self.count += other.count
+        self.sum += other.sum
+
+    def quantile(self, q):
+        """Upper bound of the bucket holding the q-th quantile, in ms (None past the last bucket)."""
+        if not self.count:
+            return 0.0
+        rank, seen = q * self.count, 0
+        for bound, n in zip(BUCKETS, self.counts):
+            seen += n
+            if seen >= rank:
+                return bound * 1000
+        return None
+
+    def summary(self):
+        return {"count": self.count, "total_ms": round(self.sum * 1000, 3),
+                "mean_ms": round(self.sum * 1000 / self.count, 4) if self.count else 0.0,
+                "p50_ms": self.quantile(0.5), "p95_ms": self.quantile(0.95), "p99_ms": self.quantile(0.99)}
+
+
+class CallStats:
+    __slots__ = ("latency", "rows", "errors")
+
+    def __init__(self):
+        self.latency = Histogram()
+        self.rows = 0
+        self.errors = 0
+
+
+class Shard:
+    """One thread's metrics. Threads only ever write their own shard, so recording takes no lock."""
+    __slots__ = ("calls", "statements", "lock_wait", "commits", "slow", "countdown")
+
+    def __init__(self):
+        self.calls = {}
+        self.statements = Histogram()
+        self.lock_wait = Histogram()
+        self.commits = Histogram()
+        self.slow = 0
+        self.countdown = METRICS_STATEMENT_SAMPLE  # Reads left until the next one is timed
+
+
+_local = threading.local()
+_shards = []
+_registered = []
+_lock = threading.Lock()
+
+
+def _new_shard():
+    shard = _local.shard = Shard()
+    with _lock:
+        shard.calls.update((name, CallStats()) for name in _registered)
+        _shards.append(shard)
+    return shard
+
+
+def _shard():
+    try:
+        return _local.shard
+    except AttributeError:
+        return _new_shard()
+
+
+def _rows_in(result):
+    if result is None:
+        return 0
+    if isinstance(result, list) or hasattr(result, "columns"):
+        return len(result)
+    return 1
+
+
+def _record_slow(shard, kind, name, seconds, **fields):
+    shard.slow += 1
+    slow_log.warning("Slow %s %s took %.1f ms", kind, name, seconds * 1000,
+                     extra=dict(fields, kind=kind, target=name, ms=round(seconds * 1000, 3)))
+
+
+def wrap(name, fn):
+    """Returns fn wrapped to record calls, errors, rows and latency under name."""
+    with _lock:
+        _registered.append(name)
+        for shard in _shards:
+            shard.calls[name] = CallStats()
+
+    @functools.wraps(fn)
+    def timed(*args, **kwargs):
+        started = perf_counter()
+        try:
+            result = fn(*args, **kwargs)
+        except BaseException:
+            stats = _shard().calls[name]
+            stats.errors += 1
+            stats.latency.observe(perf_counter() - started)
+            raise
+        elapsed = perf_counter() - started
+        try:
+            stats = _local.shard.calls[name]
+        except AttributeError:
+            stats = _new_shard().calls[name]
+        latency = stats.latency
+        latency.counts[bisect_left(BUCKETS, elapsed)] += 1
+        latency.count += 1
+        latency.sum += elapsed
+        kind = type(result)
+        stats.rows += len(result) if kind is list else 1 if kind is tuple else _rows_in(result)
+        if elapsed >= SLOW_SECONDS:
+            # Arguments are left out on purpose: several calls carry passwords
+            _record_slow(_local.shard, "call", name, elapsed)
+        return result
+
+    timed.__wrapped__ = fn
+    return timed
+
+
+def instrument_module(namespace):
+    """Wraps every public function defined in a module, given its globals().
+
+    Generators are skipped: timing them would only time their creation, and
+    the page queries they are built from are wrapped themselves.
+    """
+    module = namespace["__name__"]
+    for name, value in list(namespace.items()):
+        if (name.startswith("_") or not inspect.isfunction(value) or value.__module__ != module
+                or inspect.isgeneratorfunction(value)):
+            continue
+        namespace[name] = wrap(name, value)
+
+
+def _observe_statement(sql, seconds, locking, weight=1):
+    shard = _shard()
+    shard.statements.observe(seconds, weight)
+    if locking:
+        shard.lock_wait.observe(seconds)
+    if seconds >= SLOW_SECONDS:
+        _record_slow(shard, "statement", sql.split(None, 1)[0].upper() if sql.strip() else "?", seconds,
+                     sql=" ".join(sql.split()))
+
+
+_locks_cache = {}
+_cursor_execute = sqlite3.Cursor.execute
+_connection_cursor = sqlite3.Connection.cursor
+
+
+def _takes_write_lock(sql):
+    """Whether sql takes the write lock when no transaction is open; cached per statement text."""
+    if len(_locks_cache) >= 1024:
+        # SQL built with f-strings (IN lists, table names) would grow this forever
+        _locks_cache.clear()
+    locks = _locks_cache[sql] = _WRITE_LOCK.match(sql) is not None
+    return locks
+
+
+class InstrumentedCursor(sqlite3.Cursor):
+    """Cursor that times every statement that takes the write lock and a sample of the rest."""
+
+    def execute(self, sql, parameters=()):
+        locks = _locks_cache.get(sql)
+        if locks is None:
+            locks = _takes_write_lock(sql)
+        if locks and not self.connection.in_transaction:
+            locking, weight = True, 1
+        else:
+            try:
+                shard = _local.shard
+            except AttributeError:
+                shard = _new_shard()
+            shard.countdown -= 1
+            if shard.countdown:
+                # The common case: a read that is not sampled runs untimed
+                return _cursor_execute(self, sql, parameters)
+            shard.countdown = METRICS_STATEMENT_SAMPLE
+            locking, weight = False, METRICS_STATEMENT_SAMPLE
+        started = perf_counter()
+        try:
+            return _cursor_execute(self, sql, parameters)
+        finally:
+            _observe_statement(sql, perf_counter() - started, locking, weight)
+
+    def executemany(self, sql, seq_of_parameters):
+        locks = _locks_cache.get(sql)
+        if locks is None:
+            locks = _takes_write_lock(sql)
+        locking = locks and not self.connection.in_transaction
+        started = perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            _observe_statement(sql, perf_counter() - started, locking)
+
+
+class InstrumentedConnection(Connection):
+    """Connection whose cursors and commits are timed; used by connect() when METRICS_ENABLED."""
+
+    def cursor(self, factory=InstrumentedCursor):
+        return _connection_cursor(self, factory)
+
+    def execute(self, sql, parameters=()):
+        return _connection_cursor(self, InstrumentedCursor).execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return _connection_cursor(self, InstrumentedCursor).executemany(sql, seq_of_parameters)
+
+    def commit(self):
+        started = perf_counter()
+        try:
+            super().commit()
+        finally:
+            _shard().commits.observe(perf_counter() - started)
+
+
+# --- Export ---
+
+def _merged():
+    """Sums every thread's shard into one (readers may see a write in flight; fine for monitoring)."""
+    total = Shard()
+    with _lock:
+        shards = list(_shards)
+        total.calls = {name: CallStats() for name in _registered}
+    for shard in shards:
+        for name, stats in list(shard.calls.items()):
+            merged = total.calls[name]
+            merged.latency.merge(stats.latency)
+            merged.rows += stats.rows
+            merged.errors += stats.errors
+        total.statements.merge(shard.statements)
+        total.lock_wait.merge(shard.lock_wait)
+        total.commits.merge(shard.commits)
+        total.slow += shard.slow
+    return total
+
+
+def snapshot():
+    """Returns every metric as plain data (see to_json and to_prometheus)."""
+    total = _merged()
+    functions = {name: dict(stats.latency.summary(), rows=stats.rows, errors=stats.errors)
+                 for name, stats in sorted(total.calls.items()) if stats.latency.count}
+    return {"enabled": METRICS_ENABLED, "statement_sample": METRICS_STATEMENT_SAMPLE,
+            "slow_queries": total.slow, "functions": functions,
+            "statements": total.statements.summary(), "lock_wait": total.lock_wait.summary(),
+            "commits": total.commits.summary()}
+
+
+def to_json():
+    return json.dumps(snapshot(), indent=2)
+
+
+def _histogram_lines(metric, histogram, labels=""):
+    lines, cumulative = [], 0
+    for bound, n in zip(BUCKETS + (float("inf"),), histogram.counts):
+        cumulative += n
+        le = "+Inf" if bound == float("inf") else repr(bound)
+        lines.append(f'{metric}_bucket{{{labels}{"," if labels else ""}le="{le}"}} {cumulative}')
+    suffix = f"{{{labels}}}" if labels else ""
+    lines.append(f"{metric}_sum{suffix} {histogram.sum!r}")
+    lines.append(f"{metric}_count{suffix} {histogram.count}")
+    return lines
+
+
+def to_prometheus():
+    """Returns every metric in the Prometheus text exposition format."""
+    total = _merged()
+    calls = [(name, stats) for name, stats in sorted(total.calls.items()) if stats.latency.count]
+    lines = ["# HELP hms_db_call_seconds Latency of db.py calls.",
+             "# TYPE hms_db_call_seconds histogram"]
+    for name, stats in calls:
+        lines += _histogram_lines("hms_db_call_seconds", stats.latency, f'function="{name}"')
+    lines += ["# HELP hms_db_call_errors_total db.py calls that raised.",
+              "# TYPE hms_db_call_errors_total counter"]
+    lines += [f'hms_db_call_errors_total{{function="{name}"}} {stats.errors}' for name, stats in calls]
+    lines += ["# HELP hms_db_rows_total Rows returned by db.py calls.",
+              "# TYPE hms_db_rows_total counter"]
+    lines += [f'hms_db_rows_total{{function="{name}"}} {stats.rows}' for name, stats in calls]
+    for metric, text, histogram in [
+            ("hms_sqlite_statement_seconds", "Latency of individual SQL statements.", total.statements),
+            ("hms_sqlite_lock_wait_seconds", "Time in statements that take the write lock.", total.lock_wait),
+            ("hms_sqlite_commit_seconds", "Latency of commits.", total.commits)]:
+        lines += [f"# HELP {metric} {text}", f"# TYPE {metric} histogram"]
+        lines += _histogram_lines(metric, histogram)
+    lines += ["# HELP hms_slow_queries_total Calls and statements over the slow-query threshold.",
+              "# TYPE hms_slow_queries_total counter", f"hms_slow_queries_total {total.slow}"]
+    return "\n".join(lines) + "\n"
+
+
+def reset():
+    """Zeroes every metric, keeping the registered functions."""
+    with _lock:
+        for shard in _shards:
+            for name in shard.calls:
+                shard.calls[name] = CallStats()
+            shard.statements, shard.lock_wait, shard.commits, shard.slow = Histogram(), Histogram(), Histogram(), 0
+
+
+# --- Overhead benchmark ---
+
+def benchmark(database=None, calls=20000, repeats=5, seed=7):
+    """Times a mix of hot db.py reads plain and instrumented on the same connection setup.
+
+    Both modes run repeats times, interleaved, and the fastest run of each is
+    kept. Returns {mode: seconds}; the difference is the cost of instrumentation.
+    """
+    import random
+    import db
+    from connection import configure
+    from config import DATABASE_NAME
+
+    database = database or DATABASE_NAME
+    rng = random.Random(seed)
+    raw = {name: getattr(getattr(db, name), "__wrapped__", getattr(db, name))
+           for name in ("get_user_by_email", "get_patient_balance", "get_unpaid_bills_by_patient",
+                        "get_appointments_by_patient_page", "get_reports_by_patient")}
+    timed = {name: wrap(f"bench:{name}", fn) for name, fn in raw.items()}
+    conn = sqlite3.connect(database, factory=Connection)
+    patients = [row[0] for row in conn.execute("SELECT patient_id FROM Patient LIMIT 1000")]
+    emails = [row[0] for row in conn.execute("SELECT email FROM User LIMIT 1000")]
+    conn.close()
+    if not patients:
+        raise SystemExit("Need patients; run seed.py --generate first.")
+    work = [(name, rng.choice(emails) if name == "get_user_by_email" else rng.choice(patients))
+            for name in rng.choices(sorted(raw), k=calls)]
+
+    results = {}
+    for _ in range(repeats):
+        for mode, factory, fns in [("plain", Connection, raw), ("instrumented", InstrumentedConnection, timed)]:
+            conn = configure(sqlite3.connect(database, check_same_thread=False, factory=factory))
+            started = time.perf_counter()
+            for name, arg in work:
+                fns[name](conn, arg)
+            elapsed = time.perf_counter() - started
+            conn.close()
+            results[mode] = min(elapsed, results.get(mode, elapsed))
+    return results
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Measure the overhead of db.py instrumentation.")
+    parser.add_argument("--calls", type=int, default=20000)
+    parser.add_argument("--repeats", type=int, default=5)
+    args = parser.parse_args()
+
+    results = benchmark(calls=args.calls, repeats=args.repeats)
+    plain, instrumented = results["plain"], results["instrumented"]
+    print(f"{args.calls} reads: plain {plain * 1e6 / args.calls:.1f} us/call, "
+          f"instrumented {instrumented * 1e6 / args.calls:.1f} us/call "
+          f"(+{(instrumented - plain) * 1e6 / args.calls:.1f} us, {(instrumented / plain - 1) * 100:+.1f}%)")
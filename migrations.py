@@ -0,0 +1,656 @@
+import logging
+import sys
+import time
+from collections import namedtuple
+from indexes import INDEXES, index_statements
+
+log = logging.getLogger("hms.migrations")
+
+# A migration moves the schema from version - 1 to version. Its steps run in
+# order; SQL strings (or callables taking the connection, for steps that need
+# to inspect the schema) run inside one transaction each, Backfill steps copy
+# data in rowid-bounded batches with a commit per batch. Every step must be
+# idempotent (IF NOT EXISTS, INSERT OR IGNORE, ...) because an interrupted
+# migration is re-run from its first step. The version is stamped last.
+Migration = namedtuple("Migration", "version description steps")
+
+# sql is run once per batch with :lo and :hi bound to a rowid range of source_table.
+Backfill = namedtuple("Backfill", "description source_table sql batch_size pause")
+Backfill.__new__.__defaults__ = (5000, 0.0)
+
+BASELINE_SCHEMA = [
+    # User Table (Central)
+    """
+    CREATE TABLE IF NOT EXISTS User (
+        user_id INTEGER PRIMARY KEY AUTOINCREMENT,
+        name TEXT NOT NULL,
+        email TEXT UNIQUE NOT NULL,
+        password TEXT NOT NULL,
+        role TEXT CHECK(role IN ('doctor','patient','admin')) NOT NULL
+    );
+    """,
+    # Doctor Table (Links to User)
+    """
+    CREATE TABLE IF NOT EXISTS Doctor (
+        doctor_id INTEGER PRIMARY KEY,
+        specialization TEXT,
+        FOREIGN KEY(doctor_id) REFERENCES User(user_id)
+    );
+    """,
+    # Patient Table (Links to User)
+    """
+    CREATE TABLE IF NOT EXISTS Patient (
+        patient_id INTEGER PRIMARY KEY,
+        address TEXT,
+        phone TEXT,
+        FOREIGN KEY(patient_id) REFERENCES User(user_id)
+    );
+    """,
+    # Administrator Table (Links to User)
+    """
+    CREATE TABLE IF NOT EXISTS Administrator (
+        admin_id INTEGER PRIMARY KEY,
+        FOREIGN KEY(admin_id) REFERENCES User(user_id)
+    );
+    """,
+    # Appointment Table
+    """
+    CREATE TABLE IF NOT EXISTS Appointment (
+        appointment_id INTEGER PRIMARY KEY AUTOINCREMENT,
+        appointment_date TEXT NOT NULL,
+        doctor_id INTEGER NOT NULL,
+        patient_id INTEGER NOT NULL,
+        FOREIGN KEY(doctor_id) REFERENCES Doctor(doctor_id),
+        FOREIGN KEY(patient_id) REFERENCES Patient(patient_id)
+    );
+    """,
+    # Medical Report Table
+    """
+    CREATE TABLE IF NOT EXISTS MedicalReport (
+        report_id INTEGER PRIMARY KEY AUTOINCREMENT,
+        report_details TEXT NOT NULL,
+        report_date TEXT NOT NULL,
+        patient_id INTEGER NOT NULL,
+        doctor_id INTEGER NOT NULL,
+        FOREIGN KEY(patient_id) REFERENCES Patient(patient_id),
+        FOREIGN KEY(doctor_id) REFERENCES Doctor(doctor_id)
+    );
+    """,
+    # Billing Table
+    """
+    CREATE TABLE IF NOT EXISTS Billing (
+        bill_id INTEGER PRIMARY KEY AUTOINCREMENT,
+        amount REAL NOT NULL,
+        date TEXT NOT NULL,
+        patient_id INTEGER NOT NULL,
+        details TEXT,
+        FOREIGN KEY(patient_id) REFERENCES Patient(patient_id)
+    );
+    """,
+    # Receipt Table (Links to Billing)
+    """
+    CREATE TABLE IF NOT EXISTS Receipt (
+        receipt_id INTEGER PRIMARY KEY AUTOINCREMENT,
+        date TEXT NOT NULL,
+        bill_id INTEGER UNIQUE NOT NULL,
+        payment_method TEXT DEFAULT 'Cash',
+        FOREIGN KEY(bill_id) REFERENCES Billing(bill_id)
+    );
+    """,
+    # Patient Registration Details Table
+    """
+    CREATE TABLE IF NOT EXISTS PatientRegistration (
+        regn_id INTEGER PRIMARY KEY AUTOINCREMENT,
+        date TEXT NOT NULL,
+        patient_history TEXT,
+        patient_id INTEGER UNIQUE NOT NULL,
+        FOREIGN KEY(patient_id) REFERENCES Patient(patient_id)
+    );
+    """,
+]
+
+
+def add_column(table, column, declaration):
+    """Returns an idempotent step adding a column if the table lacks it."""
+    def step(conn):
+        columns = {row[1] for row in conn.execute(f"PRAGMA table_info({table})")}
+        if column not in columns:
+            conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {declaration}")
+    step.__doc__ = f"ADD COLUMN {table}.{column} {declaration}"
+    return step
+
+
+def replace_trigger(name, sql):
+    """Returns a step that drops a trigger and creates its new definition in the same transaction."""
+    def step(conn):
+        conn.execute(f"DROP TRIGGER IF EXISTS {name}")
+        conn.execute(sql)
+    step.__doc__ = f"REPLACE TRIGGER {name}"
+    return step
+
+
+MIGRATIONS = [
+    Migration(1, "Baseline tables and secondary index set",
+              BASELINE_SCHEMA + index_statements(INDEXES)),
+    Migration(2, "Doctor working hours and slot-based appointments", [
+        """
+        CREATE TABLE IF NOT EXISTS DoctorSchedule (
+            doctor_id INTEGER NOT NULL,
+            weekday INTEGER NOT NULL CHECK(weekday BETWEEN 0 AND 6),
+            start_time TEXT NOT NULL,
+            end_time TEXT NOT NULL,
+            slot_minutes INTEGER NOT NULL DEFAULT 30,
+            PRIMARY KEY (doctor_id, weekday),
+            FOREIGN KEY(doctor_id) REFERENCES Doctor(doctor_id)
+        );
+        """,
+        add_column("Appointment", "appointment_time", "TEXT"),
+        # At most one booking per doctor and slot; untimed legacy rows are exempt
+        """
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_appointment_slot
+        ON Appointment (doctor_id, appointment_date, appointment_time)
+        WHERE appointment_time IS NOT NULL
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_doctor_specialization ON Doctor (specialization)",
+    ]),
+    Migration(3, "Materialized bill status and patient balance ledger", [
+        """
+        CREATE TABLE IF NOT EXISTS BillStatus (
+            bill_id INTEGER PRIMARY KEY,
+            patient_id INTEGER NOT NULL,
+            amount REAL NOT NULL,
+            status TEXT CHECK(status IN ('Unpaid','Paid')) NOT NULL DEFAULT 'Unpaid',
+            paid_date TEXT,
+            FOREIGN KEY(bill_id) REFERENCES Billing(bill_id)
+        );
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_billstatus_patient ON BillStatus (patient_id, status)",
+        """
+        CREATE TABLE IF NOT EXISTS PatientBalance (
+            patient_id INTEGER PRIMARY KEY,
+            billed_total REAL NOT NULL DEFAULT 0,
+            paid_total REAL NOT NULL DEFAULT 0,
+            open_bills INTEGER NOT NULL DEFAULT 0,
+            FOREIGN KEY(patient_id) REFERENCES Patient(patient_id)
+        );
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS LedgerTotals (
+            id INTEGER PRIMARY KEY CHECK(id = 1),
+            billed_total REAL NOT NULL DEFAULT 0,
+            paid_total REAL NOT NULL DEFAULT 0,
+            open_bills INTEGER NOT NULL DEFAULT 0
+        );
+        """,
+        Backfill("bill status", "Billing", """
+            INSERT OR IGNORE INTO BillStatus (bill_id, patient_id, amount, status, paid_date)
+            SELECT B.bill_id, B.patient_id, B.amount,
+                   CASE WHEN R.receipt_id IS NULL THEN 'Unpaid' ELSE 'Paid' END, R.date
+            FROM Billing B
+            LEFT JOIN Receipt R ON R.bill_id = B.bill_id
+            WHERE B.bill_id BETWEEN :lo AND :hi
+        """),
+        Backfill("patient balances", "Patient", """
+            INSERT OR REPLACE INTO PatientBalance (patient_id, billed_total, paid_total, open_bills)
+            SELECT patient_id, SUM(amount),
+                   TOTAL(CASE WHEN status = 'Paid' THEN amount END),
+                   SUM(status = 'Unpaid')
+            FROM BillStatus
+            WHERE patient_id BETWEEN :lo AND :hi
+            GROUP BY patient_id
+        """),
+        """
+        INSERT OR REPLACE INTO LedgerTotals (id, billed_total, paid_total, open_bills)
+        SELECT 1, TOTAL(billed_total), TOTAL(paid_total), COALESCE(SUM(open_bills), 0) FROM PatientBalance
+        """,
+    ]),
+    Migration(4, "Full-text search over medical reports and patient history", [
+        # External-content FTS5 tables: only the inverted index is stored, the
+        # text itself is read back from MedicalReport / PatientRegistration.
+        """
+        CREATE VIRTUAL TABLE IF NOT EXISTS ReportSearch USING fts5(
+            report_details, content='MedicalReport', content_rowid='report_id',
+            tokenize='porter unicode61 remove_diacritics 2'
+        )
+        """,
+        """
+        CREATE VIRTUAL TABLE IF NOT EXISTS HistorySearch USING fts5(
+            patient_history, content='PatientRegistration', content_rowid='regn_id',
+            tokenize='porter unicode61 remove_diacritics 2'
+        )
+        """,
+        # Triggers keep the indexes in step with every write path, including bulk imports
+        """
+        CREATE TRIGGER IF NOT EXISTS trg_report_search_insert AFTER INSERT ON MedicalReport BEGIN
+            INSERT INTO ReportSearch (rowid, report_details) VALUES (new.report_id, new.report_details);
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS trg_report_search_delete AFTER DELETE ON MedicalReport BEGIN
+            INSERT INTO ReportSearch (ReportSearch, rowid, report_details)
+            VALUES ('delete', old.report_id, old.report_details);
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS trg_report_search_update AFTER UPDATE OF report_details ON MedicalReport BEGIN
+            INSERT INTO ReportSearch (ReportSearch, rowid, report_details)
+            VALUES ('delete', old.report_id, old.report_details);
+            INSERT INTO ReportSearch (rowid, report_details) VALUES (new.report_id, new.report_details);
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS trg_history_search_insert AFTER INSERT ON PatientRegistration BEGIN
+            INSERT INTO HistorySearch (rowid, patient_history) VALUES (new.regn_id, new.patient_history);
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS trg_history_search_delete AFTER DELETE ON PatientRegistration BEGIN
+            INSERT INTO HistorySearch (HistorySearch, rowid, patient_history)
+            VALUES ('delete', old.regn_id, old.patient_history);
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS trg_history_search_update
+        AFTER UPDATE OF patient_history ON PatientRegistration BEGIN
+            INSERT INTO HistorySearch (HistorySearch, rowid, patient_history)
+            VALUES ('delete', old.regn_id, old.patient_history);
+            INSERT INTO HistorySearch (rowid, patient_history) VALUES (new.regn_id, new.patient_history);
+        END
+        """,
+        # 'rebuild' re-reads the content table from scratch, so re-running it is safe
+        "INSERT INTO ReportSearch (ReportSearch) VALUES ('rebuild')",
+        "INSERT INTO HistorySearch (HistorySearch) VALUES ('rebuild')",
+    ]),
+    Migration(5, "Name, email and phone lookup indexes", [
+        # Case-insensitive B-tree indexes serve prefix lookups as range scans
+        "CREATE INDEX IF NOT EXISTS idx_user_name_nocase ON User (name COLLATE NOCASE)",
+        "CREATE INDEX IF NOT EXISTS idx_user_email_nocase ON User (email COLLATE NOCASE)",
+        "CREATE INDEX IF NOT EXISTS idx_patient_phone ON Patient (phone)",
+        # Trigram index for typo-tolerant lookups; rowid is the user_id
+        """
+        CREATE VIRTUAL TABLE IF NOT EXISTS UserLookup USING fts5(
+            name, email, phone, tokenize='trigram'
+        )
+        """,
+        # Per-trigram document counts, used to pick the most selective trigrams
+        "CREATE VIRTUAL TABLE IF NOT EXISTS UserLookupTerms USING fts5vocab(UserLookup, 'row')",
+        """
+        CREATE TRIGGER IF NOT EXISTS trg_user_lookup_insert AFTER INSERT ON User BEGIN
+            INSERT INTO UserLookup (rowid, name, email, phone) VALUES (new.user_id, new.name, new.email, '');
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS trg_user_lookup_update AFTER UPDATE OF name, email ON User BEGIN
+            UPDATE UserLookup SET name = new.name, email = new.email WHERE rowid = new.user_id;
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS trg_user_lookup_delete AFTER DELETE ON User BEGIN
+            DELETE FROM UserLookup WHERE rowid = old.user_id;
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS trg_patient_lookup_insert AFTER INSERT ON Patient BEGIN
+            UPDATE UserLookup SET phone = COALESCE(new.phone, '') WHERE rowid = new.patient_id;
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS trg_patient_lookup_update AFTER UPDATE OF phone ON Patient BEGIN
+            UPDATE UserLookup SET phone = COALESCE(new.phone, '') WHERE rowid = new.patient_id;
+        END
+        """,
+        Backfill("user lookup", "User", """
+            INSERT OR REPLACE INTO UserLookup (rowid, name, email, phone)
+            SELECT U.user_id, U.name, U.email, COALESCE(P.phone, '')
+            FROM User U
+            LEFT JOIN Patient P ON P.patient_id = U.user_id
+            WHERE U.user_id BETWEEN :lo AND :hi
+        """),
+    ]),
+    Migration(6, "Per-patient totals of bills moved to the archive", [
+        # Archived bills are all paid; the ledger adds these back when it recomputes balances
+        """
+        CREATE TABLE IF NOT EXISTS ArchivedBalance (
+            patient_id INTEGER PRIMARY KEY,
+            billed_total REAL NOT NULL DEFAULT 0,
+            bills INTEGER NOT NULL DEFAULT 0,
+            FOREIGN KEY(patient_id) REFERENCES Patient(patient_id)
+        );
+        """,
+    ]),
+    Migration(7, "Precomputed doctor day sheets", [
+        # Built by daysheets.py; sheet is a JSON array of
+        # [appointment_id, time, patient_id, patient_name, phone] in time order
+        """
+        CREATE TABLE IF NOT EXISTS DaySheet (
+            doctor_id INTEGER NOT NULL,
+            date TEXT NOT NULL,
+            appointments INTEGER NOT NULL,
+            sheet TEXT NOT NULL,
+            built_at TEXT NOT NULL,
+            PRIMARY KEY (doctor_id, date)
+        ) WITHOUT ROWID;
+        """,
+        # Bumped by every change that can alter a sheet, so a build can tell
+        # whether anything changed between its read and its cache write
+        """
+        CREATE TABLE IF NOT EXISTS DaySheetState (
+            id INTEGER PRIMARY KEY CHECK(id = 1),
+            generation INTEGER NOT NULL DEFAULT 0
+        );
+        """,
+        "INSERT OR IGNORE INTO DaySheetState (id, generation) VALUES (1, 0)",
+        # Triggers drop the sheets a write changes, whichever code path made it
+        """
+        CREATE TRIGGER IF NOT EXISTS trg_daysheet_appointment_insert AFTER INSERT ON Appointment BEGIN
+            DELETE FROM DaySheet WHERE doctor_id = new.doctor_id AND date = new.appointment_date;
+            UPDATE DaySheetState SET generation = generation + 1 WHERE id = 1;
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS trg_daysheet_appointment_delete AFTER DELETE ON Appointment BEGIN
+            DELETE FROM DaySheet WHERE doctor_id = old.doctor_id AND date = old.appointment_date;
+            UPDATE DaySheetState SET generation = generation + 1 WHERE id = 1;
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS trg_daysheet_appointment_update
+        AFTER UPDATE OF doctor_id, appointment_date, appointment_time, patient_id ON Appointment BEGIN
+            DELETE FROM DaySheet WHERE doctor_id = old.doctor_id AND date = old.appointment_date;
+            DELETE FROM DaySheet WHERE doctor_id = new.doctor_id AND date = new.appointment_date;
+            UPDATE DaySheetState SET generation = generation + 1 WHERE id = 1;
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS trg_daysheet_patient_phone
+        AFTER UPDATE OF phone ON Patient WHEN new.phone IS NOT old.phone BEGIN
+            DELETE FROM DaySheet WHERE (doctor_id, date) IN (
+                SELECT doctor_id, appointment_date FROM Appointment WHERE patient_id = new.patient_id);
+            UPDATE DaySheetState SET generation = generation + 1 WHERE id = 1;
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS trg_daysheet_patient_name
+        AFTER UPDATE OF name ON User WHEN new.role = 'patient' AND new.name IS NOT old.name BEGIN
+            DELETE FROM DaySheet WHERE (doctor_id, date) IN (
+                SELECT doctor_id, appointment_date FROM Appointment WHERE patient_id = new.user_id);
+            UPDATE DaySheetState SET generation = generation + 1 WHERE id = 1;
+        END
+        """,
+    ]),
+    Migration(8, "Day sheet generations per doctor", [
+        # One generation for the whole table made every chunk being built stale
+        # on any booking anywhere; a chunk now only compares its own doctors'.
+        """
+        CREATE TABLE IF NOT EXISTS DaySheetGeneration (
+            doctor_id INTEGER PRIMARY KEY,
+            generation INTEGER NOT NULL
+        );
+        """,
+        # The new triggers exist before the old ones are dropped, so no write
+        # goes unseen if the migration is interrupted between steps
+        """
+        CREATE TRIGGER IF NOT EXISTS trg_sheet_appointment_insert AFTER INSERT ON Appointment BEGIN
+            DELETE FROM DaySheet WHERE doctor_id = new.doctor_id AND date = new.appointment_date;
+            INSERT INTO DaySheetGeneration (doctor_id, generation) VALUES (new.doctor_id, 1)
+            ON CONFLICT(doctor_id) DO UPDATE SET generation = generation + 1;
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS trg_sheet_appointment_delete AFTER DELETE ON Appointment BEGIN
+            DELETE FROM DaySheet WHERE doctor_id = old.doctor_id AND date = old.appointment_date;
+            INSERT INTO DaySheetGeneration (doctor_id, generation) VALUES (old.doctor_id, 1)
+            ON CONFLICT(doctor_id) DO UPDATE SET generation = generation + 1;
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS trg_sheet_appointment_update
+        AFTER UPDATE OF doctor_id, appointment_date, appointment_time, patient_id ON Appointment BEGIN
+            DELETE FROM DaySheet WHERE doctor_id = old.doctor_id AND date = old.appointment_date;
+            DELETE FROM DaySheet WHERE doctor_id = new.doctor_id AND date = new.appointment_date;
+            INSERT INTO DaySheetGeneration (doctor_id, generation) VALUES (old.doctor_id, 1)
+            ON CONFLICT(doctor_id) DO UPDATE SET generation = generation + 1;
+            INSERT INTO DaySheetGeneration (doctor_id, generation)
+            SELECT new.doctor_id, 1 WHERE new.doctor_id IS NOT old.doctor_id
+            ON CONFLICT(doctor_id) DO UPDATE SET generation = generation + 1;
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS trg_sheet_patient_phone
+        AFTER UPDATE OF phone ON Patient WHEN new.phone IS NOT old.phone BEGIN
+            DELETE FROM DaySheet WHERE (doctor_id, date) IN (
+                SELECT doctor_id, appointment_date FROM Appointment WHERE patient_id = new.patient_id);
+            INSERT INTO DaySheetGeneration (doctor_id, generation)
+            SELECT DISTINCT doctor_id, 1 FROM Appointment WHERE patient_id = new.patient_id
+            ON CONFLICT(doctor_id) DO UPDATE SET generation = generation + 1;
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS trg_sheet_patient_name
+        AFTER UPDATE OF name ON User WHEN new.role = 'patient' AND new.name IS NOT old.name BEGIN
+            DELETE FROM DaySheet WHERE (doctor_id, date) IN (
+                SELECT doctor_id, appointment_date FROM Appointment WHERE patient_id = new.user_id);
+            INSERT INTO DaySheetGeneration (doctor_id, generation)
+            SELECT DISTINCT doctor_id, 1 FROM Appointment WHERE patient_id = new.user_id
+            ON CONFLICT(doctor_id) DO UPDATE SET generation = generation + 1;
+        END
+        """,
+        "DROP TRIGGER IF EXISTS trg_daysheet_appointment_insert",
+        "DROP TRIGGER IF EXISTS trg_daysheet_appointment_delete",
+        "DROP TRIGGER IF EXISTS trg_daysheet_appointment_update",
+        "DROP TRIGGER IF EXISTS trg_daysheet_patient_phone",
+        "DROP TRIGGER IF EXISTS trg_daysheet_patient_name",
+        "DROP TABLE IF EXISTS DaySheetState",
+    ]),
+    Migration(9, "Explicit doctor schedules", [
+        # 0: the doctor works the config.py default week. 1: DoctorSchedule
+        # holds the whole week, so a weekday without a row is a day off.
+        add_column("Doctor", "custom_schedule", "INTEGER NOT NULL DEFAULT 0"),
+        # Doctors who already have rows have edited their week
+        """
+        UPDATE Doctor SET custom_schedule = 1
+        WHERE custom_schedule = 0 AND doctor_id IN (SELECT doctor_id FROM DoctorSchedule)
+        """,
+    ]),
+    Migration(10, "Full-text index triggers that tolerate unindexed rows", [
+        # Only 'delete' rows the index holds (a row in the _docsize table):
+        # deleting one it never saw corrupts the index, and the batches below
+        # leave rows unindexed for a while as writes go on. Each trigger is
+        # dropped and recreated in one step, so exactly one version is live.
+        replace_trigger("trg_report_search_delete", """
+        CREATE TRIGGER trg_report_search_delete AFTER DELETE ON MedicalReport BEGIN
+            INSERT INTO ReportSearch (ReportSearch, rowid, report_details)
+            SELECT 'delete', old.report_id, old.report_details
+            WHERE EXISTS (SELECT 1 FROM ReportSearch_docsize WHERE id = old.report_id);
+        END
+        """),
+        replace_trigger("trg_report_search_update", """
+        CREATE TRIGGER trg_report_search_update AFTER UPDATE OF report_details ON MedicalReport BEGIN
+            INSERT INTO ReportSearch (ReportSearch, rowid, report_details)
+            SELECT 'delete', old.report_id, old.report_details
+            WHERE EXISTS (SELECT 1 FROM ReportSearch_docsize WHERE id = old.report_id);
+            INSERT INTO ReportSearch (rowid, report_details) VALUES (new.report_id, new.report_details);
+        END
+        """),
+        replace_trigger("trg_history_search_delete", """
+        CREATE TRIGGER trg_history_search_delete AFTER DELETE ON PatientRegistration BEGIN
+            INSERT INTO HistorySearch (HistorySearch, rowid, patient_history)
+            SELECT 'delete', old.regn_id, old.patient_history
+            WHERE EXISTS (SELECT 1 FROM HistorySearch_docsize WHERE id = old.regn_id);
+        END
+        """),
+        replace_trigger("trg_history_search_update", """
+        CREATE TRIGGER trg_history_search_update
+        AFTER UPDATE OF patient_history ON PatientRegistration BEGIN
+            INSERT INTO HistorySearch (HistorySearch, rowid, patient_history)
+            SELECT 'delete', old.regn_id, old.patient_history
+            WHERE EXISTS (SELECT 1 FROM HistorySearch_docsize WHERE id = old.regn_id);
+            INSERT INTO HistorySearch (rowid, patient_history) VALUES (new.regn_id, new.patient_history);
+        END
+        """),
+        # Index whatever is missing in rowid batches (nothing, where migration
+        # 4's rebuild completed). Rows already indexed are skipped, so
+        # re-running a batch never indexes a row twice.
+        Backfill("report search index", "MedicalReport", """
+            INSERT INTO ReportSearch (rowid, report_details)
+            SELECT report_id, report_details FROM MedicalReport
+            WHERE report_id BETWEEN :lo AND :hi
+              AND report_id NOT IN (SELECT id FROM ReportSearch_docsize WHERE id BETWEEN :lo AND :hi)
+        """, 1000),
+        Backfill("history search index", "PatientRegistration", """
+            INSERT INTO HistorySearch (rowid, patient_history)
+            SELECT regn_id, patient_history FROM PatientRegistration
+            WHERE regn_id BETWEEN :lo AND :hi
+              AND regn_id NOT IN (SELECT id FROM HistorySearch_docsize WHERE id BETWEEN :lo AND :hi)
+        """, 1000),
+    ]),
+]
+
+
+def latest_version():
+    """Returns the schema version the code expects."""
+    return MIGRATIONS[-1].version if MIGRATIONS else 0
+
+
+def current_version(conn):
+    """Returns the schema version stored in the database file."""
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def pending_migrations(conn):
+    """Returns the migrations not yet applied to this database, in order."""
+    version = current_version(conn)
+    return [m for m in sorted(MIGRATIONS, key=lambda m: m.version) if m.version > version]
+
+
+def _begin(conn):
+    """Starts a write transaction, closing any implicit one first."""
+    if conn.in_transaction:
+        conn.commit()
+    conn.execute("BEGIN IMMEDIATE")
+
+
+def run_backfill(conn, backfill, dry_run=False):
+    """Copies data in rowid-bounded batches, committing after each batch.
+
+    Returns the number of batches run (or that would run, for a dry run).
+    """
+    lo, hi = conn.execute(
+        f"SELECT MIN(rowid), MAX(rowid) FROM {backfill.source_table}").fetchone()
+    if lo is None:
+        return 0
+
+    batches = (hi - lo) // backfill.batch_size + 1
+    if dry_run:
+        print(f"  would backfill {backfill.description}: {batches} batch(es) of "
+              f"{backfill.batch_size} rows from {backfill.source_table}")
+        return batches
+
+    start = time.perf_counter()
+    for n, batch_lo in enumerate(range(lo, hi + 1, backfill.batch_size), 1):
+        _begin(conn)
+        try:
+            conn.execute(backfill.sql, {"lo": batch_lo, "hi": batch_lo + backfill.batch_size - 1})
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        if n % 100 == 0 or n == batches:
+            log.info(f"  backfill {backfill.description}: {n}/{batches} batches "
+                     f"({time.perf_counter() - start:.1f}s)")
+        # Yield the write lock so clinical writers are not starved
+        if backfill.pause:
+            time.sleep(backfill.pause)
+    return batches
+
+
+def _execute_step(conn, step):
+    if callable(step):
+        step(conn)
+    else:
+        conn.execute(step)
+
+
+def _describe_step(step):
+    text = (step.__doc__ or step.__name__) if callable(step) else step
+    return " ".join(text.split())[:70]
+
+
+def _run_sql_step(conn, step):
+    _begin(conn)
+    try:
+        _execute_step(conn, step)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+
+
+def apply_migration(conn, migration):
+    """Applies a single migration and stamps its version."""
+    log.info(f"Applying migration {migration.version}: {migration.description}",
+             extra={"version": migration.version})
+    for step in migration.steps:
+        if isinstance(step, Backfill):
+            run_backfill(conn, step)
+        else:
+            _run_sql_step(conn, step)
+
+    _begin(conn)
+    conn.execute(f"PRAGMA user_version = {int(migration.version)}")
+    conn.commit()
+
+
+def dry_run(conn, migrations):
+    """Runs the SQL steps of pending migrations in one transaction, then rolls back.
+
+    Validates every statement against the live schema without changing it.
+    Backfills are only sized, not executed.
+    """
+    _begin(conn)
+    try:
+        for migration in migrations:
+            print(f"Would apply migration {migration.version}: {migration.description}")
+            for step in migration.steps:
+                if isinstance(step, Backfill):
+                    run_backfill(conn, step, dry_run=True)
+                else:
+                    _execute_step(conn, step)
+                    print(f"  ok: {_describe_step(step)}")
+    finally:
+        conn.rollback()
+
+
+def migrate(conn, dry_run_only=False):
+    """Brings the database up to the latest schema version.
+
+    Returns the list of migrations that were (or, in dry-run mode, would be) applied.
+    """
+    migrations = pending_migrations(conn)
+    if not migrations:
+        return []
+
+    if dry_run_only:
+        dry_run(conn, migrations)
+    else:
+        for migration in migrations:
+            apply_migration(conn, migration)
+    return migrations
+
+
+if __name__ == "__main__":
+    from connection import get_connection
+    from logs import configure_logging
+
+    configure_logging()
+
+    with get_connection() as conn:
+        if "--status" in sys.argv:
+            print(f"Schema version {current_version(conn)} (latest {latest_version()}).")
+            for m in pending_migrations(conn):
+                print(f"  pending {m.version}: {m.description}")
+            sys.exit(0)
+
+        applied = migrate(conn, dry_run_only="--dry-run" in sys.argv)
+        if not applied:
+            print(f"Schema is up to date (version {current_version(conn)}).")
@@ -0,0 +1,187 @@
+import base64
+import hashlib
+import hmac
+import os
+import threading
+import time
+from collections import OrderedDict
+from config import (
+    PASSWORD_SCHEME, SCRYPT_N, SCRYPT_R, SCRYPT_P, PBKDF2_ITERATIONS,
+    LOGIN_CACHE_SIZE, LOGIN_CACHE_TTL
+)
+
+# Stored formats:
+#   scrypt$<n>$<r>$<p>$<salt>$<hash>
+#   pbkdf2_sha256$<iterations>$<salt>$<hash>
+# Anything else is a legacy plaintext password, upgraded on next login.
+SALT_BYTES = 16
+HASH_BYTES = 32
+
+
+def _b64(data):
+    return base64.b64encode(data).decode("ascii")
+
+
+def _scrypt(password, salt, n, r, p):
+    # OpenSSL refuses to allocate more than maxmem; size it to the cost settings
+    return hashlib.scrypt(password.encode(), salt=salt, n=n, r=r, p=p,
+                          maxmem=256 * n * r * p + (1 << 20), dklen=HASH_BYTES)
+
+
+def _pbkdf2(password, salt, iterations):
+    return hashlib.pbkdf2_hmac("sha256", password.encode(), salt, iterations, HASH_BYTES)
+
+
+def hash_password(password, scheme=None, cost=None):
+    """Returns a salted hash string for storage in User.password.
+
+    cost overrides the configured work factor (scrypt N or PBKDF2 iterations).
+    """
+    scheme = scheme or PASSWORD_SCHEME
+    salt = os.urandom(SALT_BYTES)
+    if scheme == "scrypt":
+        n = cost or SCRYPT_N
+        return f"scrypt${n}${SCRYPT_R}${SCRYPT_P}${_b64(salt)}${_b64(_scrypt(password, salt, n, SCRYPT_R, SCRYPT_P))}"
+    if scheme == "pbkdf2_sha256":
+        iterations = cost or PBKDF2_ITERATIONS
+        return f"pbkdf2_sha256${iterations}${_b64(salt)}${_b64(_pbkdf2(password, salt, iterations))}"
+    raise ValueError(f"Unknown password scheme '{scheme}'.")
+
+
+def is_hashed(stored):
+    """True if stored is in one of the supported hash formats."""
+    return stored.startswith(("scrypt$", "pbkdf2_sha256$"))
+
+
+def needs_rehash(stored):
+    """True if stored is plaintext or uses a scheme or cost other than the configured one."""
+    parts = stored.split("$")
+    if parts[0] == "scrypt" and len(parts) == 6:
+        return PASSWORD_SCHEME != "scrypt" or [int(x) for x in parts[1:4]] != [SCRYPT_N, SCRYPT_R, SCRYPT_P]
+    if parts[0] == "pbkdf2_sha256" and len(parts) == 4:
+        return PASSWORD_SCHEME != "pbkdf2_sha256" or int(parts[1]) != PBKDF2_ITERATIONS
+    return True
+
+
+def verify_password(password, stored):
+    """Checks a password against a stored hash (or legacy plaintext value)."""
+    parts = stored.split("$")
+    try:
+        if parts[0] == "scrypt" and len(parts) == 6:
+            n, r, p = (int(x) for x in parts[1:4])
+            expected = base64.b64decode(parts[5])
+            return hmac.compare_digest(_scrypt(password, base64.b64decode(parts[4]), n, r, p), expected)
+        if parts[0] == "pbkdf2_sha256" and len(parts) == 4:
+            expected = base64.b64decode(parts[3])
+            return hmac.compare_digest(_pbkdf2(password, base64.b64decode(parts[2]), int(parts[1])), expected)
+    except ValueError:
+        return False
+    return hmac.compare_digest(password.encode(), stored.encode())
+
+
+class VerificationCache:
+    """Bounded LRU of recent successful verifications, each valid for ttl seconds.
+
+    Entries are keyed by a keyed digest of (stored hash, password), never the
+    password itself. Changing a password changes the stored hash, so stale
+    entries can never match.
+    """
+
+    def __init__(self, size=LOGIN_CACHE_SIZE, ttl=LOGIN_CACHE_TTL):
+        self.size = size
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._key = os.urandom(32)
+        self.hits = 0
+        self.misses = 0
+
+    def _digest(self, stored, password):
+        return hmac.new(self._key, f"{stored}\0{password}".encode(), hashlib.sha256).digest()
+
+    def check(self, stored, password):
+        """True if this exact (hash, password) pair was verified within the TTL."""
+        key = self._digest(stored, password)
+        now = time.monotonic()
+        with self._lock:
+            expires = self._entries.get(key)
+            if expires is not None and expires > now:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return True
+            if expires is not None:
+                del self._entries[key]
+            self.misses += 1
+            return False
+
+    def add(self, stored, password):
+        key = self._digest(stored, password)
+        with self._lock:
+            self._entries[key] = time.monotonic() + self.ttl
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+verification_cache = VerificationCache()
+
+
+def remember_verified(stored, password):
+    """Records a known-good (hash, password) pair, e.g. right after a rehash."""
+    if LOGIN_CACHE_SIZE:
+        verification_cache.add(stored, password)
+
+
+def check_password(password, stored):
+    """verify_password with the recent-verification cache in front of it."""
+    if LOGIN_CACHE_SIZE and verification_cache.check(stored, password):
+        return True
+    if verify_password(password, stored):
+        remember_verified(stored, password)
+        return True
+    return False
+
+
+def benchmark(scheme, costs, threads=1, seconds=2.0):
+    """Measures verifications/sec for each cost setting. Returns [(cost, per_sec, ms_each)]."""
+    results = []
+    for cost in costs:
+        stored = hash_password("benchmark-password", scheme, cost)
+        deadline = time.perf_counter() + seconds
+
+        def worker():
+            n = 0
+            while time.perf_counter() < deadline:
+                verify_password("benchmark-password", stored)
+                n += 1
+            return n
+
+        start = time.perf_counter()
+        from concurrent.futures import ThreadPoolExecutor
+        with ThreadPoolExecutor(threads) as pool:
+            total = sum(f.result() for f in [pool.submit(worker) for _ in range(threads)])
+        elapsed = time.perf_counter() - start
+        results.append((cost, total / elapsed, elapsed * threads / total * 1000))
+    return results
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Benchmark password verification (logins/sec) per cost setting.")
+    parser.add_argument("--scheme", choices=["scrypt", "pbkdf2_sha256"], default=PASSWORD_SCHEME)
+    parser.add_argument("--costs", type=int, nargs="*",
+                        help="scrypt N values or PBKDF2 iteration counts to try")
+    parser.add_argument("--threads", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--seconds", type=float, default=2.0, help="Time spent on each cost")
+    args = parser.parse_args()
+
+    costs = args.costs or ([2 ** 12, 2 ** 13, 2 ** 14, 2 ** 15] if args.scheme == "scrypt"
+                           else [50000, 100000, 200000, 600000])
+    print(f"{args.scheme} with {args.threads} thread(s):")
+    for cost, per_sec, ms_each in benchmark(args.scheme, costs, args.threads, args.seconds):
+        print(f"  cost {cost:>8}: {per_sec:8.1f} logins/sec  ({ms_each:.1f} ms per verification)")
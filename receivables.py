@@ -0,0 +1,388 @@
+import argparse
+import csv
+import json
+import logging
+import sys
+import time
+from bisect import bisect_left
+from datetime import date
+from typing import NamedTuple
+from config import (
+    AGEING_BUCKETS, RECEIVABLES_BATCH_SIZE, DUNNING_MIN_AMOUNT, DUNNING_NOTICES, PAYMENT_FILE_METHOD
+)
+from analytics import bucket_labels
+from importer import DEFAULT_CHUNK_SIZE, chunked, read_rows
+from ledger import TOLERANCE, record_payments
+import db
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# Month-end receivables run: ages every unpaid bill, totals the amounts per
+# patient and age bucket, lists the patients who get a dunning notice, and
+# applies a bank's payment file as receipts.
+#
+# The open bills are read with db.iter_open_bill_columns(), RECEIVABLES_BATCH_SIZE
+# at a time, inside one read transaction so the whole run sees one snapshot.
+# Each batch arrives as typed arrays. With numpy installed they are folded
+# into per-patient arrays indexed by patient_id with a few whole-array
+# operations; without it a plain loop does the same over the arrays. Ages
+# are worked out once per distinct bill date, not once per bill.
+#
+# A payment file (CSV or JSON lines with bill_id, amount and optionally date
+# and method) is applied in a single transaction: either every accepted row
+# becomes a receipt or none does. Rows that cannot be applied (unknown or
+# already paid bills, amounts that do not match, repeats) are written to a
+# rejects file with their line number and reason, as importer.py does.
+
+log = logging.getLogger("hms.receivables")
+
+# Patients whose contact details are read per query when listing notices
+PROFILE_BATCH = 500
+
+
+class PatientAgeing(NamedTuple):
+    patient_id: int
+    outstanding: float
+    open_bills: int
+    oldest_days: int
+    amounts: tuple  # Outstanding per age bucket, youngest first
+
+
+class DunningNotice(NamedTuple):
+    patient_id: int
+    name: str
+    email: str
+    phone: str
+    address: str
+    level: int
+    notice: str
+    overdue: float
+    outstanding: float
+    oldest_days: int
+
+
+class Ageing:
+    """Outstanding amounts and bill counts per patient and age bucket, built up one ColumnBatch at a time.
+
+    Ages are counted in days up to as_of; a bill falls in the first bucket
+    whose edge is at least its age, as in analytics.receivables_ageing().
+    Bills whose date is not YYYY-MM-DD are left out, counted in skipped and
+    logged once per distinct date.
+    """
+
+    def __init__(self, as_of, buckets=AGEING_BUCKETS, vectorized=None):
+        self.as_of = date.fromisoformat(as_of) if isinstance(as_of, str) else as_of
+        self.buckets = tuple(buckets)
+        self.labels = bucket_labels(self.buckets)
+        self.vectorized = numpy is not None and vectorized is not False
+        self.bills = 0
+        self.skipped = 0
+        self._ages = {}  # Bill date -> age in days, or None when the date does not parse
+        if self.vectorized:
+            width = len(self.labels)
+            self._edges = numpy.array(self.buckets)
+            self._amounts = numpy.zeros((0, width))
+            self._counts = numpy.zeros((0, width), dtype=numpy.int64)
+            self._oldest = numpy.zeros(0, dtype=numpy.int64)
+        else:
+            self._patients = {}  # patient_id -> [amounts per bucket, counts per bucket, oldest age]
+
+    def add(self, batch):
+        """Folds in a ColumnBatch with patient_id, date and amount columns."""
+        if not len(batch):
+            return
+        dates = batch["date"]
+        days = set(dates)
+        for day in days.difference(self._ages):
+            try:
+                self._ages[day] = (self.as_of - date.fromisoformat(day)).days
+            except (TypeError, ValueError):
+                self._ages[day] = None
+                log.warning(f"Skipping open bills dated {day!r}: not a YYYY-MM-DD date.", extra={"date": day})
+        keep = None
+        if any(self._ages[day] is None for day in days):
+            keep = [i for i, day in enumerate(dates) if self._ages[day] is not None]
+            self.skipped += len(dates) - len(keep)
+            if not keep:
+                return
+        self.bills += len(dates) if keep is None else len(keep)
+        if self.vectorized:
+            ids = numpy.frombuffer(batch["patient_id"], dtype=numpy.int64)
+            amounts = numpy.frombuffer(batch["amount"], dtype=numpy.float64)
+            if keep is not None:
+                ids, amounts, dates = ids[keep], amounts[keep], [dates[i] for i in keep]
+            self._add_arrays(ids, numpy.fromiter(map(self._ages.__getitem__, dates), numpy.int64, len(dates)),
+                             amounts)
+            return
+
+        ages, edges, width = self._ages, self.buckets, len(self.labels)
+        patients = self._patients
+        for patient_id, day, amount in zip(batch["patient_id"], dates, batch["amount"]):
+            age = ages[day]
+            if age is None:
+                continue
+            bucket = bisect_left(edges, age)
+            entry = patients.get(patient_id)
+            if entry is None:
+                entry = patients[patient_id] = [[0.0] * width, [0] * width, age]
+            entry[0][bucket] += amount
+            entry[1][bucket] += 1
+            if age > entry[2]:
+                entry[2] = age
+
+    def _add_arrays(self, ids, ages, amounts):
+        width = len(self.labels)
+        top = int(ids.max()) + 1
+        if top > len(self._oldest):
+            grow = max(top, 2 * len(self._oldest)) - len(self._oldest)
+            self._amounts = numpy.vstack([self._amounts, numpy.zeros((grow, width))])
+            self._counts = numpy.vstack([self._counts, numpy.zeros((grow, width), dtype=numpy.int64)])
+            self._oldest = numpy.concatenate([self._oldest, numpy.full(grow, numpy.iinfo(numpy.int64).min)])
+
+        # One flat (patient, bucket) cell per bill, offset to this batch's ID range
+        low = int(ids.min())
+        cells = (ids - low) * width + numpy.searchsorted(self._edges, ages, side="left")
+        size = (top - low) * width
+        self._amounts[low:top] += numpy.bincount(cells, weights=amounts, minlength=size).reshape(-1, width)
+        self._counts[low:top] += numpy.bincount(cells, minlength=size).reshape(-1, width)
+        numpy.maximum.at(self._oldest, ids, ages)
+
+    def patients(self):
+        """Yields a PatientAgeing for every patient with open bills, by patient_id."""
+        if self.vectorized:
+            counts = self._counts.sum(axis=1)
+            ids = numpy.flatnonzero(counts)
+            for patient_id, amounts, bills, oldest in zip(ids.tolist(), self._amounts[ids].tolist(),
+                                                          counts[ids].tolist(), self._oldest[ids].tolist()):
+                yield PatientAgeing(patient_id, round(sum(amounts), 2), bills, oldest,
+                                    tuple(round(amount, 2) for amount in amounts))
+            return
+        for patient_id in sorted(self._patients):
+            amounts, counts, oldest = self._patients[patient_id]
+            yield PatientAgeing(patient_id, round(sum(amounts), 2), sum(counts), oldest,
+                                tuple(round(amount, 2) for amount in amounts))
+
+    def totals(self):
+        """Returns (bucket label, outstanding amount, open bills) rows, youngest bucket first."""
+        if self.vectorized:
+            amounts, counts = self._amounts.sum(axis=0).tolist(), self._counts.sum(axis=0).tolist()
+        else:
+            amounts, counts = [0.0] * len(self.labels), [0] * len(self.labels)
+            for patient_amounts, patient_counts, _ in self._patients.values():
+                for i, (amount, count) in enumerate(zip(patient_amounts, patient_counts)):
+                    amounts[i] += amount
+                    counts[i] += count
+        return [(label, round(amount, 2), bills) for label, amount, bills in zip(self.labels, amounts, counts)]
+
+
+def age_receivables(conn, as_of=None, buckets=AGEING_BUCKETS, batch_size=RECEIVABLES_BATCH_SIZE, vectorized=None):
+    """Ages every unpaid bill as of a date (default today) from one snapshot. Returns the Ageing."""
+    ageing = Ageing(as_of or date.today(), buckets, vectorized)
+    own_transaction = not conn.in_transaction
+    if own_transaction:
+        conn.execute("BEGIN")
+    try:
+        for batch in db.iter_open_bill_columns(conn, batch_size):
+            ageing.add(batch)
+    finally:
+        if own_transaction:
+            conn.rollback()
+    return ageing
+
+
+def dunning(conn, ageing, min_amount=DUNNING_MIN_AMOUNT, notices=DUNNING_NOTICES):
+    """Returns a DunningNotice for every patient owing at least min_amount past the first bucket.
+
+    The level is the oldest overdue bucket the patient has money in (1 for
+    the second bucket, and so on), which picks the notice sent. Notices are
+    ordered by level, then by overdue amount, largest first.
+    """
+    due = []
+    for patient in ageing.patients():
+        overdue = round(sum(patient.amounts[1:]), 2)
+        if overdue > 0 and overdue >= min_amount:
+            level = max(i for i, amount in enumerate(patient.amounts) if i and amount > 0)
+            due.append((level, overdue, patient))
+    due.sort(key=lambda item: (-item[0], -item[1], item[2].patient_id))
+
+    result = []
+    for i in range(0, len(due), PROFILE_BATCH):
+        chunk = due[i:i + PROFILE_BATCH]
+        profiles = db.get_patient_profiles(conn, [patient.patient_id for _, _, patient in chunk])
+        for level, overdue, patient in chunk:
+            profile = profiles.get(patient.patient_id)
+            if profile is None:
+                continue
+            result.append(DunningNotice(patient.patient_id, profile.name, profile.email, profile.phone,
+                                        profile.address, level, notices[min(level, len(notices)) - 1],
+                                        overdue, patient.outstanding, patient.oldest_days))
+    return result
+
+
+def write_rows(rows, path, header, as_csv=tuple):
+    """Writes records to a .csv file (each row as as_csv(record)), or to any other path as JSON lines."""
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        if path.endswith(".csv"):
+            writer = csv.writer(f)
+            writer.writerow(header)
+            writer.writerows(map(as_csv, rows))
+        else:
+            for row in rows:
+                f.write(json.dumps(row._asdict()) + "\n")
+
+
+# --- Payment files ---
+
+def _number(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _is_date(value):
+    try:
+        date.fromisoformat(value)
+        return True
+    except (TypeError, ValueError):
+        return False
+
+
+def _check_payments(conn, chunk, seen, reject):
+    """Validates numbered payment rows. Returns (date, bill_id, method, amount) tuples for the good ones."""
+    ids = {}
+    for n, row in chunk:
+        try:
+            ids[n] = int(row.get("bill_id"))
+        except (TypeError, ValueError):
+            ids[n] = None
+    bills = {bill_id: (amount, status) for bill_id, amount, status in conn.execute(
+        "SELECT bill_id, amount, status FROM BillStatus WHERE bill_id IN (SELECT value FROM json_each(?))",
+        (json.dumps(sorted(set(ids.values()) - {None})),))}
+
+    payments = []
+    today = date.today().isoformat()
+    for n, row in chunk:
+        bill_id = ids[n]
+        amount = _number(row.get("amount"))
+        paid_date = row.get("date") or today
+        if bill_id is None:
+            reject(n, row, f"invalid bill_id {row.get('bill_id')!r}")
+        elif bill_id not in bills:
+            reject(n, row, f"unknown bill_id {bill_id}")
+        elif amount is None:
+            reject(n, row, f"invalid amount {row.get('amount')!r}")
+        elif not _is_date(paid_date):
+            reject(n, row, f"invalid date {paid_date!r}")
+        elif bill_id in seen:
+            reject(n, row, f"bill #{bill_id} appears earlier in the file")
+        elif bills[bill_id][1] != "Unpaid":
+            reject(n, row, f"bill #{bill_id} is already paid")
+        elif abs(amount - bills[bill_id][0]) > TOLERANCE:
+            reject(n, row, f"amount {amount:.2f} does not match the bill's {bills[bill_id][0]:.2f}")
+        else:
+            seen.add(bill_id)
+            method = row.get("method") or row.get("payment_method") or PAYMENT_FILE_METHOD
+            payments.append((paid_date, bill_id, method, amount))
+    return payments
+
+
+def apply_payments(conn, rows, rejects_file=None, dry_run=False, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Records numbered payment rows as receipts in a single transaction.
+
+    Rows that cannot be applied are written as JSON lines to rejects_file
+    and the rest go ahead. With dry_run everything is checked and then
+    rolled back. Returns a dict with applied/rejected counts, the amount
+    applied and elapsed seconds.
+    """
+    stats = {"applied": 0, "rejected": 0, "amount": 0.0, "seconds": 0.0}
+
+    def reject(n, row, reason):
+        stats["rejected"] += 1
+        if rejects_file is not None:
+            rejects_file.write(json.dumps({"line": n, "reason": reason, "row": row}) + "\n")
+
+    start = time.perf_counter()
+    seen = set()
+    if conn.in_transaction:
+        conn.commit()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        for chunk in chunked(rows, chunk_size):
+            payments = _check_payments(conn, chunk, seen, reject)
+            conn.executemany("INSERT INTO Receipt (date, bill_id, payment_method) VALUES (?, ?, ?)",
+                             [payment[:3] for payment in payments])
+            record_payments(conn, [(bill_id, paid_date) for paid_date, bill_id, _, _ in payments])
+            stats["applied"] += len(payments)
+            stats["amount"] += sum(payment[3] for payment in payments)
+        if dry_run:
+            conn.rollback()
+        else:
+            conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    stats["amount"] = round(stats["amount"], 2)
+    stats["seconds"] = round(time.perf_counter() - start, 3)
+    log.info(f"{'Checked' if dry_run else 'Applied'} {stats['applied']} payment(s) totalling {stats['amount']:.2f}; "
+             f"{stats['rejected']} rejected.", extra={k: stats[k] for k in ("applied", "rejected", "seconds")})
+    return stats
+
+
+if __name__ == "__main__":
+    from connection import get_connection
+    from db import init_db
+    from logs import configure_logging
+
+    parser = argparse.ArgumentParser(description="Receivables ageing, dunning lists and payment files.")
+    parser.add_argument("--as-of", help="Age bills as of YYYY-MM-DD (default: today)")
+    parser.add_argument("--apply-payments", metavar="FILE", help="Record a .csv or .jsonl payment file first")
+    parser.add_argument("--rejects", help="Write rejected payment rows here (default: FILE.rejects.jsonl)")
+    parser.add_argument("--dry-run", action="store_true", help="Check the payment file without recording it")
+    parser.add_argument("--dunning", metavar="PATH", help="Write the dunning list to a .csv or .jsonl file")
+    parser.add_argument("--patients", metavar="PATH", help="Write per-patient ageing to a .csv or .jsonl file")
+    parser.add_argument("--min-amount", type=float, default=DUNNING_MIN_AMOUNT,
+                        help="Smallest overdue total that gets a notice")
+    parser.add_argument("--batch-size", type=int, default=RECEIVABLES_BATCH_SIZE)
+    parser.add_argument("--no-numpy", action="store_true", help="Use the pure-Python ageing loop")
+    args = parser.parse_args()
+
+    configure_logging(stream=sys.stderr)
+    init_db()
+    with get_connection() as conn:
+        if args.apply_payments:
+            rejects_path = args.rejects or args.apply_payments + ".rejects.jsonl"
+            with open(rejects_path, "w", encoding="utf-8") as rejects:
+                try:
+                    stats = apply_payments(conn, read_rows(args.apply_payments), rejects, args.dry_run)
+                except (OSError, ValueError) as e:
+                    sys.exit(f"Cannot apply {args.apply_payments}: {e}")
+            print(f"{'Would apply' if args.dry_run else 'Applied'} {stats['applied']} payment(s) "
+                  f"totalling {stats['amount']:.2f} in {stats['seconds']}s.")
+            if stats["rejected"]:
+                print(f"{stats['rejected']} row(s) rejected; see {rejects_path}")
+
+        started = time.perf_counter()
+        try:
+            ageing = age_receivables(conn, args.as_of, batch_size=max(1, args.batch_size),
+                                     vectorized=not args.no_numpy)
+        except ValueError as e:
+            sys.exit(str(e))
+        print(f"\nReceivables as of {ageing.as_of} ({ageing.bills} open bills, "
+              f"{'numpy' if ageing.vectorized else 'pure Python'}, {time.perf_counter() - started:.2f}s):")
+        if ageing.skipped:
+            print(f"  {ageing.skipped} open bill(s) skipped: their date is not YYYY-MM-DD")
+        for label, amount, bills in ageing.totals():
+            print(f"  {label:>7} days: {amount:>14,.2f} ({bills} bills)")
+
+        if args.patients:
+            write_rows(ageing.patients(), args.patients, PatientAgeing._fields[:-1] + tuple(ageing.labels),
+                       lambda patient: patient[:-1] + patient.amounts)
+            print(f"Per-patient ageing written to {args.patients}")
+        if args.dunning:
+            notices = dunning(conn, ageing, args.min_amount)
+            write_rows(notices, args.dunning, DunningNotice._fields)
+            print(f"{len(notices)} dunning notice(s) written to {args.dunning}")
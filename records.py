@@ -0,0 +1,255 @@
+from array import array
+from functools import lru_cache
+from typing import NamedTuple
+
+# Row types returned by db.py. They are NamedTuples, so they cost no more
+# memory than the plain tuples they replace, unpack and index the same way,
+# and add attribute access (appt.patient_name instead of appt[2]).
+
+
+class Doctor(NamedTuple):
+    doctor_id: int
+    name: str
+    specialization: str
+
+
+class Patient(NamedTuple):
+    patient_id: int
+    name: str
+    phone: str
+    address: str
+
+
+class PatientProfile(NamedTuple):
+    patient_id: int
+    name: str
+    email: str
+    phone: str
+    address: str
+
+
+class DoctorAppointment(NamedTuple):
+    """An appointment as listed for the doctor."""
+    appointment_id: int
+    date: str
+    patient_name: str
+    phone: str
+
+
+class ScheduleEntry(NamedTuple):
+    """An appointment on a doctor's day sheet, with the patient's contact details."""
+    appointment_id: int
+    date: str
+    time: str
+    patient_id: int
+    patient_name: str
+    phone: str
+
+
+class PatientAppointment(NamedTuple):
+    """An appointment as listed for the patient."""
+    appointment_id: int
+    date: str
+    doctor_name: str
+    specialization: str
+
+
+class Report(NamedTuple):
+    report_id: int
+    date: str
+    details: str
+    doctor_name: str
+
+
+class Bill(NamedTuple):
+    bill_id: int
+    date: str
+    details: str
+    amount: float
+    status: str
+
+
+class Receipt(NamedTuple):
+    receipt_id: int
+    date: str
+    bill_id: int
+    amount: float
+    payment_method: str
+
+
+class Balance(NamedTuple):
+    billed_total: float
+    paid_total: float
+    outstanding: float
+    open_bills: int
+
+
+class ReportHit(NamedTuple):
+    report_id: int
+    date: str
+    patient_id: int
+    patient_name: str
+    doctor_name: str
+    snippet: str
+
+
+class HistoryHit(NamedTuple):
+    patient_id: int
+    patient_name: str
+    date: str
+    snippet: str
+
+
+class FreeSlot(NamedTuple):
+    date: str
+    time: str
+    doctor_id: int
+    doctor_name: str
+
+
+class UserMatch(NamedTuple):
+    user_id: int
+    name: str
+    email: str
+    phone: str
+    role: str
+
+
+class TimelineEvent(NamedTuple):
+    """One entry in a patient's timeline.
+
+    kind is "registration", "appointment", "report", "bill" or "payment".
+    title and detail are the doctor and specialization for an appointment,
+    the doctor and text for a report, the details and status for a bill, the
+    payment method and bill number for a payment, or "Registration" and the
+    patient history. time is only set for appointments booked into a slot.
+    """
+    patient_id: int
+    date: str
+    time: str
+    kind: str
+    event_id: int
+    title: str
+    detail: str
+    amount: float
+
+
+@lru_cache(maxsize=None)
+def row_factory(record):
+    """Returns a cursor row_factory that turns each row straight into a record.
+
+    tuple.__new__ skips the argument parsing a record(*row) call would do,
+    so this costs about the same as returning the plain tuple.
+    """
+    new = tuple.__new__
+    return lambda cursor, row: new(record, row)
+
+
+class ColumnBatch:
+    """A result set stored column by column.
+
+    Integer and float columns go into typed arrays (8 bytes per value, no
+    per-row objects); other columns are plain lists. schema is a list of
+    (column name, array typecode or None) in SELECT order.
+    """
+    __slots__ = ("names", "columns", "_index")
+
+    def __init__(self, schema):
+        self.names = tuple(name for name, _ in schema)
+        self.columns = tuple(array(code) if code else [] for _, code in schema)
+        self._index = {name: i for i, name in enumerate(self.names)}
+
+    def extend(self, rows):
+        """Appends a list of row tuples."""
+        if rows:
+            for column, values in zip(self.columns, zip(*rows)):
+                column.extend(values)
+
+    @classmethod
+    def fetch(cls, cursor, schema, batch_size=10000):
+        """Drains an executed cursor into a new batch, batch_size rows at a time."""
+        batch = cls(schema)
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                return batch
+            batch.extend(rows)
+
+    def __len__(self):
+        return len(self.columns[0]) if self.columns else 0
+
+    def __getitem__(self, name):
+        """The whole column called name."""
+        return self.columns[self._index[name]]
+
+    def row(self, i):
+        return tuple(column[i] for column in self.columns)
+
+    def __iter__(self):
+        return zip(*self.columns)
+
+
+# --- Benchmark ---
+
+def _benchmark(rows=1_000_000):
+    """Fetches the same million rows as tuples, sqlite3.Row, records and a ColumnBatch."""
+    import sqlite3
+    import time
+    import tracemalloc
+
+    conn = sqlite3.connect(":memory:")
+    conn.execute("CREATE TABLE Billing (bill_id INTEGER PRIMARY KEY, date TEXT, details TEXT, amount REAL, "
+                 "status TEXT)")
+    conn.execute("""
+        WITH RECURSIVE n(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM n WHERE i < ?)
+        INSERT INTO Billing SELECT i, date('2024-01-01', '+' || (i % 700) || ' days'),
+                                   'Consultation', (i % 5000) / 10.0, 'Unpaid' FROM n
+    """, (rows,))
+    sql = "SELECT bill_id, date, details, amount, status FROM Billing"
+    schema = [("bill_id", "q"), ("date", None), ("details", None), ("amount", "d"), ("status", None)]
+
+    def as_tuples():
+        return conn.execute(sql).fetchall()
+
+    def as_rows():
+        c = conn.cursor()
+        c.row_factory = sqlite3.Row
+        return c.execute(sql).fetchall()
+
+    def as_records():
+        c = conn.cursor()
+        c.row_factory = row_factory(Bill)
+        return c.execute(sql).fetchall()
+
+    def as_columns():
+        return ColumnBatch.fetch(conn.execute(sql), schema)
+
+    print(f"{rows} rows of (bill_id, date, details, amount, status)")
+    print(f"{'container':<14}{'fetch s':>9}{'sum(amount) s':>15}{'memory MB':>11}")
+    for name, fetch, total in [
+            ("tuple", as_tuples, lambda r: sum(row[3] for row in r)),
+            ("sqlite3.Row", as_rows, lambda r: sum(row["amount"] for row in r)),
+            ("Bill record", as_records, lambda r: sum(row.amount for row in r)),
+            ("ColumnBatch", as_columns, lambda r: sum(r["amount"]))]:
+        started = time.perf_counter()
+        result = fetch()
+        fetched = time.perf_counter() - started
+        started = time.perf_counter()
+        total(result)
+        summed = time.perf_counter() - started
+        del result
+
+        tracemalloc.start()
+        result = fetch()
+        size = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        del result
+        print(f"{name:<14}{fetched:>9.2f}{summed:>15.3f}{size / 2 ** 20:>11.1f}")
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Compare row containers on a large result set.")
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    _benchmark(parser.parse_args().rows)
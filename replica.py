@@ -0,0 +1,336 @@
+import argparse
+import functools
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from config import (
+    DATABASE_NAME, REPLICA_MODE, REPLICA_PATH, REPLICA_MAX_LAG, REPLICA_REFRESH_AFTER, REPLICA_POOL_SIZE,
+    REPLICA_CHECK_INTERVAL
+)
+from connection import ConnectionPool
+
+# Read routing for listings, searches and reports, so they stay off the
+# connections and the WAL of the primary file that clinical writes use.
+#
+# db.py marks such reads with @replica_read. With REPLICA_MODE "off" the
+# decorator returns the function unchanged. Otherwise a call is handed a
+# connection from the replica's own small pool instead of the caller's:
+#
+#   "wal"       read-only (mode=ro) connections to the primary file. They see
+#               every commit, so there is no lag, but they can never write or
+#               take the write lock, and a burst of reports waits for one of
+#               REPLICA_POOL_SIZE connections rather than starving writers.
+#   "snapshot"  read-only connections to REPLICA_PATH, a copy of the primary
+#               taken with the online backup API. Its file time is set to the
+#               moment the copy started, so every process can tell its lag
+#               from one stat(). A routed read that finds the copy older than
+#               REPLICA_REFRESH_AFTER starts a background refresh; one older
+#               than REPLICA_MAX_LAG (or missing) is not read at all, and the
+#               call runs on the primary instead. Refreshes write a new file
+#               and rename it into place, with a lock file keeping two
+#               processes from copying at once; connections to the old copy
+#               are closed as they come back to their pool.
+#
+# A call made while the caller's connection has a transaction open stays on
+# that connection, so nobody reads around their own uncommitted writes, and
+# so does any call on a database other than the configured primary.
+
+log = logging.getLogger("hms.replica")
+
+# Per thread, how many routed reads a snapshot has answered; see snapshot_reads()
+_served = threading.local()
+
+class Replica:
+    """The read-only connections routed reads use, and counters describing them."""
+
+    def __init__(self, mode=REPLICA_MODE, primary=None, path=REPLICA_PATH, max_lag=REPLICA_MAX_LAG,
+                 refresh_after=REPLICA_REFRESH_AFTER, pool_size=REPLICA_POOL_SIZE):
+        if mode not in ("wal", "snapshot"):
+            raise ValueError(f"Unknown replica mode '{mode}'. Expected 'wal' or 'snapshot'.")
+        self.mode = mode
+        self.primary = primary or DATABASE_NAME
+        self.path = self.primary if mode == "wal" else path
+        self.max_lag = max_lag
+        self.refresh_after = refresh_after
+        self.pool_size = pool_size
+        self._lock = threading.Lock()
+        self._pool = ConnectionPool(self.primary, pool_size, readonly=True) if mode == "wal" else None
+        self._version = None     # (inode, mtime) of the snapshot the pool reads
+        self._taken_at = None    # Wall-clock time the snapshot was taken
+        self._next_check = 0.0
+        self._refresher = None
+        self.routed = 0
+        self.fallbacks = 0       # Reads sent to the primary because the snapshot was missing or too old
+        self.lag_total = 0.0
+        self.lag_max = 0.0
+        self.refreshes = 0
+        self.refresh_failures = 0
+        self.last_refresh_seconds = None
+
+    def lag(self):
+        """Seconds the replica is behind the primary, or None when there is no snapshot yet."""
+        if self.mode == "wal":
+            return 0.0
+        if self._taken_at is None:
+            return None
+        return max(0.0, time.time() - self._taken_at)
+
+    def _check(self):
+        """Opens a pool on the snapshot file when it is new or has been replaced. Call with the lock held."""
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            self._taken_at = None
+            return
+        version = (st.st_ino, st.st_mtime_ns)
+        if version != self._version:
+            if self._pool is not None:
+                self._pool.close()
+            self._pool = ConnectionPool(self.path, self.pool_size, readonly=True)
+            self._version = version
+        self._taken_at = st.st_mtime
+
+    def _acquire(self):
+        """Returns (pool, connection, lag), or (None, None, lag) when reads should go to the primary."""
+        if self.mode == "wal":
+            return self._pool, self._pool.acquire(), 0.0
+        with self._lock:
+            now = time.monotonic()
+            if now >= self._next_check:
+                self._check()
+                self._next_check = now + REPLICA_CHECK_INTERVAL
+            lag = self.lag()
+            if lag is None or lag > self.refresh_after:
+                self._refresh_in_background()
+            if lag is None or lag > self.max_lag:
+                self.fallbacks += 1
+                return None, None, lag
+            pool = self._pool
+        return pool, pool.acquire(), lag
+
+    @contextmanager
+    def connection(self):
+        """Yields a read-only replica connection, or None when the read should use the primary."""
+        pool, conn, lag = self._acquire()
+        if conn is None:
+            yield None
+            return
+        try:
+            yield conn
+        finally:
+            pool.release(conn)
+            with self._lock:
+                if pool is not self._pool:
+                    # A refresh replaced this snapshot; close what has come back
+                    pool.close()
+                self.routed += 1
+                self.lag_total += lag
+                self.lag_max = max(self.lag_max, lag)
+
+    def _claim(self):
+        """Takes the lock file that stops two processes copying at once. Returns False if another holds it."""
+        claim = self.path + ".refreshing"
+        for _ in range(2):
+            try:
+                os.close(os.open(claim, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+                return True
+            except FileExistsError:
+                try:
+                    if time.time() - os.stat(claim).st_mtime < self.max_lag:
+                        return False
+                    # Left behind by a process that died while copying
+                    os.remove(claim)
+                except FileNotFoundError:
+                    pass
+        return False
+
+    def refresh(self):
+        """Copies the primary to a new snapshot file and swaps it in.
+
+        Returns the seconds taken, or None when another process was already
+        refreshing the same file.
+        """
+        if self.mode == "wal":
+            return 0.0
+        if not self._claim():
+            return None
+        from backup import online_copy
+        started, taken_at = time.perf_counter(), time.time()
+        temp = f"{self.path}.{os.getpid()}-{threading.get_ident()}.tmp"
+        try:
+            online_copy(temp, self.primary)
+            os.utime(temp, (taken_at, taken_at))
+            os.replace(temp, self.path)
+        except Exception:
+            with self._lock:
+                self.refresh_failures += 1
+            if os.path.exists(temp):
+                os.remove(temp)
+            raise
+        finally:
+            os.remove(self.path + ".refreshing")
+        seconds = time.perf_counter() - started
+        with self._lock:
+            self.refreshes += 1
+            self.last_refresh_seconds = round(seconds, 3)
+            self._next_check = 0.0
+        log.info(f"Replica refreshed in {seconds:.2f}s.", extra={"seconds": round(seconds, 3)})
+        return seconds
+
+    def _refresh_quietly(self):
+        try:
+            self.refresh()
+        except Exception:
+            log.exception("Replica refresh failed; reads stay on the primary until a snapshot is fresh.")
+
+    def _refresh_in_background(self):
+        """Starts a refresh thread unless one is running. Call with the lock held."""
+        if self._refresher is None or not self._refresher.is_alive():
+            self._refresher = threading.Thread(target=self._refresh_quietly, name="hms-replica-refresh",
+                                               daemon=True)
+            self._refresher.start()
+
+    def stats(self):
+        with self._lock:
+            if self.mode == "snapshot":
+                self._check()
+            lag = self.lag()
+            return {"mode": self.mode, "path": self.path, "lag_seconds": None if lag is None else round(lag, 3),
+                    "max_lag_seconds": self.max_lag, "routed": self.routed, "fallbacks": self.fallbacks,
+                    "mean_lag_seconds": round(self.lag_total / self.routed, 3) if self.routed else 0.0,
+                    "max_served_lag_seconds": round(self.lag_max, 3), "refreshes": self.refreshes,
+                    "refresh_failures": self.refresh_failures, "last_refresh_seconds": self.last_refresh_seconds}
+
+    def close(self):
+        with self._lock:
+            if self._pool is not None:
+                self._pool.close()
+
+
+_replica = None
+_replica_lock = threading.Lock()
+
+
+def get_replica():
+    """Returns the process-wide Replica for the configured mode, or None when it is "off"."""
+    global _replica
+    if REPLICA_MODE == "off":
+        return None
+    with _replica_lock:
+        if _replica is None:
+            _replica = Replica()
+        return _replica
+
+
+@contextmanager
+def reading(conn):
+    """Yields the connection a routed read should use instead of conn (conn itself when not routed)."""
+    replica = get_replica()
+    if replica is None or conn.in_transaction or getattr(conn, "database", None) != replica.primary:
+        yield conn
+        return
+    with replica.connection() as replica_conn:
+        if replica_conn is not None and replica.mode == "snapshot":
+            _served.snapshot_reads = snapshot_reads() + 1
+        yield replica_conn or conn
+
+
+def snapshot_reads():
+    """Returns how many routed reads on this thread a snapshot (rather than the primary) has answered.
+
+    cache.py compares it before and after a call, so it never caches a
+    result that may be up to REPLICA_MAX_LAG old.
+    """
+    return getattr(_served, "snapshot_reads", 0)
+
+
+def _forget_in_child():
+    # A forked worker must open its own connections, not share its parent's
+    global _replica, _replica_lock
+    _replica, _replica_lock = None, threading.Lock()
+
+
+os.register_at_fork(after_in_child=_forget_in_child)
+
+
+def replica_read(fn):
+    """Routes a db.py read function of the form f(conn, *args) to the replica when one is configured."""
+    if REPLICA_MODE == "off":
+        return fn
+
+    @functools.wraps(fn)
+    def routed(conn, *args, **kwargs):
+        with reading(conn) as source:
+            return fn(source, *args, **kwargs)
+    return routed
+
+
+def replica_stats():
+    """Returns the replica's mode, lag and routing counters ({"mode": "off"} when disabled)."""
+    replica = get_replica()
+    return replica.stats() if replica else {"mode": "off"}
+
+
+def to_prometheus():
+    """Returns the replica gauges and counters in the Prometheus text exposition format."""
+    stats = replica_stats()
+    if stats["mode"] == "off":
+        return ""
+    lag = stats["lag_seconds"]
+    lines = []
+    for metric, kind, text, value in [
+            ("hms_replica_lag_seconds", "gauge", "Age of the replica's data (-1 when there is none).",
+             -1 if lag is None else lag),
+            ("hms_replica_routed_total", "counter", "Reads served by the replica.", stats["routed"]),
+            ("hms_replica_fallbacks_total", "counter", "Routed reads sent to the primary because the replica "
+             "was missing or too far behind.", stats["fallbacks"]),
+            ("hms_replica_refreshes_total", "counter", "Snapshot refreshes completed.", stats["refreshes"]),
+            ("hms_replica_refresh_failures_total", "counter", "Snapshot refreshes that failed.",
+             stats["refresh_failures"])]:
+        lines += [f"# HELP {metric} {text}", f"# TYPE {metric} {kind}", f'{metric}{{mode="{stats["mode"]}"}} {value}']
+    return "\n".join(lines) + "\n"
+
+
+if __name__ == "__main__":
+    from logs import configure_logging
+
+    parser = argparse.ArgumentParser(description="Refresh or check the read replica snapshot.")
+    parser.add_argument("--refresh", action="store_true", help="Take a new snapshot now")
+    parser.add_argument("--every", type=float, metavar="SECONDS",
+                        help="Keep refreshing at this interval (for a sidecar process)")
+    parser.add_argument("--json", action="store_true", help="Print the status as JSON")
+    args = parser.parse_args()
+
+    configure_logging(stream=sys.stderr)
+    # The command line manages the snapshot file whatever mode this process routes reads in
+    replica = Replica("snapshot")
+    try:
+        if args.every:
+            while True:
+                started = time.monotonic()
+                try:
+                    replica.refresh()
+                except Exception:
+                    log.exception("Replica refresh failed.")
+                time.sleep(max(0.0, args.every - (time.monotonic() - started)))
+        if args.refresh:
+            seconds = replica.refresh()
+            if seconds is None:
+                sys.exit(f"Another process is refreshing {replica.path}.")
+            print(f"Snapshot of {replica.primary} written to {replica.path} in {seconds:.2f}s.")
+        status = replica.stats()
+        if args.json:
+            print(json.dumps(status))
+        else:
+            lag = status["lag_seconds"]
+            print(f"Routing: {REPLICA_MODE}")
+            print(f"Snapshot: {status['path']}")
+            print("Lag: " + ("no snapshot" if lag is None else f"{lag:.1f}s") + f" (limit {status['max_lag_seconds']}s)")
+    except KeyboardInterrupt:
+        pass
+    finally:
+        replica.close()
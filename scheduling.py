@@ -0,0 +1,198 @@
+import sqlite3
+import threading
+import time
+from collections import defaultdict
+from datetime import date, datetime, timedelta
+from config import (
+    DEFAULT_WORKING_DAYS, DEFAULT_WORKING_HOURS, DEFAULT_SLOT_MINUTES,
+    SLOT_INDEX_HORIZON_DAYS, SLOT_INDEX_TTL
+)
+from db import add_appointment
+from records import FreeSlot
+
+
+def to_minutes(hhmm):
+    """'09:30' -> 570"""
+    hours, minutes = hhmm.split(":")
+    return int(hours) * 60 + int(minutes)
+
+
+def to_hhmm(minutes):
+    """570 -> '09:30'"""
+    return f"{minutes // 60:02d}:{minutes % 60:02d}"
+
+
+def _write_out_default_week(conn, doctor_id):
+    """Stores the default week as rows for a doctor still on it, so edits to single days are explicit."""
+    if conn.execute("UPDATE Doctor SET custom_schedule = 1 WHERE doctor_id = ? AND custom_schedule = 0",
+                    (doctor_id,)).rowcount:
+        start, end = DEFAULT_WORKING_HOURS
+        conn.executemany("""
+            INSERT OR IGNORE INTO DoctorSchedule (doctor_id, weekday, start_time, end_time, slot_minutes)
+            VALUES (?, ?, ?, ?, ?)
+        """, [(doctor_id, weekday, start, end, DEFAULT_SLOT_MINUTES) for weekday in DEFAULT_WORKING_DAYS])
+
+
+def set_working_hours(conn, doctor_id, weekday, start_time, end_time, slot_minutes=DEFAULT_SLOT_MINUTES):
+    """Sets a doctor's hours for one weekday (0 = Monday)."""
+    if to_minutes(end_time) - to_minutes(start_time) < slot_minutes:
+        raise ValueError("Working hours must fit at least one slot.")
+    _write_out_default_week(conn, doctor_id)
+    c = conn.cursor()
+    c.execute("""
+        INSERT INTO DoctorSchedule (doctor_id, weekday, start_time, end_time, slot_minutes)
+        VALUES (?, ?, ?, ?, ?)
+        ON CONFLICT(doctor_id, weekday) DO UPDATE SET
+            start_time = excluded.start_time, end_time = excluded.end_time,
+            slot_minutes = excluded.slot_minutes
+    """, (doctor_id, weekday, start_time, end_time, slot_minutes))
+    conn.after_commit(slot_index.invalidate)
+
+
+def clear_working_day(conn, doctor_id, weekday):
+    """Removes a doctor's hours for one weekday, making it a day off."""
+    _write_out_default_week(conn, doctor_id)
+    c = conn.cursor()
+    c.execute("DELETE FROM DoctorSchedule WHERE doctor_id = ? AND weekday = ?", (doctor_id, weekday))
+    conn.after_commit(slot_index.invalidate)
+
+
+class SlotIndex:
+    """In-memory index of every doctor's bookable slots over a rolling horizon.
+
+    For each (specialization, weekday) it keeps the day's slot start times in
+    order, each with the doctors working that slot, plus the set of slots
+    already booked. Finding the next free slots is then a walk over a few
+    sorted lists instead of a query against Appointment.
+    """
+
+    def __init__(self, horizon_days=SLOT_INDEX_HORIZON_DAYS, ttl=SLOT_INDEX_TTL):
+        self.horizon_days = horizon_days
+        self.ttl = ttl
+        self._lock = threading.RLock()
+        self._loaded_at = None
+        self.first_day = None
+        self.hours = {}          # doctor_id -> {weekday: (start_min, end_min, slot_minutes)}
+        self.names = {}          # doctor_id -> name
+        self.grid = {}           # (specialization, weekday) -> [(minute, [doctor_id, ...]), ...]
+        self.booked = set()      # (doctor_id, 'YYYY-MM-DD', minute)
+
+    def invalidate(self):
+        """Forces a reload on next use (after schedules change)."""
+        with self._lock:
+            self._loaded_at = None
+
+    def load(self, conn, today=None):
+        """Rebuilds the index from DoctorSchedule and the horizon's bookings."""
+        today = today or date.today()
+        last_day = today + timedelta(days=self.horizon_days)
+        default_start, default_end = (to_minutes(t) for t in DEFAULT_WORKING_HOURS)
+
+        schedules = defaultdict(dict)
+        for doctor_id, weekday, start, end, slot in conn.execute(
+                "SELECT doctor_id, weekday, start_time, end_time, slot_minutes FROM DoctorSchedule"):
+            schedules[doctor_id][weekday] = (to_minutes(start), to_minutes(end), slot)
+
+        hours, names, grid = {}, {}, defaultdict(lambda: defaultdict(list))
+        for doctor_id, name, specialization, custom in conn.execute("""
+                SELECT D.doctor_id, U.name, D.specialization, D.custom_schedule
+                FROM Doctor D JOIN User U ON U.user_id = D.doctor_id"""):
+            names[doctor_id] = name
+            # A doctor with a custom week and no rows at all is not working
+            hours[doctor_id] = schedules.get(doctor_id, {}) if custom else {
+                weekday: (default_start, default_end, DEFAULT_SLOT_MINUTES) for weekday in DEFAULT_WORKING_DAYS}
+            for weekday, (start, end, slot) in hours[doctor_id].items():
+                for minute in range(start, end - slot + 1, slot):
+                    grid[(specialization, weekday)][minute].append(doctor_id)
+
+        booked = set()
+        for doctor_id, day, hhmm in conn.execute("""
+                SELECT doctor_id, appointment_date, appointment_time FROM Appointment
+                WHERE doctor_id IN (SELECT doctor_id FROM Doctor)
+                  AND appointment_date BETWEEN ? AND ? AND appointment_time IS NOT NULL
+                """, (today.isoformat(), last_day.isoformat())):
+            booked.add((doctor_id, day, to_minutes(hhmm)))
+
+        with self._lock:
+            self.first_day = today
+            self.hours, self.names, self.booked = hours, names, booked
+            self.grid = {key: sorted(slots.items()) for key, slots in grid.items()}
+            self._loaded_at = time.monotonic()
+
+    def ensure_current(self, conn):
+        """Reloads if the index is older than its TTL or the day has rolled over."""
+        with self._lock:
+            stale = (self._loaded_at is None or time.monotonic() - self._loaded_at > self.ttl
+                     or self.first_day != date.today())
+        if stale:
+            self.load(conn)
+
+    def is_slot(self, doctor_id, day, minute):
+        """True if the doctor works a slot starting at minute on that date."""
+        weekday = date.fromisoformat(day).weekday()
+        start, end, slot = self.hours.get(doctor_id, {}).get(weekday, (0, 0, 1))
+        return start <= minute <= end - slot and (minute - start) % slot == 0
+
+    def next_free_slots(self, specialization, days=7, limit=10, now=None):
+        """Returns up to limit FreeSlot (date, 'HH:MM', doctor_id, doctor_name) records, earliest first."""
+        now = now or datetime.now()
+        today = now.date().isoformat()
+        now_minute = now.hour * 60 + now.minute
+        results = []
+        with self._lock:
+            days = min(days, self.horizon_days)
+            for offset in range(days):
+                day = now.date() + timedelta(days=offset)
+                day_str = day.isoformat()
+                for minute, doctors in self.grid.get((specialization, day.weekday()), ()):
+                    if day_str == today and minute <= now_minute:
+                        continue
+                    for doctor_id in doctors:
+                        if (doctor_id, day_str, minute) not in self.booked:
+                            results.append(FreeSlot(day_str, to_hhmm(minute), doctor_id, self.names[doctor_id]))
+                            if len(results) == limit:
+                                return results
+        return results
+
+    def mark_booked(self, doctor_id, day, minute):
+        with self._lock:
+            self.booked.add((doctor_id, day, minute))
+
+
+slot_index = SlotIndex()
+
+
+def find_free_slots(conn, specialization, days=7, limit=10):
+    """Next free slots for a specialization, from the shared slot index."""
+    slot_index.ensure_current(conn)
+    return slot_index.next_free_slots(specialization, days, limit)
+
+
+def book_slot(conn, doctor_id, patient_id, day, hhmm):
+    """Atomically books one slot. Returns the appointment ID, or None if it was taken.
+
+    The unique slot index on Appointment makes the INSERT itself the
+    conflict check, so two sessions racing for a slot cannot both win. The
+    shared slot index only shows the slot as taken once the caller commits.
+    Callers refresh the index (find_free_slots or slot_index.ensure_current)
+    before opening their write transaction; reloading it here would hold the
+    write lock and could pick up bookings from a batch that later rolls back.
+    """
+    minute = to_minutes(hhmm)
+    now = datetime.now()
+    if (date.fromisoformat(day), minute) <= (now.date(), now.hour * 60 + now.minute):
+        raise ValueError(f"{day} {hhmm} is in the past.")
+    if not slot_index.is_slot(doctor_id, day, minute):
+        raise ValueError(f"{day} {hhmm} is not within Dr. #{doctor_id}'s working hours.")
+
+    try:
+        appointment_id = add_appointment(conn, day, doctor_id, patient_id, time=to_hhmm(minute))
+    except sqlite3.IntegrityError:
+        # Either another session booked it first or the IDs are invalid
+        if conn.execute("SELECT 1 FROM Appointment WHERE doctor_id = ? AND appointment_date = ? "
+                        "AND appointment_time = ?", (doctor_id, day, to_hhmm(minute))).fetchone():
+            slot_index.mark_booked(doctor_id, day, minute)
+            return None
+        raise
+    conn.after_commit(lambda: slot_index.mark_booked(doctor_id, day, minute))
+    return appointment_id
@@ -0,0 +1,124 @@
+import argparse
+import sqlite3
+import sys
+import time
+from bench import measure
+from db import match_query, search_patient_history, search_reports
+
+# ReportSearch and HistorySearch are external-content FTS5 indexes over
+# MedicalReport.report_details and PatientRegistration.patient_history, kept
+# current by triggers (migration 4). They only need rebuilding after the
+# content tables were changed with the triggers missing, e.g. a restore from
+# an old dump, or when integrity_check() reports a mismatch.
+FTS_TABLES = ("ReportSearch", "HistorySearch")
+
+# Terms the benchmark searches for. Generated data draws reports from a handful
+# of phrases, so the first three each match about a seventh of all reports;
+# the last matches none, like most real clinical terms in a large corpus.
+BENCH_TERMS = ["atrial fibrillation", "pollen", "antibiot*", "hemochromatosis"]
+
+
+def rebuild(conn):
+    """Recreates both full-text indexes from their content tables."""
+    if conn.in_transaction:
+        conn.commit()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        for table in FTS_TABLES:
+            conn.execute(f"INSERT INTO {table} ({table}) VALUES ('rebuild')")
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+
+
+def optimize(conn):
+    """Merges each index's segments into one, which speeds up later queries."""
+    for table in FTS_TABLES:
+        conn.execute(f"INSERT INTO {table} ({table}) VALUES ('optimize')")
+    conn.commit()
+
+
+def integrity_check(conn):
+    """Returns the names of indexes that disagree with their content tables."""
+    broken = []
+    for table in FTS_TABLES:
+        try:
+            conn.execute(f"INSERT INTO {table} ({table}, rank) VALUES ('integrity-check', 1)")
+        except sqlite3.DatabaseError:
+            broken.append(table)
+    conn.rollback()
+    return broken
+
+
+def like_search_reports(conn, text, since=None, limit=50):
+    """The naive equivalent of search_reports: one LIKE per word, newest first."""
+    words = [word.rstrip("*") for word in text.split() if word.rstrip("*")]
+    if not words:
+        return []
+    conditions = " AND ".join("R.report_details LIKE ?" for _ in words)
+    return conn.execute(f"""
+        SELECT R.report_id, R.report_date, R.patient_id, PU.name, DU.name, R.report_details
+        FROM MedicalReport R
+        JOIN User PU ON PU.user_id = R.patient_id
+        JOIN User DU ON DU.user_id = R.doctor_id
+        WHERE {conditions} AND R.report_date >= ?
+        ORDER BY R.report_date DESC
+        LIMIT ?
+    """, [f"%{word}%" for word in words] + [since or "", limit]).fetchall()
+
+
+def benchmark(conn, terms=BENCH_TERMS, iterations=50, budget=5.0):
+    """Times FTS5 search against LIKE scans for each term. Returns {term: (fts, like)} summaries."""
+    results = {}
+    for text in terms:
+        fts = measure(lambda: search_reports(conn, text), iterations, budget)
+        like = measure(lambda: like_search_reports(conn, text), iterations, budget)
+        results[text] = (fts, like)
+    return results
+
+
+if __name__ == "__main__":
+    from connection import get_connection
+    from db import init_db
+
+    parser = argparse.ArgumentParser(description="Search, check or rebuild the full-text indexes.")
+    parser.add_argument("query", nargs="?", help="Words to search for (FTS5 syntax if quoted)")
+    parser.add_argument("--since", help="Only reports on or after this date (YYYY-MM-DD)")
+    parser.add_argument("--history", action="store_true", help="Search patient histories instead of reports")
+    parser.add_argument("--limit", type=int, default=20)
+    parser.add_argument("--rebuild", action="store_true", help="Rebuild both indexes from scratch")
+    parser.add_argument("--check", action="store_true", help="Verify the indexes against their tables")
+    parser.add_argument("--bench", action="store_true", help="Compare FTS5 search with LIKE scans")
+    args = parser.parse_args()
+
+    init_db()
+    with get_connection() as conn:
+        if args.rebuild:
+            started = time.perf_counter()
+            rebuild(conn)
+            optimize(conn)
+            print(f"Full-text indexes rebuilt in {time.perf_counter() - started:.1f}s.")
+        if args.check:
+            broken = integrity_check(conn)
+            for table in broken:
+                print(f"{table} is out of date; run with --rebuild.")
+            if broken:
+                sys.exit(1)
+            print("Full-text indexes are consistent.")
+        if args.bench:
+            reports = conn.execute("SELECT MAX(report_id) FROM MedicalReport").fetchone()[0] or 0
+            print(f"Searching ~{reports} reports")
+            print(f"{'query':<22}{'fts p50 ms':>12}{'fts p95 ms':>12}{'like p50 ms':>13}{'like p95 ms':>13}")
+            for text, (fts, like) in benchmark(conn).items():
+                print(f"{text:<22}{fts['p50_ms']:>12.2f}{fts['p95_ms']:>12.2f}"
+                      f"{like['p50_ms']:>13.2f}{like['p95_ms']:>13.2f}")
+        if args.query:
+            print(f"Query: {match_query(args.query)}")
+            if args.history:
+                for patient_id, name, day, snippet in search_patient_history(conn, args.query, args.limit):
+                    print(f"Patient #{patient_id} {name} (registered {day}): {snippet}")
+            else:
+                for report_id, day, patient_id, patient, doctor, snippet in search_reports(
+                        conn, args.query, args.since, args.limit):
+                    print(f"Report #{report_id} | {day} | {patient} (#{patient_id}) | Dr. {doctor}: {snippet}")
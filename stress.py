@@ -0,0 +1,697 @@
+import argparse
+import json
+import os
+import random
+import re
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter, defaultdict
+from datetime import date, datetime
+from typing import NamedTuple
+from bench import percentile, summarize
+from config import BUSY_TIMEOUT_MS, DATABASE_NAME, JOURNAL_MODE, SLOW_QUERY_MS
+from connection import Connection, configure
+import db
+import scheduling
+
+# Concurrency stress harness. Simulated doctors, patients and admins each hold
+# their own connection, as a menu session does, and run a weighted script of
+# db.py operations against a throwaway copy of the database, as threads spread
+# over one or more processes. Three knobs reproduce the ways sessions can
+# collide:
+#
+#   --commit-every K  commit after every K operations; K > 1 keeps writes
+#                     (and the write lock) open across several operations and
+#                     the think time between them, as long-lived sessions do
+#   --begin MODE      auto: Python's implicit BEGIN before the first write
+#                     deferred: BEGIN before the first operation, so a
+#                       transaction may read first and upgrade to a write later
+#                     immediate: BEGIN IMMEDIATE before the first write operation
+#   --busy-timeout    how long a writer waits on the lock before SQLITE_BUSY
+#
+# Every connection records how long statements that take the write lock took
+# (the lock wait, plus the statement itself), how long the lock was then held
+# until commit or rollback, and each SQLITE_BUSY, classified as:
+#
+#   busy_snapshot      a transaction read an older snapshot and then tried to
+#                      write after another session committed; waiting cannot
+#                      help, so SQLite fails at once
+#   busy_without_wait  SQLITE_BUSY well before busy_timeout ran out; SQLite
+#                      skipped waiting because it could deadlock
+#   busy_timeout       waited out the whole busy_timeout behind a writer
+#
+# A busy operation is rolled back (losing whatever its session had not yet
+# committed) and retried after a random backoff. The report has throughput,
+# per-operation latency, the busy and retry counts, lock wait and hold-time
+# percentiles, and the transaction scripts behind each busy error, long hold
+# or lock held while idle. Save it with --save and diff a later run, another
+# release or another configuration with --compare.
+
+DEFAULT_DURATION = 10.0
+DEFAULT_THINK_MS = 20         # Pause between one actor's operations
+DEFAULT_RETRIES = 3           # Retries of an operation that hit SQLITE_BUSY
+BACKOFF_MS = 10               # Retry n waits up to BACKOFF_MS * 2**n
+LONG_HOLD_MS = SLOW_QUERY_MS  # Write-lock holds longer than this are reported as patterns
+TOP_PATTERNS = 20
+REGRESSION_TOLERANCE = 0.25   # Allowed growth before --compare fails
+MIN_RATE_CHANGE = 0.5         # Ignore busy-rate changes under this many per 1000 operations
+
+SEARCH_TERMS = ("atrial fibrillation", "pollen", "fracture", "zzz")
+LOOKUP_TERMS = ("Mar", "Jennifr Dvis", "555-1", "pat")
+
+_WRITE_LOCK = re.compile(r"\s*(INSERT|UPDATE|DELETE|REPLACE|BEGIN\s+(IMMEDIATE|EXCLUSIVE))", re.IGNORECASE)
+
+
+class Actor(NamedTuple):
+    role: str
+    number: int
+    user_id: int
+    patients: tuple           # Patients the actor reads or writes for
+    days: tuple               # Doctors: dates with appointments, for the day charts
+    specializations: tuple
+    seed: int
+
+
+class Tally:
+    """What one actor (or, merged, a whole run) observed."""
+
+    def __init__(self):
+        self.latencies = defaultdict(list)   # operation: [seconds]
+        self.errors = Counter()              # "operation: error"
+        self.busy = Counter()                # busy kind: count
+        self.patterns = Counter()            # "finding: op > op > ...": count
+        self.roles = Counter()               # role: operations completed
+        self.retries = 0
+        self.gave_up = 0
+        self.lost_ops = 0                    # Earlier uncommitted operations rolled back with a failed one
+        self.write_transactions = 0
+        self.lock_waits = []
+        self.lock_holds = []
+        self.commits = []
+        self.idle_with_lock = 0.0
+
+    def merge(self, other):
+        for name, values in other.latencies.items():
+            self.latencies[name].extend(values)
+        for field in ("errors", "busy", "patterns", "roles"):
+            getattr(self, field).update(getattr(other, field))
+        for field in ("retries", "gave_up", "lost_ops", "write_transactions", "idle_with_lock"):
+            setattr(self, field, getattr(self, field) + getattr(other, field))
+        for field in ("lock_waits", "lock_holds", "commits"):
+            getattr(self, field).extend(getattr(other, field))
+        return self
+
+
+# --- Traced connections ---
+
+class TracedCursor(sqlite3.Cursor):
+    """Cursor that notes when its connection takes the write lock and how long that took."""
+
+    def execute(self, sql, parameters=()):
+        return self.connection.traced(super().execute, sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.connection.traced(super().executemany, sql, seq_of_parameters)
+
+
+class TracedConnection(Connection):
+    """Connection that records lock waits, lock holds and commits into a Tally."""
+    tally = None
+    locked_at = None          # perf_counter() when this transaction took the write lock
+    failed_after = 0.0        # Seconds the last failing statement ran before raising
+    ops = ()                  # Operations run in the current transaction
+
+    def cursor(self, factory=TracedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+    def traced(self, run, sql, parameters):
+        locking = self.locked_at is None and _WRITE_LOCK.match(sql) is not None
+        started = time.perf_counter()
+        try:
+            result = run(sql, parameters)
+        except sqlite3.Error as e:
+            self.failed_after = time.perf_counter() - started
+            # A constraint violation still leaves the write lock taken
+            if locking and not is_busy(e) and self.in_transaction:
+                self._locked(started)
+            raise
+        if locking:
+            self._locked(started)
+        return result
+
+    def _locked(self, started):
+        self.locked_at = time.perf_counter()
+        self.tally.lock_waits.append(self.locked_at - started)
+
+    def commit(self):
+        started = time.perf_counter()
+        super().commit()
+        self.tally.commits.append(time.perf_counter() - started)
+        self._released()
+
+    def rollback(self):
+        super().rollback()
+        self._released()
+
+    def _released(self):
+        if self.locked_at is not None:
+            held = time.perf_counter() - self.locked_at
+            self.tally.lock_holds.append(held)
+            self.tally.write_transactions += 1
+            if held * 1000 >= LONG_HOLD_MS:
+                self.tally.patterns[f"long_hold: {' > '.join(self.ops)}"] += 1
+            self.locked_at = None
+
+
+def open_connection(database, tally, busy_timeout_ms=BUSY_TIMEOUT_MS):
+    """Opens a tuned, traced connection for one actor."""
+    conn = sqlite3.connect(database, timeout=busy_timeout_ms / 1000, check_same_thread=False,
+                           factory=TracedConnection)
+    conn.database = database
+    conn.tally = tally
+    configure(conn)
+    conn.execute(f"PRAGMA busy_timeout = {int(busy_timeout_ms)}")
+    return conn
+
+
+def is_busy(error):
+    return getattr(error, "sqlite_errorcode", 0) & 0xFF in (sqlite3.SQLITE_BUSY, sqlite3.SQLITE_LOCKED)
+
+
+def classify_busy(error, waited, busy_timeout_ms):
+    """Names the kind of SQLITE_BUSY, given how long the failing statement waited (seconds)."""
+    if getattr(error, "sqlite_errorname", "") == "SQLITE_BUSY_SNAPSHOT":
+        return "busy_snapshot"
+    if waited * 1000 < busy_timeout_ms * 0.9:
+        return "busy_without_wait"
+    return "busy_timeout"
+
+
+# --- Scripted operations ---
+# Each runs as fn(conn, actor, rng) using the same db.py and scheduling.py
+# calls the menus and the API make.
+
+def _today():
+    return date.today().isoformat()
+
+
+def doctor_day_list(conn, actor, rng):
+    return db.get_appointments_by_doctor_page(conn, actor.user_id)
+
+
+def doctor_timeline(conn, actor, rng):
+    return db.get_patient_timeline(conn, rng.choice(actor.patients))
+
+
+def doctor_day_charts(conn, actor, rng):
+    return db.get_day_timelines(conn, actor.user_id, rng.choice(actor.days))
+
+
+def doctor_search(conn, actor, rng):
+    return db.search_reports(conn, rng.choice(SEARCH_TERMS), limit=20)
+
+
+def doctor_add_report(conn, actor, rng):
+    return db.add_medical_report(conn, "Stress test follow-up", _today(), rng.choice(actor.patients), actor.user_id)
+
+
+def doctor_add_bill(conn, actor, rng):
+    return db.add_billing(conn, round(rng.uniform(20, 400), 2), _today(), rng.choice(actor.patients),
+                          "Stress test consultation")
+
+
+def patient_appointments(conn, actor, rng):
+    return db.get_appointments_by_patient_page(conn, actor.user_id)
+
+
+def patient_bills(conn, actor, rng):
+    return db.get_unpaid_bills_by_patient(conn, actor.user_id)
+
+
+def patient_balance(conn, actor, rng):
+    return db.get_patient_balance(conn, actor.user_id)
+
+
+def patient_timeline(conn, actor, rng):
+    return db.get_patient_timeline(conn, actor.user_id)
+
+
+def patient_book(conn, actor, rng):
+    slots = scheduling.find_free_slots(conn, rng.choice(actor.specializations), 14, 5)
+    if slots:
+        slot = rng.choice(slots)
+        return scheduling.book_slot(conn, slot.doctor_id, actor.user_id, slot.date, slot.time)
+
+
+def patient_pay(conn, actor, rng):
+    # Reads, then writes: the shape that loses the race under BEGIN DEFERRED
+    bills = db.get_unpaid_bills_by_patient(conn, actor.user_id)
+    if bills:
+        return db.add_receipt(conn, _today(), rng.choice(bills).bill_id, "Card")
+
+
+def patient_update_details(conn, actor, rng):
+    return db.update_patient_details(conn, actor.user_id, f"{rng.randint(1, 999)} Stress Street",
+                                     f"555-{rng.randint(1000, 9999)}")
+
+
+def admin_lookup(conn, actor, rng):
+    return db.lookup_users(conn, rng.choice(LOOKUP_TERMS), "patient")
+
+
+def admin_receivables(conn, actor, rng):
+    return db.get_total_receivables(conn)
+
+
+def admin_patients_page(conn, actor, rng):
+    return db.get_patients_page(conn, rng.choice(actor.patients))
+
+
+def admin_register(conn, actor, rng):
+    user_id = db.add_user(conn, "Stress Patient", f"stress-{actor.number}-{rng.getrandbits(48):x}@example.com",
+                          "pass123", "patient", address="1 Stress Street", phone="555-0000")
+    if user_id is not None:
+        db.add_patient_registration(conn, _today(), "Registered by the stress test", user_id)
+    return user_id
+
+
+def admin_update_details(conn, actor, rng):
+    return db.update_patient_details(conn, rng.choice(actor.patients), "2 Stress Street",
+                                     f"555-{rng.randint(1000, 9999)}")
+
+
+# role: (name, fn, writes, weight) for each scripted operation
+ROLES = {
+    "doctor": (
+        ("doctor.day_list", doctor_day_list, False, 25),
+        ("doctor.timeline", doctor_timeline, False, 25),
+        ("doctor.day_charts", doctor_day_charts, False, 5),
+        ("doctor.search", doctor_search, False, 10),
+        ("doctor.add_report", doctor_add_report, True, 20),
+        ("doctor.add_bill", doctor_add_bill, True, 15),
+    ),
+    "patient": (
+        ("patient.appointments", patient_appointments, False, 25),
+        ("patient.bills", patient_bills, False, 20),
+        ("patient.balance", patient_balance, False, 20),
+        ("patient.timeline", patient_timeline, False, 10),
+        ("patient.book", patient_book, True, 10),
+        ("patient.pay", patient_pay, True, 10),
+        ("patient.update_details", patient_update_details, True, 5),
+    ),
+    "admin": (
+        ("admin.lookup", admin_lookup, False, 30),
+        ("admin.receivables", admin_receivables, False, 20),
+        ("admin.patients_page", admin_patients_page, False, 20),
+        ("admin.register", admin_register, True, 10),
+        ("admin.update_details", admin_update_details, True, 20),
+    ),
+}
+
+
+class Settings(NamedTuple):
+    database: str
+    duration: float = DEFAULT_DURATION
+    think_ms: float = DEFAULT_THINK_MS
+    commit_every: int = 1
+    begin: str = "auto"
+    busy_timeout_ms: int = BUSY_TIMEOUT_MS
+    retries: int = DEFAULT_RETRIES
+
+
+# --- Running actors ---
+
+def run_actor(actor, settings, start_at, stop_at):
+    """Runs one actor's script from start_at until stop_at (time.time() values). Returns its Tally."""
+    rng = random.Random(actor.seed)
+    tally = Tally()
+    script = ROLES[actor.role]
+    weights = [weight for *_, weight in script]
+    conn = open_connection(settings.database, tally, settings.busy_timeout_ms)
+    conn.ops = []
+    try:
+        time.sleep(max(0.0, start_at - time.time()))
+        while time.time() < stop_at:
+            name, fn, writes, _ = rng.choices(script, weights)[0]
+            conn.ops.append(name)
+            if _run_op(conn, tally, settings, rng, actor, name, fn, writes):
+                tally.roles[actor.role] += 1
+            if conn.ops and len(conn.ops) >= settings.commit_every:
+                _commit(conn, tally, settings)
+            if settings.think_ms:
+                think = rng.uniform(0.5, 1.5) * settings.think_ms / 1000
+                if conn.locked_at is not None:
+                    tally.idle_with_lock += think
+                    tally.patterns[f"idle_with_lock: {' > '.join(conn.ops)}"] += 1
+                time.sleep(think)
+        _commit(conn, tally, settings)
+    finally:
+        conn.close()
+    return tally
+
+
+def _begin(conn, settings, writes):
+    if conn.in_transaction:
+        return
+    if settings.begin == "deferred":
+        conn.execute("BEGIN")
+    elif settings.begin == "immediate" and writes:
+        conn.execute("BEGIN IMMEDIATE")
+
+
+def _run_op(conn, tally, settings, rng, actor, name, fn, writes):
+    """Runs one operation, retrying it after SQLITE_BUSY. Returns True if it completed."""
+    started = time.perf_counter()
+    for attempt in range(settings.retries + 1):
+        try:
+            _begin(conn, settings, writes)
+            fn(conn, actor, rng)
+        except sqlite3.OperationalError as e:
+            if not is_busy(e):
+                _fail(conn, tally, name, type(e).__name__)
+                return False
+            _busy(conn, tally, settings, e)
+            if attempt == settings.retries:
+                tally.gave_up += 1
+                tally.errors[f"{name}: gave up after {attempt} retries"] += 1
+                return False
+            tally.retries += 1
+            conn.ops.append(name)
+            time.sleep(rng.uniform(0, BACKOFF_MS * 2 ** attempt) / 1000)
+        except Exception as e:
+            _fail(conn, tally, name, type(e).__name__)
+            return False
+        else:
+            tally.latencies[name].append(time.perf_counter() - started)
+            return True
+
+
+def _busy(conn, tally, settings, error):
+    """Records a SQLITE_BUSY and rolls back the session's uncommitted work."""
+    kind = classify_busy(error, conn.failed_after, settings.busy_timeout_ms)
+    tally.busy[kind] += 1
+    tally.patterns[f"{kind}: {' > '.join(conn.ops)}"] += 1
+    tally.lost_ops += len(conn.ops) - 1
+    conn.rollback()
+    conn.ops.clear()
+
+
+def _fail(conn, tally, name, error):
+    tally.errors[f"{name}: {error}"] += 1
+    tally.lost_ops += len(conn.ops) - 1
+    conn.rollback()
+    conn.ops.clear()
+
+
+def _commit(conn, tally, settings):
+    try:
+        if conn.in_transaction:
+            conn.commit()
+    except sqlite3.OperationalError as e:
+        if not is_busy(e):
+            raise
+        # The rollback below counts every operation in the session as lost
+        conn.ops.append("commit")
+        _busy(conn, tally, settings, e)
+    conn.ops.clear()
+
+
+def _run_group(actors, settings, start_at, stop_at):
+    """Runs actors as threads of this process. Returns their merged Tally."""
+    from logs import configure_logging
+    configure_logging("ERROR", stream=sys.stderr)
+    tallies = [None] * len(actors)
+
+    def work(i, actor):
+        tallies[i] = run_actor(actor, settings, start_at, stop_at)
+
+    threads = [threading.Thread(target=work, args=(i, actor), name=f"{actor.role}-{actor.number}")
+               for i, actor in enumerate(actors)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    total = Tally()
+    for tally in tallies:
+        if tally is not None:
+            total.merge(tally)
+    return total
+
+
+def cast(database, doctors, patients, admins, seed):
+    """Picks the users the actors play, from the database. Returns a list of Actor."""
+    rng = random.Random(seed)
+    conn = sqlite3.connect(database)
+    try:
+        doctor_ids = [row[0] for row in conn.execute(
+            "SELECT doctor_id FROM Doctor WHERE doctor_id IN (SELECT doctor_id FROM Appointment) ORDER BY doctor_id")]
+        patient_ids = [row[0] for row in conn.execute("SELECT patient_id FROM Patient ORDER BY patient_id")]
+        specializations = tuple(row[0] for row in conn.execute(
+            "SELECT DISTINCT specialization FROM Doctor WHERE specialization IS NOT NULL ORDER BY 1"))
+        if not doctor_ids or not patient_ids:
+            raise SystemExit("Need doctors with appointments and patients; run seed.py --generate first.")
+
+        acting = rng.sample(patient_ids, min(patients, len(patient_ids)))
+        actors = [Actor("patient", i, patient_id, (patient_id,), (), specializations, rng.getrandbits(32))
+                  for i, patient_id in enumerate(acting)]
+        for i in range(doctors):
+            doctor_id = doctor_ids[rng.randrange(len(doctor_ids))]
+            seen = [row[0] for row in conn.execute(
+                "SELECT DISTINCT patient_id FROM Appointment WHERE doctor_id = ? LIMIT 50", (doctor_id,))]
+            days = [row[0] for row in conn.execute(
+                "SELECT DISTINCT appointment_date FROM Appointment WHERE doctor_id = ? "
+                "ORDER BY appointment_date DESC LIMIT 10", (doctor_id,))]
+            # Doctors also bill the acting patients, so they have bills to pay
+            actors.append(Actor("doctor", i, doctor_id, tuple(seen + acting), tuple(days), specializations,
+                                rng.getrandbits(32)))
+        for i in range(admins):
+            actors.append(Actor("admin", i, 0, tuple(rng.sample(patient_ids, min(200, len(patient_ids)))), (),
+                                specializations, rng.getrandbits(32)))
+    finally:
+        conn.close()
+    return actors
+
+
+def run(settings, actors, processes=1):
+    """Runs every actor for settings.duration seconds. Returns (merged Tally, elapsed seconds).
+
+    With processes > 1 the actors are dealt round-robin to that many worker
+    processes, each running its share as threads.
+    """
+    groups = [actors[i::processes] for i in range(max(1, processes))]
+    groups = [group for group in groups if group]
+    # Leave time for the workers to start and open their connections
+    start_at = time.time() + 0.2 + 0.3 * (len(groups) > 1)
+    stop_at = start_at + settings.duration
+    if len(groups) == 1:
+        total = _run_group(groups[0], settings, start_at, stop_at)
+    else:
+        from concurrent.futures import ProcessPoolExecutor
+        total = Tally()
+        with ProcessPoolExecutor(len(groups)) as pool:
+            for tally in pool.map(_run_group, groups, [settings] * len(groups),
+                                  [start_at] * len(groups), [stop_at] * len(groups)):
+                total.merge(tally)
+    return total, time.time() - start_at
+
+
+# --- Report ---
+
+def durations(values):
+    """Count, percentiles and maximum of a list of seconds, in ms."""
+    values = sorted(values)
+    return {"count": len(values),
+            "p50_ms": round(percentile(values, 50) * 1000, 3),
+            "p95_ms": round(percentile(values, 95) * 1000, 3),
+            "p99_ms": round(percentile(values, 99) * 1000, 3),
+            "max_ms": round(values[-1] * 1000, 3) if values else 0.0}
+
+
+def build_report(tally, settings, actors, processes, elapsed, database):
+    """Turns a run's Tally into the report document ({"meta", "results", "contention", ...})."""
+    errors_by_op = Counter()
+    for key, count in tally.errors.items():
+        errors_by_op[key.split(":", 1)[0]] += count
+    results = {}
+    for name in sorted(set(tally.latencies) | set(errors_by_op)):
+        results[name] = summarize(tally.latencies.get(name, []))
+        results[name]["errors"] = errors_by_op[name]
+        del results[name]["rows_per_sec"]
+    ops = sum(len(values) for values in tally.latencies.values())
+    results["all"] = summarize([t for values in tally.latencies.values() for t in values])
+    results["all"]["errors"] = sum(errors_by_op.values())
+    del results["all"]["rows_per_sec"]
+
+    per_1000 = 1000 / ops if ops else 0.0
+    conn = sqlite3.connect(database)
+    journal_mode = conn.execute("PRAGMA journal_mode").fetchone()[0]
+    conn.close()
+    return {
+        "meta": {"created": datetime.now().isoformat(timespec="seconds"),
+                 "sqlite_version": sqlite3.sqlite_version, "python": sys.version.split()[0],
+                 "journal_mode": journal_mode, "processes": processes,
+                 "actors": dict(Counter(actor.role for actor in actors)),
+                 "settings": {k: v for k, v in settings._asdict().items() if k != "database"}},
+        "results": results,
+        "throughput": {"seconds": round(elapsed, 2), "ops": ops,
+                       "ops_per_sec": round(ops / elapsed, 1) if elapsed else 0.0,
+                       "write_tx_per_sec": round(tally.write_transactions / elapsed, 1) if elapsed else 0.0,
+                       "by_role": {role: round(n / elapsed, 1) for role, n in sorted(tally.roles.items())}},
+        "contention": {
+            "busy": dict(sorted(tally.busy.items())),
+            "busy_per_1000_ops": {kind: round(n * per_1000, 2) for kind, n in sorted(tally.busy.items())},
+            "retries": tally.retries, "gave_up": tally.gave_up, "lost_ops": tally.lost_ops,
+            "write_transactions": tally.write_transactions,
+            "lock_wait": durations(tally.lock_waits),
+            "lock_hold": durations(tally.lock_holds),
+            "commit": durations(tally.commits),
+            "idle_with_lock_s": round(tally.idle_with_lock, 3),
+        },
+        "patterns": dict(tally.patterns.most_common(TOP_PATTERNS)),
+        "errors": dict(tally.errors.most_common()),
+        "findings": findings(tally, settings),
+    }
+
+
+def findings(tally, settings):
+    """Plain-language notes on the deadlock-prone patterns a run hit."""
+    notes = []
+    if tally.busy["busy_snapshot"]:
+        notes.append(f"{tally.busy['busy_snapshot']} transaction(s) read first and then could not write because "
+                     "another session had committed since (SQLITE_BUSY_SNAPSHOT). Start read-then-write "
+                     "transactions with BEGIN IMMEDIATE, or commit before writing.")
+    if tally.busy["busy_without_wait"]:
+        notes.append(f"{tally.busy['busy_without_wait']} write(s) got SQLITE_BUSY without waiting out "
+                     "busy_timeout: the transaction had read before writing, so SQLite would not wait for "
+                     "the lock (waiting could deadlock, or end on a stale snapshot). Use BEGIN IMMEDIATE.")
+    if tally.busy["busy_timeout"]:
+        longest = max(tally.lock_holds, default=0.0) * 1000
+        notes.append(f"{tally.busy['busy_timeout']} write(s) waited the full {settings.busy_timeout_ms} ms "
+                     f"busy_timeout ('database is locked'); the longest write-lock hold was {longest:.0f} ms. "
+                     "See the long_hold patterns for the transactions holding it.")
+    if tally.idle_with_lock:
+        notes.append(f"Sessions held the write lock for {tally.idle_with_lock:.1f}s in total while idle between "
+                     "operations. Commit after each write instead of batching a session's work.")
+    if tally.gave_up:
+        notes.append(f"{tally.gave_up} operation(s) still failed after {settings.retries} retries.")
+    return notes
+
+
+def compare(baseline, current, tolerance=REGRESSION_TOLERANCE):
+    """Returns (metric, old, new) for every latency or contention figure that got worse."""
+    import bench
+    regressions = [(f"{name} p95_ms", old, new) for name, old, new in bench.compare(baseline, current, tolerance)]
+    old_contention = baseline.get("contention", {})
+    new_contention = current["contention"]
+    for kind in set(old_contention.get("busy_per_1000_ops", {})) | set(new_contention["busy_per_1000_ops"]):
+        old = old_contention.get("busy_per_1000_ops", {}).get(kind, 0.0)
+        new = new_contention["busy_per_1000_ops"].get(kind, 0.0)
+        if new > old * (1 + tolerance) and new - old >= MIN_RATE_CHANGE:
+            regressions.append((f"{kind} per 1000 ops", old, new))
+    for metric in ("lock_wait", "lock_hold"):
+        old = old_contention.get(metric, {}).get("p95_ms")
+        new = new_contention[metric]["p95_ms"]
+        if old is not None and new > old * (1 + tolerance) and new - old > bench.MIN_REGRESSION_MS:
+            regressions.append((f"{metric} p95_ms", old, new))
+    old_rate = baseline.get("throughput", {}).get("ops_per_sec")
+    new_rate = current["throughput"]["ops_per_sec"]
+    if old_rate and new_rate < old_rate / (1 + tolerance):
+        regressions.append(("ops_per_sec", old_rate, new_rate))
+    return regressions
+
+
+def print_report(report):
+    meta, throughput, contention = report["meta"], report["throughput"], report["contention"]
+    actors = ", ".join(f"{n} {role}{'s' if n != 1 else ''}" for role, n in meta["actors"].items())
+    settings = meta["settings"]
+    print(f"{actors} in {meta['processes']} process(es), {meta['journal_mode']} journal, "
+          f"commit every {settings['commit_every']}, begin {settings['begin']}, "
+          f"busy_timeout {settings['busy_timeout_ms']} ms")
+    print(f"{throughput['seconds']:.1f}s, {throughput['ops']} ops, {throughput['ops_per_sec']:.0f} ops/s, "
+          f"{throughput['write_tx_per_sec']:.0f} write transactions/s")
+    print(f"{'operation':<24}{'count':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'errors':>8}")
+    for name, stats in report["results"].items():
+        print(f"{name:<24}{stats['calls']:>8}{stats['p50_ms']:>10.2f}{stats['p95_ms']:>10.2f}"
+              f"{stats['p99_ms']:>10.2f}{stats['errors']:>8}")
+    print(f"{'':<24}{'count':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+    for metric in ("lock_wait", "lock_hold", "commit"):
+        stats = contention[metric]
+        print(f"{metric:<24}{stats['count']:>8}{stats['p50_ms']:>10.2f}{stats['p95_ms']:>10.2f}"
+              f"{stats['p99_ms']:>10.2f}{stats['max_ms']:>10.2f}")
+    busy = ", ".join(f"{kind} {n}" for kind, n in contention["busy"].items()) or "none"
+    print(f"SQLITE_BUSY: {busy}; retries {contention['retries']}, gave up {contention['gave_up']}, "
+          f"lost uncommitted ops {contention['lost_ops']}")
+    for pattern, count in report["patterns"].items():
+        print(f"  {count:>6}  {pattern}")
+    for key, count in report["errors"].items():
+        print(f"  error {key}: {count}")
+    for note in report["findings"]:
+        print(f"- {note}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Stress concurrent db.py sessions and report lock contention.")
+    parser.add_argument("--doctors", type=int, default=4)
+    parser.add_argument("--patients", type=int, default=12)
+    parser.add_argument("--admins", type=int, default=1)
+    parser.add_argument("--processes", type=int, default=1, help="Worker processes the actors are spread over")
+    parser.add_argument("--duration", type=float, default=DEFAULT_DURATION, help="Seconds to run")
+    parser.add_argument("--think-ms", type=float, default=DEFAULT_THINK_MS,
+                        help="Mean pause between one actor's operations")
+    parser.add_argument("--commit-every", type=int, default=1, help="Operations per session transaction")
+    parser.add_argument("--begin", choices=("auto", "deferred", "immediate"), default="auto")
+    parser.add_argument("--busy-timeout", type=int, default=BUSY_TIMEOUT_MS, help="busy_timeout in ms")
+    parser.add_argument("--retries", type=int, default=DEFAULT_RETRIES, help="Retries after SQLITE_BUSY")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--in-place", action="store_true",
+                        help="Write to the database itself instead of a temporary copy")
+    parser.add_argument("--save", help="Write the report as JSON")
+    parser.add_argument("--compare", help="Fail if latency or contention is worse than in this report")
+    parser.add_argument("--tolerance", type=float, default=REGRESSION_TOLERANCE)
+    args = parser.parse_args()
+
+    database = DATABASE_NAME
+    workdir = None
+    if not args.in_place:
+        from backup import online_copy
+        workdir = tempfile.TemporaryDirectory(prefix="hms-stress-")
+        database = os.path.join(workdir.name, "stress.db")
+        online_copy(database, DATABASE_NAME)
+        # online_copy leaves the copy in DELETE mode; run it the way the live database runs
+        conn = sqlite3.connect(database)
+        conn.execute(f"PRAGMA journal_mode = {JOURNAL_MODE}")
+        conn.close()
+    try:
+        settings = Settings(database, args.duration, args.think_ms, max(1, args.commit_every), args.begin,
+                            args.busy_timeout, args.retries)
+        actors = cast(database, args.doctors, args.patients, args.admins, args.seed)
+        tally, elapsed = run(settings, actors, args.processes)
+        report = build_report(tally, settings, actors, args.processes, elapsed, database)
+    finally:
+        if workdir is not None:
+            workdir.cleanup()
+    print_report(report)
+
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Report written to {args.save}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(json.load(f), report, args.tolerance)
+        for metric, old, new in regressions:
+            print(f"REGRESSION {metric}: {old} -> {new}")
+        if regressions:
+            sys.exit(1)
+        print("No regressions against the baseline report.")
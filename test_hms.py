@@ -0,0 +1,188 @@
+import threading
+from datetime import date, timedelta
+
+import pytest
+
+import archive
+import connection
+import db
+import ledger
+import receivables
+import scheduling
+from indexes import check_query_plans
+from writer import GroupCommitWriter
+
+# Each test gets its own database file under tmp_path, brought up to the
+# latest schema by init_db(). Run with: python -m pytest -q
+
+
+@pytest.fixture
+def database(tmp_path, monkeypatch):
+    path = str(tmp_path / "hospital.db")
+    monkeypatch.setattr(connection, "DATABASE_NAME", path)
+    db.init_db()
+    yield path
+    scheduling.slot_index.invalidate()
+    connection.close_all()
+
+
+@pytest.fixture
+def conn(database):
+    conn = connection.connect(database)
+    yield conn
+    conn.close()
+
+
+def _doctor_and_patient(conn, specialization="Cardiology"):
+    doctor_id = db.add_user(conn, "Dr. Test", "doctor@example.com", "Passw0rd!", "doctor",
+                            specialization=specialization)
+    patient_id = db.add_user(conn, "Pat Test", "patient@example.com", "Passw0rd!", "patient",
+                             address="1 Main St", phone="555-0100")
+    conn.commit()
+    return doctor_id, patient_id
+
+
+def _next_weekday(weekday):
+    """The first date after today falling on weekday (0 = Monday)."""
+    day = date.today() + timedelta(days=1)
+    return day + timedelta(days=(weekday - day.weekday()) % 7)
+
+
+def test_every_lookup_uses_an_index(conn):
+    assert check_query_plans(conn) == []
+
+
+def test_writer_rolls_back_a_failing_write_alone(database, conn):
+    doctor_id, patient_id = _doctor_and_patient(conn)
+    callbacks = []
+
+    def failing(write_conn):
+        db.add_appointment(write_conn, "2030-01-01", doctor_id, patient_id)
+        write_conn.after_commit(lambda: callbacks.append("failing"))
+        raise ValueError("rejected")
+
+    writer = GroupCommitWriter(database, window_ms=50)
+    try:
+        futures = [writer.submit(db.add_appointment, "2030-01-02", doctor_id, patient_id) for _ in range(5)]
+        futures.insert(2, writer.submit(failing))
+        futures.append(writer.submit(db.add_appointment, "2030-01-03", doctor_id, patient_id))
+        with pytest.raises(ValueError):
+            futures[2].result()
+        ids = [f.result() for i, f in enumerate(futures) if i != 2]
+    finally:
+        writer.close()
+
+    stored = [row[0] for row in conn.execute("SELECT appointment_id FROM Appointment ORDER BY appointment_id")]
+    assert stored == sorted(ids)
+    assert not conn.execute("SELECT 1 FROM Appointment WHERE appointment_date = '2030-01-01'").fetchone()
+    assert callbacks == []
+    assert writer.writes == 7
+
+
+def test_only_one_of_two_racing_bookings_wins(database, conn):
+    doctor_id, patient_id = _doctor_and_patient(conn)
+    day = _next_weekday(0).isoformat()
+    scheduling.slot_index.load(conn)
+    barrier = threading.Barrier(2)
+    results = []
+
+    def book():
+        own = connection.connect(database)
+        try:
+            barrier.wait()
+            results.append(scheduling.book_slot(own, doctor_id, patient_id, day, "09:30"))
+            own.commit()
+        finally:
+            own.close()
+
+    threads = [threading.Thread(target=book) for _ in range(2)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert len(results) == 2 and results.count(None) == 1
+    assert conn.execute("SELECT COUNT(*) FROM Appointment WHERE doctor_id = ? AND appointment_date = ?",
+                        (doctor_id, day)).fetchone()[0] == 1
+    free = scheduling.find_free_slots(conn, "Cardiology", days=8, limit=100)
+    assert (day, "09:30") not in {(slot.date, slot.time) for slot in free}
+
+
+def test_a_cleared_day_stays_off_and_an_empty_week_means_not_working(conn):
+    doctor_id, _ = _doctor_and_patient(conn)
+    monday = _next_weekday(0).isoformat()
+    scheduling.slot_index.load(conn)
+    assert scheduling.slot_index.is_slot(doctor_id, monday, 9 * 60)
+
+    scheduling.clear_working_day(conn, doctor_id, 0)
+    conn.commit()
+    scheduling.slot_index.ensure_current(conn)
+    assert not scheduling.slot_index.is_slot(doctor_id, monday, 9 * 60)
+    assert scheduling.slot_index.is_slot(doctor_id, _next_weekday(1).isoformat(), 9 * 60)
+
+    for weekday in range(1, 5):
+        scheduling.clear_working_day(conn, doctor_id, weekday)
+    conn.commit()
+    scheduling.slot_index.ensure_current(conn)
+    assert scheduling.slot_index.hours[doctor_id] == {}
+    with pytest.raises(ValueError):
+        scheduling.book_slot(conn, doctor_id, doctor_id, monday, "09:00")
+
+
+def test_ledger_follows_bills_and_receipts(conn):
+    _, patient_id = _doctor_and_patient(conn)
+    bills = [db.add_billing(conn, amount, "2024-03-01", patient_id, "Consultation") for amount in (50.0, 20.0, 5.5)]
+    conn.commit()
+    assert db.add_receipt(conn, "2024-03-02", bills[0], "Card") is not None
+    conn.commit()
+    assert db.add_receipt(conn, "2024-03-03", bills[0], "Card") is None
+
+    balance = db.get_patient_balance(conn, patient_id)
+    assert (balance.billed_total, balance.paid_total, balance.outstanding, balance.open_bills) == (75.5, 50.0, 25.5, 2)
+    report = ledger.verify(conn)
+    assert report["bill_status_drift"] == report["patient_balance_drift"] == 0
+    assert report["totals_ok"]
+
+
+def test_archive_moves_old_rows_and_keeps_the_ledger_whole(conn, tmp_path):
+    doctor_id, patient_id = _doctor_and_patient(conn)
+    db.add_appointment(conn, "2019-05-01", doctor_id, patient_id)
+    db.add_medical_report(conn, "Annual check", "2019-05-01", patient_id, doctor_id)
+    old_bill = db.add_billing(conn, 30.0, "2019-05-01", patient_id, "Old visit")
+    unpaid = db.add_billing(conn, 12.0, "2019-06-01", patient_id, "Unpaid visit")
+    recent = db.add_billing(conn, 40.0, date.today().isoformat(), patient_id, "Recent visit")
+    db.add_receipt(conn, "2019-05-02", old_bill, "Cash")
+    conn.commit()
+
+    directory = str(tmp_path / "archive")
+    moved = archive.archive(conn, "2020-01-01", directory=directory)
+    assert moved == {"Appointment": 1, "MedicalReport": 1, "Billing": 1}
+    assert archive.archive_years(directory) == [2019]
+    remaining = {row[0] for row in conn.execute("SELECT bill_id FROM Billing")}
+    assert remaining == {unpaid, recent}
+    assert [bill[0] for bill in archive.archived_bills_by_patient(conn, patient_id, directory)] == [old_bill]
+
+    # Re-running finds nothing new, and the ledger still counts the archived bill
+    assert sum(archive.archive(conn, "2020-01-01", directory=directory).values()) == 0
+    report = ledger.verify(conn)
+    assert report["bill_status_drift"] == report["patient_balance_drift"] == 0
+    assert report["totals_ok"]
+
+
+@pytest.mark.parametrize("vectorized", [False, True])
+def test_receivables_ageing_skips_bills_with_bad_dates(conn, vectorized):
+    if vectorized and receivables.numpy is None:
+        pytest.skip("numpy is not installed")
+    _, patient_id = _doctor_and_patient(conn)
+    as_of = date(2024, 6, 30)
+    db.add_billing(conn, 100.0, (as_of - timedelta(days=10)).isoformat(), patient_id, "Recent")
+    db.add_billing(conn, 60.0, (as_of - timedelta(days=45)).isoformat(), patient_id, "Older")
+    db.add_billing(conn, 999.0, "05/01/2024", patient_id, "Entered by hand")
+    conn.commit()
+
+    ageing = receivables.age_receivables(conn, as_of, vectorized=vectorized)
+    assert (ageing.bills, ageing.skipped) == (2, 1)
+    [patient] = ageing.patients()
+    assert (patient.patient_id, patient.outstanding, patient.open_bills, patient.oldest_days) == (
+        patient_id, 160.0, 2, 45)
+    assert patient.amounts[:2] == (100.0, 60.0)
@@ -1,4 +1,5 @@
 from datetime import datetime
+from config import PAGE_SIZE
 
 def get_int_input(prompt):
     """Gets validated integer input from the user."""
@@ -25,4 +26,21 @@ def get_yes_no_input(prompt):
         choice = input(prompt + " (y/n): ").lower().strip()
         if choice in ['y', 'n']:
             return choice == 'y'
-        print("Invalid input. Please enter 'y' or 'n'.")
\ No newline at end of file
+        print("Invalid input. Please enter 'y' or 'n'.")
+
+def show_paged(rows, show_row, empty_message, page_size=PAGE_SIZE):
+    """Prints rows from an iterator one page at a time, asking before each next page."""
+    rows = iter(rows)
+    row = next(rows, None)
+    if row is None:
+        print(empty_message)
+        return
+
+    shown = 0
+    while row is not None:
+        show_row(row)
+        shown += 1
+        row = next(rows, None)
+        if row is not None and shown % page_size == 0:
+            if input("-- Press Enter for more, or 'q' to stop: ").strip().lower() == 'q':
+                return
\ No newline at end of file
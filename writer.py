@@ -0,0 +1,255 @@
+import argparse
+import os
+import queue
+import random
+import sqlite3
+import tempfile
+import threading
+import time
+from concurrent.futures import Future
+from config import (
+    DATABASE_NAME, GROUP_COMMIT_WINDOW_MS, GROUP_COMMIT_MAX_BATCH, GROUP_COMMIT_QUEUE_SIZE, JOURNAL_MODE
+)
+from connection import connect
+import db
+
+# Every commit is a WAL append (and, with synchronous=FULL or a rollback
+# journal, an fsync). The writer lets many callers share one commit: a single
+# thread owns the only write connection, drains whatever has queued up within
+# a short window, runs each write under its own SAVEPOINT and commits the lot.
+# Callers get their result only after that commit, so a returned row ID is
+# always durable; a failing write is rolled back alone and its caller gets
+# the exception.
+
+_STOP = object()
+
+
+class GroupCommitWriter:
+    """A single writer thread that batches submitted writes into shared transactions."""
+
+    def __init__(self, database=None, window_ms=GROUP_COMMIT_WINDOW_MS, max_batch=GROUP_COMMIT_MAX_BATCH,
+                 queue_size=GROUP_COMMIT_QUEUE_SIZE, on_connect=None):
+        self.database = database or DATABASE_NAME
+        self.on_connect = on_connect
+        self.window = window_ms / 1000
+        self.max_batch = max_batch
+        self._queue = queue.Queue(queue_size)
+        self._closed = False
+        self.batches = 0
+        self.writes = 0
+        self._thread = threading.Thread(target=self._run, name="hms-writer", daemon=True)
+        self._thread.start()
+
+    def submit(self, fn, *args):
+        """Queues fn(conn, *args). Returns a Future resolved with its result after the commit."""
+        if self._closed:
+            raise RuntimeError("The writer has been closed.")
+        future = Future()
+        self._queue.put((future, fn, args))
+        return future
+
+    def write(self, fn, *args):
+        """Runs fn(conn, *args) in the next group commit and waits for its result."""
+        return self.submit(fn, *args).result()
+
+    # Shortcuts for the high-volume inserts; each returns the new row's ID
+    def add_appointment(self, date, doctor_id, patient_id, time=None):
+        return self.write(db.add_appointment, date, doctor_id, patient_id, time)
+
+    def add_medical_report(self, details, date, patient_id, doctor_id):
+        return self.write(db.add_medical_report, details, date, patient_id, doctor_id)
+
+    def add_billing(self, amount, date, patient_id, details):
+        return self.write(db.add_billing, amount, date, patient_id, details)
+
+    def add_receipt(self, date, bill_id, payment_method):
+        return self.write(db.add_receipt, date, bill_id, payment_method)
+
+    def _collect(self):
+        """Blocks for one write, then gathers more until the window closes or the batch is full."""
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.window
+        while len(batch) < self.max_batch and batch[-1] is not _STOP:
+            remaining = deadline - time.monotonic()
+            try:
+                batch.append(self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        conn = connect(self.database)
+        if self.on_connect:
+            self.on_connect(conn)
+        try:
+            while True:
+                batch = self._collect()
+                stop = batch[-1] is _STOP
+                if stop:
+                    batch.pop()
+                if batch:
+                    self._commit(conn, batch)
+                if stop:
+                    break
+        finally:
+            conn.close()
+
+    def _commit(self, conn, batch):
+        if conn.in_transaction:
+            conn.commit()
+        results = []
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            for future, fn, args in batch:
+                if not future.set_running_or_notify_cancel():
+                    continue
+                conn.execute("SAVEPOINT write")
+                queued = len(conn._after_commit)
+                try:
+                    results.append((future, fn(conn, *args), None))
+                    conn.execute("RELEASE write")
+                except Exception as e:
+                    conn.execute("ROLLBACK TO write")
+                    conn.execute("RELEASE write")
+                    if len(conn._after_commit) > queued:
+                        # The rolled-back write's after_commit callbacks must not run either
+                        del conn._after_commit[queued:]
+                    results.append((future, None, e))
+            conn.commit()
+        except Exception as e:
+            # The whole batch is lost (e.g. the database stayed locked); fail every caller
+            if conn.in_transaction:
+                conn.rollback()
+            for future, _, _ in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        self.batches += 1
+        self.writes += len(results)
+        for future, result, error in results:
+            if error is None:
+                future.set_result(result)
+            else:
+                future.set_exception(error)
+
+    def close(self):
+        """Commits everything already queued, then stops the writer thread."""
+        if not self._closed:
+            self._closed = True
+            self._queue.put(_STOP)
+            self._thread.join()
+
+
+_writers = {}
+_writers_lock = threading.Lock()
+
+
+def get_writer(database=None):
+    """Returns the process-wide writer for a database file, starting it on first use."""
+    database = database or DATABASE_NAME
+    with _writers_lock:
+        writer = _writers.get(database)
+        if writer is None:
+            writer = _writers[database] = GroupCommitWriter(database)
+        return writer
+
+
+def close_writers():
+    """Flushes and stops every writer in this process."""
+    with _writers_lock:
+        writers = list(_writers.values())
+        _writers.clear()
+    for writer in writers:
+        writer.close()
+
+
+# --- Benchmark ---
+
+def _per_row_worker(database, rows, synchronous, latencies, inserted):
+    conn = connect(database)
+    conn.execute(f"PRAGMA synchronous = {synchronous}")
+    for doctor_id, patient_id in rows:
+        started = time.perf_counter()
+        inserted.append(db.add_appointment(conn, "2000-01-01", doctor_id, patient_id))
+        conn.commit()
+        latencies.append(time.perf_counter() - started)
+    conn.close()
+
+
+def _group_worker(writer, rows, latencies, inserted):
+    for doctor_id, patient_id in rows:
+        started = time.perf_counter()
+        inserted.append(writer.add_appointment("2000-01-01", doctor_id, patient_id))
+        latencies.append(time.perf_counter() - started)
+
+
+def benchmark(database=None, threads=16, rows_per_thread=200, synchronous="NORMAL", seed=7):
+    """Inserts the same appointments with per-row commits and through the writer.
+
+    Returns {mode: (writes/sec, latency summary)}. Without a database the
+    run uses a temporary copy of the configured one; with one, only the
+    appointments it inserted are deleted again afterwards.
+    """
+    if database is None:
+        from backup import online_copy
+        with tempfile.TemporaryDirectory(prefix="hms-writer-") as workdir:
+            copy = os.path.join(workdir, "writer.db")
+            online_copy(copy, DATABASE_NAME)
+            # online_copy leaves the copy in DELETE mode; run it the way the live database runs
+            conn = sqlite3.connect(copy)
+            conn.execute(f"PRAGMA journal_mode = {JOURNAL_MODE}")
+            conn.close()
+            return benchmark(copy, threads, rows_per_thread, synchronous, seed)
+
+    from bench import summarize
+
+    rng = random.Random(seed)
+    conn = connect(database)
+    doctors = [row[0] for row in conn.execute("SELECT doctor_id FROM Doctor LIMIT 100")]
+    patients = [row[0] for row in conn.execute("SELECT patient_id FROM Patient LIMIT 1000")]
+    if not doctors or not patients:
+        raise SystemExit("Need doctors and patients; run seed.py --generate first.")
+    work = [[(rng.choice(doctors), rng.choice(patients)) for _ in range(rows_per_thread)] for _ in range(threads)]
+
+    results = {}
+    inserted = []
+    for mode in ("per-row commit", "group commit"):
+        latencies = []
+        writer = None
+        if mode == "group commit":
+            writer = GroupCommitWriter(database, on_connect=lambda c: c.execute(f"PRAGMA synchronous = {synchronous}"))
+            targets = [threading.Thread(target=_group_worker, args=(writer, rows, latencies, inserted))
+                       for rows in work]
+        else:
+            targets = [threading.Thread(target=_per_row_worker,
+                                        args=(database, rows, synchronous, latencies, inserted))
+                       for rows in work]
+        started = time.perf_counter()
+        for t in targets:
+            t.start()
+        for t in targets:
+            t.join()
+        elapsed = time.perf_counter() - started
+        if writer:
+            writer.close()
+        results[mode] = (len(latencies) / elapsed, summarize(latencies))
+
+    conn.executemany("DELETE FROM Appointment WHERE appointment_id = ?", [(i,) for i in inserted])
+    conn.commit()
+    conn.close()
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark group commit against per-row commits.")
+    parser.add_argument("--threads", type=int, default=16)
+    parser.add_argument("--rows", type=int, default=200, help="Inserts per thread")
+    parser.add_argument("--synchronous", default="NORMAL", choices=["OFF", "NORMAL", "FULL"])
+    args = parser.parse_args()
+
+    db.init_db()
+    print(f"{args.threads} threads x {args.rows} appointment inserts, synchronous={args.synchronous}")
+    for mode, (rate, stats) in benchmark(threads=args.threads, rows_per_thread=args.rows,
+                                         synchronous=args.synchronous).items():
+        print(f"{mode:<16}{rate:>10.0f} writes/s   p50 {stats['p50_ms']:.2f} ms   p99 {stats['p99_ms']:.2f} ms")